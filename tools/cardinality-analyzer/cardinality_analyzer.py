@@ -0,0 +1,565 @@
+"""
+Cardinality and ingest cost of the series stored in VictoriaMetrics
+
+Reads the TSDB status and series counts of a local VictoriaMetrics for every
+scrape job of the config template, for the series pushed by each ingester
+and for the recorded and downsampled series computed from them, ranks
+metrics and labels by series count and churn, and links each metric back to
+the dashboards and alert rules that read it. The report is
+printed and the headline numbers are optionally pushed back as
+`cardinality_*` series so they can be graphed.
+
+Responses can be recorded with `--record` and analyzed later with
+`--replay`, which serves the recorded responses instead of querying
+VictoriaMetrics.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import requests
+import yaml
+from downsampling import AGGREGATES, RESOLUTIONS
+from grafana_queries import Selector, load_queries, selectors
+from victoria_exporter import Sample, VictoriaExporter
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+VICTORIA_METRICS_URL = os.getenv("VICTORIA_METRICS_URL", "http://localhost:9090")
+
+# Series computed from other series keep the labels of their inputs, job
+# included, they are told apart by their name instead. Tried first, their
+# names are excluded from every other scope.
+DERIVED = (
+    # Written by the downsampling worker of the node-rewards-ingester, hourly and daily
+    (
+        "downsampling",
+        f".+:({'|'.join(AGGREGATES)})_({'|'.join(RESOLUTIONS)})",
+        "1d",
+    ),
+    # level:metric:operations, written by vmalert every evaluation interval
+    ("recording-rules", ".+:.+:.+", None),
+)
+
+# Pushed series carry no job label, they are told apart by the ingester that
+# pushes them. The last scope takes the unlabelled series of no known ingester.
+INGESTERS = (
+    ("obs-github-ingester", "git_.*"),
+    ("cardinality-analyzer", "cardinality_.*"),
+    (
+        "node-rewards-ingester",
+        "nodes_count|total_(base|adjusted)_rewards_xdr_permyriad|performance_multiplier"
+        "|(original|relative|subnets)_failure_rate|governance_.*|days_since_governance_distribution"
+        "|node_rewards_(rollup|ingester)_.*",
+    ),
+    ("other", ".+"),
+)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "cardinality-analyzer",
+        description="Rank the metrics and labels stored in VictoriaMetrics by series count and churn",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--victoria-url",
+        dest="victoria_url",
+        default=VICTORIA_METRICS_URL,
+        help="Base url of VictoriaMetrics",
+    )
+
+    parser.add_argument(
+        "--template-path",
+        dest="template_path",
+        default="config/prometheus/config-template.yaml",
+        help="Scrape config template whose jobs are analyzed",
+    )
+
+    parser.add_argument(
+        "--dashboards-path",
+        dest="dashboards_path",
+        default="config/grafana/provisioning/dashboards",
+        help="Directory with the provisioned dashboards",
+    )
+
+    parser.add_argument(
+        "--alerts-path",
+        dest="alerts_path",
+        default="config/grafana/provisioning/alerting/alerts.yaml",
+        help="Alert rules file",
+    )
+
+    parser.add_argument(
+        "--date",
+        default=None,
+        help="Day to analyze as YYYY-MM-DD, today (UTC) by default. Churn is measured "
+        "against the series active now, growth against the day before",
+    )
+
+    parser.add_argument("--top", type=int, default=20, help="Metrics and labels per scope")
+
+    parser.add_argument(
+        "--drill-down",
+        dest="drill_down",
+        type=int,
+        default=5,
+        help="Top metrics per scope whose highest cardinality label is looked up",
+    )
+
+    parser.add_argument(
+        "--json-output",
+        dest="json_output",
+        default=None,
+        help="Also write the report as JSON to this path",
+    )
+
+    parser.add_argument(
+        "--push",
+        action="store_true",
+        help="Push the results as cardinality_* series to --victoria-url",
+    )
+
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0,
+        help="Seconds between runs, 0 runs once",
+    )
+
+    recording = parser.add_mutually_exclusive_group()
+    recording.add_argument(
+        "--record",
+        default=None,
+        help="Directory the responses of VictoriaMetrics are recorded to",
+    )
+    recording.add_argument(
+        "--replay",
+        default=None,
+        help="Directory with recorded responses served instead of querying VictoriaMetrics",
+    )
+
+    return parser.parse_args()
+
+
+class Scope(NamedTuple):
+    """A set of series, either the targets of a scrape job or the series of an ingester"""
+
+    kind: str
+    name: str
+    matchers: str
+    # Window a series needs a sample in to count as active, scraped series
+    # use the default lookback of instant queries
+    lookback: Optional[str] = None
+
+    @property
+    def selector(self) -> str:
+        return "{" + self.matchers + "}"
+
+    def metric_selector(self, metric: str) -> str:
+        return "{" + f'__name__="{metric}", ' + self.matchers + "}"
+
+
+def template_jobs(path: str) -> List[str]:
+    with open(path, "r") as f:
+        template = yaml.safe_load(f)
+    return [job["job_name"] for job in template["scrape_configs"]]
+
+
+def scopes(jobs: List[str]) -> List[Scope]:
+    """One scope per kind of derived series, per template job, for other jobs and per ingester"""
+    result = []
+    previous: List[str] = []
+    for name, pattern, lookback in DERIVED:
+        matchers = f'__name__=~"{pattern}"'
+        if previous:
+            matchers += f', __name__!~"{"|".join(previous)}"'
+        result.append(Scope("derived", name, matchers, lookback))
+        previous.append(pattern)
+    derived = f'__name__!~"{"|".join(previous)}"'
+
+    result.extend(Scope("job", job, f'job="{job}", {derived}') for job in jobs)
+    # Jobs not in the template, e.g. added by hand to the generated config
+    result.append(
+        Scope(
+            "job",
+            "other",
+            f'job!="", job!~"{"|".join(re.escape(job) for job in jobs)}", {derived}',
+        )
+    )
+
+    for ingester, pattern in INGESTERS:
+        matchers = f'__name__=~"{pattern}", job="", __name__!~"{"|".join(previous)}"'
+        # Ingesters push daily samples, not a sample every scrape interval
+        result.append(Scope("ingester", ingester, matchers, "1d"))
+        previous.append(pattern)
+    return result
+
+
+def _request_key(path: str, params: Dict[str, Any]) -> str:
+    canonical = json.dumps([path, sorted(params.items())], sort_keys=True)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+class VictoriaClient:
+    """Reads the JSON APIs of VictoriaMetrics"""
+
+    def __init__(self, victoria_url: str, timeout: float = 60):
+        self.victoria_url = victoria_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def get(self, path: str, params: Dict[str, Any]) -> Any:
+        response = self.session.get(
+            f"{self.victoria_url}/{path}", params=params, timeout=self.timeout
+        )
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get("status") != "success":
+            raise ValueError(f"{path} failed: {payload.get('error')}")
+        return payload["data"]
+
+
+class RecordingClient(VictoriaClient):
+    """Queries VictoriaMetrics and stores every response in `directory`"""
+
+    def __init__(self, victoria_url: str, directory: str, timeout: float = 60):
+        super().__init__(victoria_url, timeout)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, path: str, params: Dict[str, Any]) -> Any:
+        data = super().get(path, params)
+        file_path = os.path.join(self.directory, f"{_request_key(path, params)}.json")
+        with open(file_path, "w") as f:
+            json.dump({"path": path, "params": params, "data": data}, f)
+        return data
+
+
+class ReplayClient:
+    """Serves responses recorded by `RecordingClient`"""
+
+    def __init__(self, directory: str):
+        self.responses: Dict[str, Any] = {}
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(directory, name), "r") as f:
+                recorded = json.load(f)
+            self.responses[_request_key(recorded["path"], recorded["params"])] = recorded["data"]
+
+    def get(self, path: str, params: Dict[str, Any]) -> Any:
+        try:
+            return self.responses[_request_key(path, params)]
+        except KeyError:
+            raise ValueError(
+                f"No recorded response for {path} {params}, pass the --date of the recording"
+            ) from None
+
+
+def tsdb_status(client, match: str, date: str, top: int) -> Dict[str, Any]:
+    """Series counts of `date` by metric name, label and label value pair"""
+    return client.get(
+        "api/v1/status/tsdb", {"match[]": match, "date": date, "topN": str(top)}
+    )
+
+
+def active_series(client, match: str, lookback: Optional[str] = None) -> Dict[str, int]:
+    """Series per metric name with a sample within `lookback`, five minutes by default"""
+    if lookback:
+        match = f"last_over_time({match}[{lookback}]) keep_metric_names"
+    data = client.get("api/v1/query", {"query": f"count by (__name__) ({match})"})
+    return {
+        sample["metric"].get("__name__", ""): int(float(sample["value"][1]))
+        for sample in data["result"]
+    }
+
+
+def _counts(entries: Optional[List[Dict[str, Any]]]) -> Dict[str, int]:
+    return {entry["name"]: int(entry["value"]) for entry in entries or []}
+
+
+class MetricCost(NamedTuple):
+    name: str
+    series: int
+    previous: int
+    active: int
+    used_by: Tuple[str, ...]
+    top_label: Optional[str] = None
+    top_label_values: int = 0
+
+    @property
+    def churned(self) -> int:
+        """Series of the day that are no longer active"""
+        return max(0, self.series - self.active)
+
+    @property
+    def growth(self) -> int:
+        return self.series - self.previous
+
+
+class LabelCost(NamedTuple):
+    name: str
+    values: int
+    series: int
+
+
+class ScopeReport(NamedTuple):
+    scope: Scope
+    total_series: int
+    previous_series: int
+    active_series: int
+    metrics: List[MetricCost]
+    labels: List[LabelCost]
+
+    @property
+    def churned_series(self) -> int:
+        return max(0, self.total_series - self.active_series)
+
+    @property
+    def unused_series(self) -> int:
+        return sum(metric.series for metric in self.metrics if not metric.used_by)
+
+
+class Usage(NamedTuple):
+    selector: Selector
+    source: str
+
+
+def load_usages(dashboards_path: str, alerts_path: str) -> List[Usage]:
+    usages = []
+    for query in load_queries(dashboards_path, alerts_path):
+        source = os.path.basename(query.source)
+        for selector in selectors(query.expr):
+            usages.append(Usage(selector, source))
+    return usages
+
+
+def used_by(metric: str, scope: Scope, usages: List[Usage]) -> Tuple[str, ...]:
+    """Dashboards and alert files with a query that reads `metric` of `scope`"""
+    sources = set()
+    for selector, source in usages:
+        if selector.literal:
+            if selector.name != metric:
+                continue
+        elif re.fullmatch(selector.name, metric) is None:
+            continue
+        jobs = selector.label_values("job")
+        # Pushed series have no job label, a job matcher never selects them
+        if jobs is not None and (
+            scope.kind == "ingester" or (scope.kind == "job" and scope.name not in jobs)
+        ):
+            continue
+        sources.add(source)
+    return tuple(sorted(sources))
+
+
+def analyze_scope(
+    client, scope: Scope, date: str, top: int, drill_down: int, usages: List[Usage]
+) -> ScopeReport:
+    day = datetime.strptime(date, "%Y-%m-%d")
+    previous_date = (day - timedelta(days=1)).strftime("%Y-%m-%d")
+
+    status = tsdb_status(client, scope.selector, date, top)
+    previous = tsdb_status(client, scope.selector, previous_date, top)
+    active = active_series(client, scope.selector, scope.lookback)
+
+    series = _counts(status.get("seriesCountByMetricName"))
+    previous_series = _counts(previous.get("seriesCountByMetricName"))
+
+    metrics = []
+    ranked = sorted(series.items(), key=lambda item: (-item[1], item[0]))
+    for rank, (name, count) in enumerate(ranked):
+        top_label, top_label_values = None, 0
+        if rank < drill_down:
+            # The label with the most values is what drives the cardinality of a metric
+            metric_status = tsdb_status(client, scope.metric_selector(name), date, top)
+            label_values = _counts(metric_status.get("labelValueCountByLabelName"))
+            label_values.pop("__name__", None)
+            if label_values:
+                top_label, top_label_values = max(
+                    label_values.items(), key=lambda item: (item[1], item[0])
+                )
+        metrics.append(
+            MetricCost(
+                name,
+                count,
+                previous_series.get(name, 0),
+                active.get(name, 0),
+                used_by(name, scope, usages),
+                top_label,
+                top_label_values,
+            )
+        )
+
+    label_series = _counts(status.get("seriesCountByLabelName"))
+    labels = [
+        LabelCost(name, values, label_series.get(name, 0))
+        for name, values in _counts(status.get("labelValueCountByLabelName")).items()
+        if name != "__name__"
+    ]
+    labels.sort(key=lambda label: (-label.values, label.name))
+
+    return ScopeReport(
+        scope,
+        int(status.get("totalSeries", 0)),
+        int(previous.get("totalSeries", 0)),
+        sum(active.values()),
+        metrics,
+        labels[:top],
+    )
+
+
+def analyze(client, args: argparse.Namespace, date: str) -> List[ScopeReport]:
+    usages = load_usages(args.dashboards_path, args.alerts_path)
+    reports = [
+        analyze_scope(client, scope, date, args.top, args.drill_down, usages)
+        for scope in scopes(template_jobs(args.template_path))
+    ]
+    reports.sort(key=lambda report: -report.total_series)
+    return reports
+
+
+def format_report(reports: List[ScopeReport], date: str) -> str:
+    total = sum(report.total_series for report in reports)
+    lines = [f"Series stored on {date}: {total}"]
+    for report in reports:
+        if report.total_series == 0:
+            continue
+        share = report.total_series / total if total else 0
+        lines.append("")
+        lines.append(
+            f"{report.scope.kind} {report.scope.name}: {report.total_series} series ({share:.0%}), "
+            f"{report.active_series} active, {report.churned_series} churned, "
+            f"{report.total_series - report.previous_series:+} since the day before, "
+            f"{report.unused_series} in metrics no dashboard or alert reads"
+        )
+        lines.append(f"  {'series':>8} {'active':>8} {'churned':>8} {'growth':>8}  metric")
+        for metric in report.metrics:
+            details = []
+            if metric.top_label:
+                details.append(f"{metric.top_label} has {metric.top_label_values} values")
+            details.append("used by " + ", ".join(metric.used_by) if metric.used_by else "unused")
+            lines.append(
+                f"  {metric.series:>8} {metric.active:>8} {metric.churned:>8} {metric.growth:>+8}  "
+                f"{metric.name} ({'; '.join(details)})"
+            )
+        churning = sorted(
+            (metric for metric in report.metrics if metric.churned),
+            key=lambda metric: (-metric.churned, metric.name),
+        )
+        if churning:
+            lines.append("  highest churn: " + ", ".join(
+                f"{metric.name} {metric.churned}" for metric in churning[:5]
+            ))
+        if report.labels:
+            lines.append("  labels by values: " + ", ".join(
+                f"{label.name} {label.values} ({label.series} series)" for label in report.labels
+            ))
+    return "\n".join(lines)
+
+
+def report_json(reports: List[ScopeReport], date: str) -> Dict[str, Any]:
+    return {
+        "date": date,
+        "scopes": [
+            {
+                "kind": report.scope.kind,
+                "name": report.scope.name,
+                "series": report.total_series,
+                "previous_series": report.previous_series,
+                "active_series": report.active_series,
+                "churned_series": report.churned_series,
+                "unused_series": report.unused_series,
+                "metrics": [
+                    dict(metric._asdict(), churned=metric.churned, growth=metric.growth)
+                    for metric in report.metrics
+                ],
+                "labels": [label._asdict() for label in report.labels],
+            }
+            for report in reports
+        ],
+    }
+
+
+def report_samples(reports: List[ScopeReport], timestamp_ms: int) -> List[Sample]:
+    samples = []
+    for report in reports:
+        scope = {"scope_kind": report.scope.kind, "scope": report.scope.name}
+        samples.extend(
+            (
+                Sample("cardinality_scope_series", scope, report.total_series, timestamp_ms),
+                Sample("cardinality_scope_active_series", scope, report.active_series, timestamp_ms),
+                Sample("cardinality_scope_churned_series", scope, report.churned_series, timestamp_ms),
+                Sample("cardinality_scope_unused_series", scope, report.unused_series, timestamp_ms),
+            )
+        )
+        for metric in report.metrics:
+            labels = dict(scope, metric=metric.name, used=str(bool(metric.used_by)).lower())
+            samples.append(Sample("cardinality_metric_series", labels, metric.series, timestamp_ms))
+            samples.append(
+                Sample("cardinality_metric_churned_series", labels, metric.churned, timestamp_ms)
+            )
+        for label in report.labels:
+            labels = dict(scope, label=label.name)
+            samples.append(Sample("cardinality_label_values", labels, label.values, timestamp_ms))
+    samples.append(
+        Sample("cardinality_analyzer_last_success_timestamp_seconds", {}, timestamp_ms // 1000, timestamp_ms)
+    )
+    return samples
+
+
+def run(client, args: argparse.Namespace, exporter: Optional[VictoriaExporter]):
+    date = args.date or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    reports = analyze(client, args, date)
+
+    print(format_report(reports, date), flush=True)
+    if args.json_output:
+        with open(args.json_output, "w") as f:
+            json.dump(report_json(reports, date), f, indent=2)
+
+    if exporter is not None:
+        stats = exporter.push_samples(report_samples(reports, int(time.time() * 1000)))
+        logging.info(f"Pushed {stats.samples} cardinality samples")
+
+
+def main():
+    args = parse_args()
+
+    if args.replay:
+        client = ReplayClient(args.replay)
+    elif args.record:
+        client = RecordingClient(args.victoria_url, args.record)
+    else:
+        client = VictoriaClient(args.victoria_url)
+
+    exporter = VictoriaExporter(args.victoria_url, pool_maxsize=1) if args.push else None
+
+    while True:
+        try:
+            run(client, args, exporter)
+        except (OSError, ValueError, KeyError, requests.RequestException) as e:
+            if not args.interval:
+                sys.exit(f"Analysis failed: {e}")
+            logging.error("Analysis failed: %s", e)
+
+        if not args.interval:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Compares the export formats of the VictoriaMetrics exporter
+
+Synthetic samples shaped like the node rewards metrics (one sample per series
+per day) are rendered with every format and compression. When a
+VictoriaMetrics url is given the samples are also pushed and the ingest time
+is measured, otherwise only rendering is benchmarked.
+"""
+
+import argparse
+import random
+import time
+
+from victoria_exporter import (
+    EXPORT_FORMATS,
+    SUPPORTED_COMPRESSIONS,
+    ImportStats,
+    Sample,
+    VictoriaExporter,
+)
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "benchmark-exporter",
+        description="Compare bytes on the wire and ingest time of the export formats",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--series", type=int, default=20000, help="Number of distinct series"
+    )
+    parser.add_argument(
+        "--days", type=int, default=5, help="Number of daily samples per series"
+    )
+    parser.add_argument(
+        "--victoria-url",
+        dest="victoria_url",
+        default=None,
+        help="Push the samples to this VictoriaMetrics to measure ingest time",
+    )
+    parser.add_argument(
+        "--metric-prefix",
+        dest="metric_prefix",
+        default="exporter_benchmark_",
+        help="Prefix of the generated metric names",
+    )
+
+    return parser.parse_args()
+
+
+def generate_samples(series: int, days: int, prefix: str):
+    rng = random.Random(42)
+    start_ms = int(time.time() // 86400 - days) * DAY_MS
+    samples = []
+    for day in range(days):
+        ts = start_ms + day * DAY_MS
+        for i in range(series):
+            samples.append(
+                Sample(
+                    f"{prefix}performance_multiplier",
+                    {
+                        "canister_id": "sgymv-uiaaa-aaaaa-aaaia-cai",
+                        "provider_id": f"provider-{i % 500:04d}",
+                        "node_id": f"node-{i:06d}",
+                    },
+                    rng.random(),
+                    ts,
+                )
+            )
+    return samples
+
+
+def run(exporter: VictoriaExporter, samples, push: bool):
+    started = time.perf_counter()
+    if push:
+        stats = exporter.push_samples(samples)
+    else:
+        stats = ImportStats()
+        for _ in exporter.body(samples, stats):
+            pass
+    return stats, time.perf_counter() - started
+
+
+def main():
+    args = parse_args()
+    samples = generate_samples(args.series, args.days, args.metric_prefix)
+    push = args.victoria_url is not None
+    url = args.victoria_url or "http://localhost:9090"
+
+    print(f"{len(samples)} samples, {args.series} series x {args.days} days")
+    print(
+        f"{'format':<12}{'compression':<13}{'lines':>10}{'raw bytes':>14}{'wire bytes':>14}{'seconds':>10}"
+    )
+    for export_format in EXPORT_FORMATS:
+        for compression in SUPPORTED_COMPRESSIONS:
+            exporter = VictoriaExporter(
+                url, export_format=export_format, compression=compression, timeout=300
+            )
+            stats, elapsed = run(exporter, samples, push)
+            exporter.close()
+            print(
+                f"{export_format:<12}{compression:<13}{stats.lines:>10}"
+                f"{stats.raw_bytes:>14}{stats.sent_bytes:>14}{elapsed:>10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
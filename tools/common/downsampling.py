@@ -0,0 +1,335 @@
+"""
+Downsampled long-term series computed from raw VictoriaMetrics series
+
+Long-range panels over a year of raw 30s samples are slow. The worker reads
+the raw series of selected metrics once per closed hourly or daily window
+and writes their min, max, avg and last value back as new series, named
+`<metric>:<aggregate>_<resolution>`, e.g. `power_average_watts:max_1h`. The
+labels of the raw series are kept and every downsampled sample is stamped
+with the end of its window, the way recording rules stamp their results.
+
+A watermark per metric and resolution is persisted after every push, so a
+window is computed only once, also across restarts. Windows are only
+computed once they are `settle_seconds` old, late samples after that are
+not reflected. Without a watermark the worker starts `backfill_days` back
+and catches up in steps of at most `max_windows_per_run` windows.
+"""
+
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import requests
+
+from victoria_exporter import Sample
+
+logger = logging.getLogger(__name__)
+
+RESOLUTIONS = {"1h": 3600, "1d": 86400}
+AGGREGATES = ("min", "max", "avg", "last")
+# Upper bound of points VictoriaMetrics returns per series and query, see -search.maxPointsPerTimeseries
+MAX_WINDOWS_PER_QUERY = 1000
+
+WATERMARKS_FORMAT_VERSION = 1
+
+_METRIC_NAME = re.compile(r"^[a-zA-Z_:][a-zA-Z0-9_:]*$")
+
+
+class DownsampleSpec(NamedTuple):
+    """A raw metric to downsample, windows are computed once they are `settle_seconds` old"""
+
+    metric: str
+    resolutions: Tuple[str, ...] = ("1h", "1d")
+    settle_seconds: float = 900
+
+
+DEFAULT_SPECS = [
+    DownsampleSpec("power_average_watts"),
+    DownsampleSpec("power_instantaneous_watts"),
+]
+
+
+def load_specs(config: Optional[str] = None) -> List[DownsampleSpec]:
+    """
+    Parse the DOWNSAMPLE_METRICS configuration, a JSON list of objects, e.g.
+
+        [{"metric": "power_average_watts"},
+         {"metric": "nodes_count", "resolutions": ["1d"], "settle_seconds": 172800}]
+
+    The power usage metrics are downsampled when nothing is configured.
+    """
+    if config is None:
+        config = os.environ.get("DOWNSAMPLE_METRICS", "")
+    if not config.strip():
+        return list(DEFAULT_SPECS)
+
+    specs = []
+    for entry in json.loads(config):
+        if "resolutions" in entry:
+            entry = {**entry, "resolutions": tuple(entry["resolutions"])}
+        spec = DownsampleSpec(**entry)
+        if not _METRIC_NAME.match(spec.metric):
+            raise ValueError(f"Invalid metric name in DOWNSAMPLE_METRICS: {spec.metric!r}")
+        unknown = [resolution for resolution in spec.resolutions if resolution not in RESOLUTIONS]
+        if unknown:
+            raise ValueError(
+                f"Unsupported resolutions {unknown} for {spec.metric}, use {list(RESOLUTIONS)}"
+            )
+        specs.append(spec)
+    return specs
+
+
+def series_name(metric: str, aggregate: str, resolution: str) -> str:
+    return f"{metric}:{aggregate}_{resolution}"
+
+
+class Watermarks:
+    """
+    End of the last downsampled window per metric and resolution, persisted as a single JSON file
+
+    Args:
+        path: File the watermarks are stored in, kept in memory only when empty
+    """
+
+    def __init__(self, path: str = ""):
+        self.path = path
+        self._lock = threading.Lock()
+        self._watermarks: Dict[str, int] = self._load()
+
+    @staticmethod
+    def key(metric: str, resolution: str) -> str:
+        return f"{metric}:{resolution}"
+
+    def _load(self) -> Dict[str, int]:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Starting without watermarks, {self.path} is unreadable: {e}")
+            return {}
+        if stored.get("version") != WATERMARKS_FORMAT_VERSION:
+            logger.info(f"Starting without watermarks, {self.path} has an outdated format")
+            return {}
+        return stored.get("watermarks", {})
+
+    def _save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file first so that a crash never leaves partial watermarks
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".downsample.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"version": WATERMARKS_FORMAT_VERSION, "watermarks": self._watermarks},
+                    f,
+                    indent=1,
+                    sort_keys=True,
+                )
+            os.replace(tmp_path, self.path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def get(self, metric: str, resolution: str) -> Optional[int]:
+        with self._lock:
+            return self._watermarks.get(self.key(metric, resolution))
+
+    def advance(self, metric: str, resolution: str, end: int):
+        with self._lock:
+            self._watermarks[self.key(metric, resolution)] = end
+            self._save()
+
+
+def pending_windows(
+    watermark: Optional[int], resolution: int, now: float, settle_seconds: float, backfill_days: int
+) -> Tuple[int, int]:
+    """
+    First and last end of the windows that are due, in seconds
+
+    Windows are aligned to multiples of the resolution since the epoch, i.e.
+    whole UTC hours and days. The range is empty when first > last.
+    """
+    last = int(now - settle_seconds) // resolution * resolution
+    if watermark is None:
+        first = (int(now) - backfill_days * 86400) // resolution * resolution + resolution
+    else:
+        first = watermark + resolution
+    return first, last
+
+
+class DownsampleWorker:
+    """
+    Computes due windows of every spec and pushes them through `push`
+
+    Args:
+        victoria_url: VictoriaMetrics to read the raw series from
+        push: Writes a batch of samples, e.g. an exporter behind the ingester limits
+        specs: Metrics to downsample
+        watermarks: Progress of every metric and resolution
+        backfill_days: How far back a metric without watermark starts
+        max_windows_per_run: Upper bound of windows per metric and resolution and run
+        timeout: Timeout of a single query
+        registry: Optional instrumentation registry
+    """
+
+    def __init__(
+        self,
+        victoria_url: str,
+        push: Callable[[List[Sample]], object],
+        specs: List[DownsampleSpec],
+        watermarks: Watermarks,
+        backfill_days: int = 30,
+        max_windows_per_run: int = 24 * 31,
+        timeout: float = 120,
+        registry=None,
+    ):
+        self.victoria_url = victoria_url.rstrip("/")
+        self.push = push
+        self.specs = specs
+        self.watermarks = watermarks
+        self.backfill_days = backfill_days
+        self.max_windows_per_run = max(1, max_windows_per_run)
+        self.timeout = timeout
+        self.registry = registry
+        self.session = requests.Session()
+        self._worker: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def query_windows(
+        self, metric: str, aggregate: str, resolution: str, first: int, last: int
+    ) -> Iterator[Sample]:
+        """Aggregate of every series over the windows ending from `first` to `last`"""
+        seconds = RESOLUTIONS[resolution]
+        # `[1h]` covers (t - 1h, t], shifting it by 1ms covers the window [t - 1h, t) instead
+        query = f"{aggregate}_over_time({metric}[{resolution}] offset 1ms)"
+        response = self.session.get(
+            f"{self.victoria_url}/api/v1/query_range",
+            params={
+                "query": query,
+                "start": first,
+                "end": last,
+                "step": f"{seconds}s",
+                "nocache": "1",
+            },
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        name = series_name(metric, aggregate, resolution)
+        for series in response.json()["data"]["result"]:
+            labels = {key: value for key, value in series["metric"].items() if key != "__name__"}
+            for timestamp, value in series["values"]:
+                yield Sample(name, labels, float(value), int(timestamp) * 1000)
+
+    def downsample(self, spec: DownsampleSpec, resolution: str, now: float) -> int:
+        """Push the due windows of one metric and resolution, returns the windows left for later runs"""
+        seconds = RESOLUTIONS[resolution]
+        first, last = pending_windows(
+            self.watermarks.get(spec.metric, resolution),
+            seconds,
+            now,
+            spec.settle_seconds,
+            self.backfill_days,
+        )
+        if first > last:
+            return 0
+        due = (last - first) // seconds + 1
+        end = min(last, first + (self.max_windows_per_run - 1) * seconds)
+
+        chunk_start = first
+        while chunk_start <= end:
+            chunk_end = min(end, chunk_start + (MAX_WINDOWS_PER_QUERY - 1) * seconds)
+            started = time.perf_counter()
+            samples = []
+            for aggregate in AGGREGATES:
+                samples.extend(
+                    self.query_windows(spec.metric, aggregate, resolution, chunk_start, chunk_end)
+                )
+            if samples:
+                self.push(samples)
+            # Only advanced once the windows are written, a failed push recomputes them
+            self.watermarks.advance(spec.metric, resolution, chunk_end)
+
+            windows = (chunk_end - chunk_start) // seconds + 1
+            self._observe(spec.metric, resolution, windows, len(samples), started, now, chunk_end)
+            logger.info(
+                f"Downsampled {windows} {resolution} windows of {spec.metric} "
+                f"up to {time.strftime('%Y-%m-%d %H:%M', time.gmtime(chunk_end))} UTC "
+                f"({len(samples)} samples)"
+            )
+            chunk_start = chunk_end + seconds
+
+        return due - ((end - first) // seconds + 1)
+
+    def run_once(self, now: Optional[float] = None) -> int:
+        """Downsample the due windows of every spec, returns the windows left for later runs"""
+        now = time.time() if now is None else now
+        left = 0
+        for spec in self.specs:
+            for resolution in spec.resolutions:
+                try:
+                    left += self.downsample(spec, resolution, now)
+                except Exception as e:
+                    self._inc("downsample_errors_total", metric=spec.metric, resolution=resolution)
+                    logger.warning(f"Downsampling {spec.metric} to {resolution} failed: {e}")
+        return left
+
+    def start(self, interval: float = 300):
+        """Run every `interval` seconds from a daemon thread, immediately again while catching up"""
+
+        def run():
+            wait = 0.0
+            while not self._stop.wait(wait):
+                try:
+                    left = self.run_once()
+                except Exception as e:
+                    logger.error(f"Error in downsampling loop: {e}", exc_info=True)
+                    left = 0
+                wait = 1.0 if left else interval
+
+        self._worker = threading.Thread(target=run, daemon=True, name="downsampler")
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join()
+
+    def _inc(self, name: str, amount: float = 1, **labels):
+        if self.registry is not None:
+            self.registry.inc(name, amount, **labels)
+
+    def _observe(
+        self,
+        metric: str,
+        resolution: str,
+        windows: int,
+        samples: int,
+        started: float,
+        now: float,
+        watermark: int,
+    ):
+        if self.registry is None:
+            return
+        self.registry.inc("downsample_windows_total", windows, resolution=resolution)
+        self.registry.inc("downsample_samples_total", samples, resolution=resolution)
+        self.registry.observe(
+            "stage_duration_seconds",
+            time.perf_counter() - started,
+            stage="downsample",
+            resolution=resolution,
+        )
+        self.registry.set(
+            "downsample_lag_seconds", now - watermark, metric=metric, resolution=resolution
+        )
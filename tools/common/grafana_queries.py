@@ -0,0 +1,292 @@
+"""
+PromQL queries of the provisioned Grafana dashboards and alert rules
+
+Walks dashboard JSON files (panels, nested rows and template variables) and
+the alert rule provisioning file, and extracts the metric selectors each
+query uses. This is a tokenizer, not a full PromQL parser: it only needs to
+tell metric names apart from functions, keywords, label matchers, grouping
+labels, durations and Grafana template variables.
+"""
+
+import glob
+import json
+import os
+import re
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import yaml
+
+# Identifiers that are never metric names when they are not followed by `(`
+KEYWORDS = frozenset(
+    (
+        "and",
+        "or",
+        "unless",
+        "by",
+        "without",
+        "on",
+        "ignoring",
+        "group_left",
+        "group_right",
+        "bool",
+        "offset",
+        "inf",
+        "nan",
+    )
+)
+# Aggregation operators, they may be followed by `by (...)` instead of `(`
+AGGREGATIONS = frozenset(
+    (
+        "sum",
+        "min",
+        "max",
+        "avg",
+        "group",
+        "stddev",
+        "stdvar",
+        "count",
+        "count_values",
+        "bottomk",
+        "topk",
+        "quantile",
+    )
+)
+# Keywords followed by a parenthesized list of label names
+LABEL_LIST_KEYWORDS = frozenset(("by", "without", "on", "ignoring", "group_left", "group_right"))
+
+_IDENTIFIER = re.compile(r"[a-zA-Z_:][a-zA-Z0-9_:]*")
+_MATCHER = re.compile(r"""\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!~|!=|=)\s*("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|`[^`]*`)\s*,?""")
+_LABEL_VALUES = re.compile(r"^\s*label_values\s*\((.*),\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*\)\s*$", re.S)
+_QUERY_RESULT = re.compile(r"^\s*query_result\s*\((.*)\)\s*$", re.S)
+
+
+class Selector(NamedTuple):
+    """A metric selector, `name` is a regex when `literal` is False"""
+
+    name: str
+    literal: bool
+    matchers: Tuple[Tuple[str, str, str], ...]
+
+    def label_values(self, label: str) -> Optional[List[str]]:
+        """Values an equality or simple alternation matcher on `label` allows, None if unrestricted"""
+        for name, op, value in self.matchers:
+            if name != label or "$" in value or "[[" in value:
+                continue
+            if op == "=":
+                return [value]
+            if op == "=~" and re.fullmatch(r"[a-zA-Z0-9_:.-]+(\|[a-zA-Z0-9_:.-]+)*", value):
+                return value.split("|")
+        return None
+
+
+class Query(NamedTuple):
+    """A PromQL expression and where it is used"""
+
+    source: str
+    kind: str
+    title: str
+    expr: str
+    panel_id: Optional[int] = None
+    ref_id: Optional[str] = None
+
+
+def _unquote(value: str) -> str:
+    if value[0] == "`":
+        return value[1:-1]
+    return re.sub(r"\\(.)", r"\1", value[1:-1])
+
+
+def _skip_string(expr: str, pos: int) -> int:
+    quote = expr[pos]
+    pos += 1
+    while pos < len(expr) and expr[pos] != quote:
+        pos += 2 if expr[pos] == "\\" and quote != "`" else 1
+    return pos + 1
+
+
+def _skip_group(expr: str, pos: int, opening: str, closing: str) -> int:
+    """Position after the bracket closing the one at `pos`, strings are skipped"""
+    depth = 0
+    while pos < len(expr):
+        char = expr[pos]
+        if char in "\"'`":
+            pos = _skip_string(expr, pos)
+            continue
+        if char == opening:
+            depth += 1
+        elif char == closing:
+            depth -= 1
+            if depth == 0:
+                return pos + 1
+        pos += 1
+    return pos
+
+
+def _parse_matchers(block: str) -> List[Tuple[str, str, str]]:
+    matchers = []
+    pos = 0
+    while pos < len(block):
+        match = _MATCHER.match(block, pos)
+        if match is None:
+            break
+        matchers.append((match.group(1), match.group(2), _unquote(match.group(3))))
+        pos = match.end()
+    return matchers
+
+
+def selectors(expr: str) -> List[Selector]:
+    """Metric selectors of a PromQL expression, in order of appearance"""
+    found: List[Selector] = []
+    pos = 0
+    length = len(expr)
+    while pos < length:
+        char = expr[pos]
+
+        if char in "\"'`":
+            pos = _skip_string(expr, pos)
+        elif char == "[":
+            # Range durations, subqueries and Grafana [[variables]]
+            pos = _skip_group(expr, pos, "[", "]")
+        elif char == "$":
+            # Grafana variables: $var, ${var} and ${var:format}
+            if expr.startswith("${", pos):
+                pos = expr.find("}", pos) + 1 or length
+            else:
+                match = _IDENTIFIER.match(expr, pos + 1)
+                pos = match.end() if match else pos + 1
+        elif char == "{":
+            # Selector without a metric name, e.g. {__name__=~"node_.*"}
+            end = _skip_group(expr, pos, "{", "}")
+            found.extend(_nameless_selector(_parse_matchers(expr[pos + 1 : end - 1])))
+            pos = end
+        elif char.isdigit() or (char == "." and pos + 1 < length and expr[pos + 1].isdigit()):
+            # Numbers and durations such as 5m or 1.5e3
+            match = re.compile(r"[0-9.]+(e[+-]?[0-9]+)?[a-zA-Z]*").match(expr, pos)
+            pos = match.end()
+        elif _IDENTIFIER.match(expr, pos):
+            match = _IDENTIFIER.match(expr, pos)
+            name = match.group(0)
+            pos = match.end()
+
+            rest = pos
+            while rest < length and expr[rest].isspace():
+                rest += 1
+            following = expr[rest] if rest < length else ""
+
+            if name in LABEL_LIST_KEYWORDS:
+                if following == "(":
+                    pos = _skip_group(expr, rest, "(", ")")
+            elif following == "(" or name.lower() in KEYWORDS or name in AGGREGATIONS:
+                # Functions and aggregations
+                continue
+            else:
+                matchers: List[Tuple[str, str, str]] = []
+                if following == "{":
+                    end = _skip_group(expr, rest, "{", "}")
+                    matchers = _parse_matchers(expr[rest + 1 : end - 1])
+                    pos = end
+                found.append(Selector(name, True, tuple(matchers)))
+        else:
+            pos += 1
+    return found
+
+
+def _nameless_selector(matchers: List[Tuple[str, str, str]]) -> List[Selector]:
+    rest = tuple(m for m in matchers if m[0] != "__name__")
+    for label, op, value in matchers:
+        if label == "__name__" and op == "=":
+            return [Selector(value, True, rest)]
+        if label == "__name__" and op == "=~":
+            return [Selector(value, False, rest)]
+    return []
+
+
+def metric_names(expr: str) -> Set[str]:
+    """Literal metric names an expression reads"""
+    return {selector.name for selector in selectors(expr) if selector.literal}
+
+
+def variable_promql(query: Any) -> Optional[str]:
+    """PromQL part of a Grafana template variable query, None if it has none"""
+    if isinstance(query, dict):
+        query = query.get("query")
+    if not isinstance(query, str) or not query.strip():
+        return None
+    match = _LABEL_VALUES.match(query)
+    if match:
+        return match.group(1)
+    match = _QUERY_RESULT.match(query)
+    if match:
+        return match.group(1)
+    if re.match(r"^\s*(label_values|label_names|metrics)\s*\(", query):
+        return None
+    return query
+
+
+def _panels(panels: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    for panel in panels:
+        yield panel
+        # Collapsed rows keep their panels nested
+        yield from _panels(panel.get("panels", []))
+
+
+def panel_targets(dashboard: Dict[str, Any]) -> Iterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """Every panel and PromQL target pair of a parsed dashboard"""
+    for panel in _panels(dashboard.get("panels", [])):
+        for target in panel.get("targets", []):
+            expr = target.get("expr")
+            if isinstance(expr, str) and expr.strip():
+                yield panel, target
+
+
+def dashboard_queries(path: str) -> Iterator[Query]:
+    """Panel target and template variable queries of a dashboard JSON file"""
+    with open(path, "r") as f:
+        dashboard = json.load(f)
+
+    for panel, target in panel_targets(dashboard):
+        yield Query(
+            path,
+            "panel",
+            panel.get("title", ""),
+            target["expr"],
+            panel.get("id"),
+            target.get("refId"),
+        )
+
+    for variable in dashboard.get("templating", {}).get("list", []):
+        if variable.get("type") != "query":
+            continue
+        expr = variable_promql(variable.get("query")) or variable_promql(variable.get("definition"))
+        if expr:
+            yield Query(path, "variable", variable.get("name", ""), expr)
+
+
+def alert_queries(path: str) -> Iterator[Query]:
+    """Data source queries of a Grafana alert rule provisioning file"""
+    with open(path, "r") as f:
+        provisioning = yaml.safe_load(f) or {}
+
+    for group in provisioning.get("groups", []):
+        for rule in group.get("rules", []):
+            for data in rule.get("data", []):
+                if data.get("datasourceUid") == "__expr__":
+                    continue
+                expr = data.get("model", {}).get("expr")
+                if isinstance(expr, str) and expr.strip():
+                    yield Query(path, "alert", rule.get("title", ""), expr, None, data.get("refId"))
+
+
+def dashboard_files(dashboards_dir: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(dashboards_dir, "**", "*.json"), recursive=True))
+
+
+def load_queries(dashboards_dir: Optional[str], alerts_path: Optional[str]) -> List[Query]:
+    """Every query of all dashboards below `dashboards_dir` and of `alerts_path`"""
+    queries: List[Query] = []
+    if dashboards_dir:
+        for path in dashboard_files(dashboards_dir):
+            queries.extend(dashboard_queries(path))
+    if alerts_path and os.path.exists(alerts_path):
+        queries.extend(alert_queries(alerts_path))
+    return queries
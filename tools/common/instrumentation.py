@@ -0,0 +1,154 @@
+"""
+Minimal self-instrumentation for the ingesters
+
+Counters, gauges and histograms are kept in a thread-safe registry and
+exported as exporter samples, so they can be pushed together with the
+ingested data, or scraped from an optional local `/metrics` endpoint.
+"""
+
+import contextlib
+import logging
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from victoria_exporter import Sample, format_prometheus_line
+
+logger = logging.getLogger(__name__)
+
+# Seconds, covers everything from a local render to a stalled canister query
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Bytes, from a handful of samples to a multi-day backfill batch
+SIZE_BUCKETS = tuple(4**i * 1024 for i in range(10))
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """
+    Thread-safe collection of metrics
+
+    Args:
+        prefix: Prepended to every metric name
+        labels: Constant labels added to every sample
+    """
+
+    def __init__(self, prefix: str, **labels: str):
+        self.prefix = prefix
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._gauges: Dict[Tuple[str, LabelKey], float] = {}
+        self._histograms: Dict[Tuple[str, LabelKey], Histogram] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, str]) -> Tuple[str, LabelKey]:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, buckets=DEFAULT_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def time(self, stage: str, **labels):
+        """Observe the duration of the block in `stage_duration_seconds`"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(
+                "stage_duration_seconds",
+                time.perf_counter() - started,
+                stage=stage,
+                **labels,
+            )
+
+    def samples(self, timestamp_ms: Optional[int] = None) -> List[Sample]:
+        """Snapshot of all metrics as exporter samples"""
+        if timestamp_ms is None:
+            timestamp_ms = int(time.time() * 1000)
+
+        def sample(name, labels, value, **extra):
+            return Sample(
+                f"{self.prefix}{name}",
+                {**self.labels, **dict(labels), **extra},
+                value,
+                timestamp_ms,
+            )
+
+        result = []
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                result.append(sample(name, labels, value))
+            for (name, labels), value in self._gauges.items():
+                result.append(sample(name, labels, value))
+            for (name, labels), histogram in self._histograms.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    result.append(sample(f"{name}_bucket", labels, cumulative, le=str(bound)))
+                result.append(sample(f"{name}_bucket", labels, histogram.count, le="+Inf"))
+                result.append(sample(f"{name}_sum", labels, histogram.sum))
+                result.append(sample(f"{name}_count", labels, histogram.count))
+        return result
+
+    def serve(self, port: int, host: str = "") -> ThreadingHTTPServer:
+        """Expose the metrics in Prometheus text format on http://host:port/metrics"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = "".join(
+                    # Scrapers assign their own timestamps
+                    format_prometheus_line(sample).rsplit(" ", 1)[0] + "\n"
+                    for sample in registry.samples()
+                ).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+        logger.info(f"Serving self metrics on port {port}")
+        return server
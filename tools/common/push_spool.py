@@ -0,0 +1,223 @@
+"""
+Durable on-disk spool for samples that could not be pushed
+
+Batches that fail to reach VictoriaMetrics are appended as JSON lines to
+segment files instead of being dropped. A background flusher replays the
+segments oldest first, in batches, once VictoriaMetrics accepts imports
+again, and deletes every segment that was fully pushed. A batch that is
+rejected permanently, e.g. with a 400, is dropped so that it does not
+block the batches spooled after it.
+
+The spool is bounded in size, when it grows beyond `max_bytes` the oldest
+segments are evicted. A segment that fails halfway is replayed from its
+start on the next attempt; samples carry their own timestamps so the
+duplicates are collapsed by VictoriaMetrics deduplication.
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from resilience import CircuitOpenError, ErrorKind, classify
+from victoria_exporter import Sample
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".seg"
+
+
+class PushSpool:
+    """
+    Append-only spool of sample batches split into segment files
+
+    Args:
+        directory: Where the segments are stored, created if missing
+        max_bytes: Upper bound of all segments together
+        segment_max_bytes: A new segment is started once the current one is larger
+        batch_samples: Upper bound of samples replayed in a single push
+        registry: Optional instrumentation registry
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 256 * 1024**2,
+        segment_max_bytes: int = 8 * 1024**2,
+        batch_samples: int = 50000,
+        registry=None,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_max_bytes = segment_max_bytes
+        self.batch_samples = batch_samples
+        self.registry = registry
+        self._lock = threading.Lock()
+        # Segments being replayed are sealed, appends go to a new segment
+        self._sealed = ""
+        self._flush_lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+
+    def _segments(self) -> List[str]:
+        """Segment paths, oldest first"""
+        names = sorted(
+            name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX)
+        )
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _next_segment(self, segments: List[str]) -> str:
+        last = int(os.path.basename(segments[-1])[: -len(SEGMENT_SUFFIX)]) if segments else 0
+        return os.path.join(self.directory, f"{last + 1:020d}{SEGMENT_SUFFIX}")
+
+    def size(self) -> int:
+        return sum(os.path.getsize(path) for path in self._segments())
+
+    def __len__(self):
+        return len(self._segments())
+
+    def append(self, samples: Iterable[Sample]) -> int:
+        """Durably store a batch, returns the number of spooled samples"""
+        batch = [list(sample) for sample in samples]
+        if not batch:
+            return 0
+        line = json.dumps(batch, separators=(",", ":")) + "\n"
+
+        with self._lock:
+            segments = self._segments()
+            if (
+                not segments
+                or segments[-1] <= self._sealed
+                or os.path.getsize(segments[-1]) >= self.segment_max_bytes
+            ):
+                segments.append(self._next_segment(segments))
+            with open(segments[-1], "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._evict(segments)
+
+        self._inc("spooled_samples_total", len(batch))
+        self._set_size()
+        logger.warning(f"⚠️  Spooled {len(batch)} samples to {self.directory}")
+        return len(batch)
+
+    def _evict(self, segments: List[str]):
+        total = sum(os.path.getsize(path) for path in segments)
+        # The newest segment is never evicted, it holds the batch just appended
+        while total > self.max_bytes and len(segments) > 1:
+            oldest = segments.pop(0)
+            size = os.path.getsize(oldest)
+            dropped = sum(len(batch) for batch in self._read(oldest))
+            os.remove(oldest)
+            total -= size
+            self._inc("evicted_samples_total", dropped)
+            logger.error(
+                f"❌ Spool over {self.max_bytes} bytes, evicted {os.path.basename(oldest)} "
+                f"with {dropped} samples"
+            )
+
+    @staticmethod
+    def _read(path: str) -> Iterator[List[Sample]]:
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    batch = json.loads(line)
+                except ValueError:
+                    # A crash while appending can leave a torn last line
+                    logger.warning(f"Skipping unreadable line {number} of {path}")
+                    continue
+                yield [Sample(name, labels, value, ts) for name, labels, value, ts in batch]
+
+    def flush(self, push: Callable[[List[Sample]], object]) -> int:
+        """
+        Replay all spooled segments oldest first
+
+        `push` is called with up to `batch_samples` samples at a time and
+        has to raise on failure. Stops at the first transient failure and
+        returns the number of replayed samples, batches that fail
+        permanently are dropped.
+        """
+        replayed = 0
+        with self._flush_lock:
+            with self._lock:
+                segments = self._segments()
+                if segments:
+                    self._sealed = segments[-1]
+
+            try:
+                for path in segments:
+                    pending: List[Sample] = []
+                    try:
+                        for batch in self._read(path):
+                            pending.extend(batch)
+                            # Spooled batches can be larger than a replay push
+                            while len(pending) >= self.batch_samples:
+                                replayed += self._replay(
+                                    push, pending[: self.batch_samples], path
+                                )
+                                pending = pending[self.batch_samples :]
+                        if pending:
+                            replayed += self._replay(push, pending, path)
+                        os.remove(path)
+                    except FileNotFoundError:
+                        # Evicted while it was being replayed
+                        continue
+            finally:
+                with self._lock:
+                    # Once the sealed segment is gone appends may reuse its number
+                    if self._sealed and not os.path.exists(self._sealed):
+                        self._sealed = ""
+                if replayed:
+                    self._inc("replayed_samples_total", replayed)
+                    logger.info(f"✅ Replayed {replayed} spooled samples")
+                self._set_size()
+
+        return replayed
+
+    def _replay(
+        self, push: Callable[[List[Sample]], object], samples: List[Sample], path: str
+    ) -> int:
+        """Push one batch, returns the pushed samples, raises when it should be retried later"""
+        try:
+            push(samples)
+        except Exception as e:
+            if classify(e) is ErrorKind.TRANSIENT or isinstance(e, CircuitOpenError):
+                raise
+            self._inc("dropped_samples_total", len(samples))
+            logger.error(
+                f"❌ Dropped {len(samples)} spooled samples of {os.path.basename(path)}, "
+                f"rejected permanently: {e}"
+            )
+            return 0
+        return len(samples)
+
+    def start_flusher(self, push: Callable[[List[Sample]], object], interval: float = 30):
+        """Replay the spool every `interval` seconds from a daemon thread"""
+
+        def run():
+            while not self._stop.wait(interval):
+                if not len(self):
+                    continue
+                try:
+                    self.flush(push)
+                except Exception as e:
+                    logger.warning(f"Replaying the spool failed, retrying in {interval}s: {e}")
+
+        self._flusher = threading.Thread(target=run, daemon=True, name="spool-flusher")
+        self._flusher.start()
+
+    def stop_flusher(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+
+    def _inc(self, name: str, amount: float):
+        if self.registry is not None:
+            self.registry.inc(name, amount)
+
+    def _set_size(self):
+        if self.registry is not None:
+            self.registry.set("spool_bytes", self.size())
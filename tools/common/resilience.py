@@ -0,0 +1,346 @@
+"""
+Retries, deadlines and circuit breakers for calls to remote endpoints
+
+Errors are classified by type instead of by message: only transient
+failures (timeouts, connection problems, throttling and server errors) are
+retried, with jittered exponential backoff bounded by a total deadline
+budget. A circuit breaker per endpoint makes callers fail fast while the
+endpoint is down instead of every caller sleeping through its own retries.
+
+Retries belong at the I/O boundary only. Callers that need a tighter bound
+around several calls wrap them in `deadline(seconds)`, which every retry
+loop in the block honours.
+"""
+
+import contextlib
+import contextvars
+import enum
+import logging
+import random
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# HTTP status codes worth retrying, everything else is the caller's fault
+RETRYABLE_STATUS_CODES = frozenset((408, 425, 429, 500, 502, 503, 504))
+
+
+class ErrorKind(enum.Enum):
+    TRANSIENT = "transient"
+    PERMANENT = "permanent"
+
+
+class CircuitOpenError(Exception):
+    """The endpoint failed repeatedly and calls are rejected until it cools down"""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(f"Circuit for {endpoint} is open, retry in {retry_in:.0f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class DeadlineExceeded(TimeoutError):
+    """The deadline budget ran out before the operation succeeded"""
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def classify(exc: BaseException) -> ErrorKind:
+    """
+    Decide whether an error is worth retrying
+
+    Exceptions can override the decision with a boolean `retryable`
+    attribute, e.g. replica rejects that carry a transient reject code.
+    """
+    retryable = getattr(exc, "retryable", None)
+    if isinstance(retryable, bool):
+        return ErrorKind.TRANSIENT if retryable else ErrorKind.PERMANENT
+
+    if isinstance(exc, (CircuitOpenError, DeadlineExceeded)):
+        return ErrorKind.PERMANENT
+
+    if isinstance(exc, requests.exceptions.HTTPError) or (
+        httpx is not None and isinstance(exc, httpx.HTTPStatusError)
+    ):
+        status = _status_code(exc)
+        return ErrorKind.TRANSIENT if status in RETRYABLE_STATUS_CODES else ErrorKind.PERMANENT
+
+    transient = (
+        requests.exceptions.Timeout,
+        requests.exceptions.ConnectionError,
+        requests.exceptions.ChunkedEncodingError,
+        TimeoutError,
+        ConnectionError,
+    )
+    if httpx is not None:
+        transient += (httpx.TimeoutException, httpx.TransportError)
+
+    return ErrorKind.TRANSIENT if isinstance(exc, transient) else ErrorKind.PERMANENT
+
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "resilience_deadline", default=None
+)
+
+
+@contextlib.contextmanager
+def deadline(seconds: float):
+    """Bound every retry loop in the block to finish within `seconds`"""
+    expires_at = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(expires_at if outer is None else min(outer, expires_at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left of the enclosing `deadline` block, None when unbounded"""
+    expires_at = _deadline.get()
+    return None if expires_at is None else expires_at - time.monotonic()
+
+
+class CircuitBreaker:
+    """
+    Fails fast after repeated transient failures of an endpoint
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    every call is rejected with CircuitOpenError for `reset_timeout`
+    seconds. Afterwards a single probe call is let through: success closes
+    the circuit, failure opens it again.
+
+    Args:
+        name: Endpoint the breaker protects, used in errors and metrics
+        failure_threshold: Consecutive failures opening the circuit
+        reset_timeout: Seconds the circuit stays open before probing
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def before_call(self):
+        """Raise CircuitOpenError unless the call may go through"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            retry_in = self._opened_at + self.reset_timeout - time.monotonic()
+            if retry_in > 0 or self._probing:
+                raise CircuitOpenError(self.name, max(retry_in, 0))
+            # Let exactly one probe through
+            self._state = self.HALF_OPEN
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"✅ Circuit for {self.name} closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self, exc: BaseException):
+        # Permanent errors say nothing about the health of the endpoint
+        if classify(exc) is not ErrorKind.TRANSIENT:
+            with self._lock:
+                self._probing = False
+                if self._state == self.HALF_OPEN:
+                    self._state = self.CLOSED
+                    self._failures = 0
+            return
+
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(
+                        f"⚠️  Circuit for {self.name} opened after {self._failures} failures"
+                    )
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def call(self, func: Callable, *args, **kwargs):
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(url: str, **kwargs) -> CircuitBreaker:
+    """Shared circuit breaker of the endpoint (scheme, host and port) of `url`"""
+    parts = urlsplit(url)
+    endpoint = f"{parts.scheme}://{parts.netloc}" if parts.netloc else url
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint, **kwargs)
+        return breaker
+
+
+class RetryPolicy:
+    """
+    Jittered exponential backoff within a total deadline budget
+
+    Delays are drawn uniformly from [0, min(max_delay, initial_delay *
+    multiplier ** attempt)] ("full jitter") so that concurrent workers
+    do not retry in lockstep.
+
+    Args:
+        max_attempts: Upper bound of attempts including the first one
+        initial_delay: Upper bound of the first delay in seconds
+        max_delay: Upper bound of any single delay in seconds
+        multiplier: Growth of the delay bound per attempt
+        deadline: Total seconds the operation may take including retries
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        initial_delay: float = 1,
+        max_delay: float = 30,
+        multiplier: float = 2,
+        deadline: Optional[float] = 120,
+    ):
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.deadline = deadline
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.initial_delay * self.multiplier**attempt))
+
+    def call(
+        self,
+        func: Callable,
+        *args,
+        breaker: Optional[CircuitBreaker] = None,
+        on_retry: Optional[Callable[[BaseException, int, float], None]] = None,
+        on_give_up: Optional[Callable[[BaseException], None]] = None,
+        **kwargs,
+    ):
+        """
+        Call `func` until it succeeds, fails permanently or the budget is spent
+
+        Args:
+            breaker: Circuit breaker of the endpoint `func` talks to
+            on_retry: Called with (error, attempt, delay) before sleeping
+            on_give_up: Called with the final error of a transient failure
+        """
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                if breaker is None:
+                    return func(*args, **kwargs)
+                return breaker.call(func, *args, **kwargs)
+            except Exception as e:
+                if classify(e) is not ErrorKind.TRANSIENT:
+                    raise
+
+                attempt += 1
+                remaining = self._remaining(started)
+                delay = self.delay(attempt - 1)
+                if attempt >= self.max_attempts or (remaining is not None and remaining <= delay):
+                    if on_give_up is not None:
+                        on_give_up(e)
+                    raise
+
+                if on_retry is not None:
+                    on_retry(e, attempt, delay)
+                time.sleep(delay)
+
+    def _remaining(self, started: float) -> Optional[float]:
+        budgets = [remaining_budget()]
+        if self.deadline is not None:
+            budgets.append(self.deadline - (time.monotonic() - started))
+        budgets = [budget for budget in budgets if budget is not None]
+        return min(budgets) if budgets else None
+
+
+def retry(
+    policy: RetryPolicy,
+    breaker: Optional[Callable[..., Optional[CircuitBreaker]]] = None,
+    registry=None,
+):
+    """
+    Decorator retrying transient failures according to `policy`
+
+    Args:
+        policy: Backoff and deadline budget
+        breaker: Called with the decorated function's arguments, returns
+            the circuit breaker of the endpoint the call talks to
+        registry: Instrumentation registry counting retries and give ups
+    """
+
+    def decorator(func):
+        def on_retry(e, attempt, delay):
+            if registry is not None:
+                registry.inc("retries_total", function=func.__name__, exception=type(e).__name__)
+            logger.warning(
+                f"Attempt {attempt}/{policy.max_attempts} of {func.__name__} failed with "
+                f"{type(e).__name__}: {e}. Retrying in {delay:.1f} seconds..."
+            )
+
+        def on_give_up(e):
+            if registry is not None:
+                registry.inc(
+                    "retries_exhausted_total", function=func.__name__, exception=type(e).__name__
+                )
+            logger.error(f"Giving up on {func.__name__}. Last error: {e}")
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return policy.call(
+                func,
+                *args,
+                breaker=breaker(*args, **kwargs) if breaker is not None else None,
+                on_retry=on_retry,
+                on_give_up=on_give_up,
+                **kwargs,
+            )
+
+        return wrapper
+
+    return decorator
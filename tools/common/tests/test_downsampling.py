@@ -0,0 +1,46 @@
+import pytest
+
+from downsampling import Watermarks, load_specs, pending_windows
+
+HOUR = 3600
+DAY = 86400
+# 2025-01-10 00:30 UTC
+NOW = 20098 * DAY + 1800
+
+
+def test_windows_without_watermark_start_backfill_days_back():
+    first, last = pending_windows(None, HOUR, NOW, settle_seconds=900, backfill_days=1)
+    assert last == 20098 * DAY
+    assert first == 20097 * DAY + HOUR
+    assert (last - first) // HOUR + 1 == 24
+
+
+def test_windows_continue_after_the_watermark():
+    first, last = pending_windows(20098 * DAY - HOUR, HOUR, NOW, settle_seconds=900, backfill_days=30)
+    assert (first, last) == (20098 * DAY, 20098 * DAY)
+
+
+def test_unsettled_window_is_not_due():
+    # The window ending at 00:00 is only 30 minutes old
+    first, last = pending_windows(20098 * DAY - DAY, DAY, NOW, settle_seconds=2 * HOUR, backfill_days=30)
+    assert first > last
+
+
+def test_finished_windows_are_not_due_again():
+    first, last = pending_windows(20098 * DAY, DAY, NOW, settle_seconds=900, backfill_days=30)
+    assert first > last
+
+
+def test_watermarks_survive_a_reload(tmp_path):
+    path = str(tmp_path / "downsample.json")
+    Watermarks(path).advance("power_average_watts", "1h", 20098 * DAY)
+    assert Watermarks(path).get("power_average_watts", "1h") == 20098 * DAY
+    assert Watermarks(path).get("power_average_watts", "1d") is None
+
+
+def test_load_specs_rejects_unknown_resolutions():
+    assert [spec.metric for spec in load_specs("")] == ["power_average_watts", "power_instantaneous_watts"]
+    (spec,) = load_specs('[{"metric": "nodes_count", "resolutions": ["1d"]}]')
+    assert spec.resolutions == ("1d",)
+    with pytest.raises(ValueError):
+        load_specs('[{"metric": "nodes_count", "resolutions": ["5m"]}]')
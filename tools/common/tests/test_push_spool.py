@@ -0,0 +1,120 @@
+import os
+
+import pytest
+import requests
+
+from push_spool import PushSpool
+from victoria_exporter import Sample
+
+
+def samples(name, count=1):
+    return [Sample(name, {"i": str(i)}, i, 1000 + i) for i in range(count)]
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+def test_flush_replays_oldest_first_and_deletes_segments(tmp_path):
+    spool = PushSpool(str(tmp_path), segment_max_bytes=1)
+    spool.append(samples("first"))
+    spool.append(samples("second"))
+    assert len(spool) == 2
+
+    pushed = []
+    assert spool.flush(pushed.append) == 2
+    assert [batch[0].name for batch in pushed] == ["first", "second"]
+    assert len(spool) == 0
+
+
+def test_flush_batches_samples(tmp_path):
+    spool = PushSpool(str(tmp_path), batch_samples=3)
+    spool.append(samples("a", 5))
+
+    pushed = []
+    assert spool.flush(pushed.append) == 5
+    assert [len(batch) for batch in pushed] == [3, 2]
+
+
+def test_transient_failure_keeps_the_segment(tmp_path):
+    spool = PushSpool(str(tmp_path))
+    spool.append(samples("a"))
+
+    def push(batch):
+        raise requests.ConnectionError("down")
+
+    with pytest.raises(requests.ConnectionError):
+        spool.flush(push)
+    assert len(spool) == 1
+
+    pushed = []
+    assert spool.flush(pushed.append) == 1
+    assert len(spool) == 0
+
+
+def test_permanent_failure_drops_only_the_rejected_batch(tmp_path):
+    spool = PushSpool(str(tmp_path), segment_max_bytes=1)
+    spool.append(samples("rejected"))
+    spool.append(samples("accepted"))
+
+    pushed = []
+
+    def push(batch):
+        if batch[0].name == "rejected":
+            raise http_error(400)
+        pushed.append(batch)
+
+    assert spool.flush(push) == 1
+    assert [batch[0].name for batch in pushed] == ["accepted"]
+    assert len(spool) == 0
+
+
+def test_appends_reuse_one_segment_after_a_flush(tmp_path):
+    spool = PushSpool(str(tmp_path))
+    spool.append(samples("a"))
+    spool.flush(lambda batch: None)
+
+    spool.append(samples("b"))
+    spool.append(samples("c"))
+    assert len(spool) == 1
+
+
+def test_appends_after_a_seal_go_to_a_new_segment(tmp_path):
+    spool = PushSpool(str(tmp_path))
+    spool.append(samples("a"))
+
+    def push(batch):
+        # Appended while the segment is being replayed
+        spool.append(samples("b"))
+        raise requests.ConnectionError("down")
+
+    with pytest.raises(requests.ConnectionError):
+        spool.flush(push)
+    assert len(spool) == 2
+
+
+def test_evicts_oldest_segments_over_the_size_limit(tmp_path):
+    spool = PushSpool(str(tmp_path), segment_max_bytes=1)
+    spool.append(samples("a"))
+    segment_bytes = spool.size()
+    spool.max_bytes = 2 * segment_bytes
+    for name in ("b", "c", "d"):
+        spool.append(samples(name))
+
+    assert spool.size() <= 2 * segment_bytes
+    pushed = []
+    spool.flush(pushed.append)
+    assert [batch[0].name for batch in pushed] == ["c", "d"]
+
+
+def test_skips_torn_lines(tmp_path):
+    spool = PushSpool(str(tmp_path))
+    spool.append(samples("a"))
+    (segment,) = os.listdir(tmp_path)
+    with open(tmp_path / segment, "a") as f:
+        f.write('[["torn"')
+
+    pushed = []
+    assert spool.flush(pushed.append) == 1
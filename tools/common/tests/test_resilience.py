@@ -0,0 +1,92 @@
+import pytest
+import requests
+
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, ErrorKind, classify
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+def fail(exc):
+    def call():
+        raise exc
+
+    return call
+
+
+def test_classify():
+    assert classify(requests.ConnectionError()) is ErrorKind.TRANSIENT
+    assert classify(http_error(503)) is ErrorKind.TRANSIENT
+    assert classify(http_error(400)) is ErrorKind.PERMANENT
+    assert classify(ValueError()) is ErrorKind.PERMANENT
+
+
+def test_breaker_opens_after_consecutive_transient_failures(clock):
+    breaker = CircuitBreaker("endpoint", failure_threshold=2, reset_timeout=30)
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            breaker.call(fail(requests.ConnectionError()))
+
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "not called")
+
+
+def test_permanent_failures_do_not_open_the_breaker(clock):
+    breaker = CircuitBreaker("endpoint", failure_threshold=1)
+    with pytest.raises(requests.HTTPError):
+        breaker.call(fail(http_error(400)))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_breaker_lets_one_probe_through(clock):
+    breaker = CircuitBreaker("endpoint", failure_threshold=1, reset_timeout=30)
+    with pytest.raises(requests.ConnectionError):
+        breaker.call(fail(requests.ConnectionError()))
+
+    clock.now += 30
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call()
+    # A second caller is rejected while the probe is in flight
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.call(lambda: "ok") == "ok"
+
+
+def test_failed_probe_opens_the_breaker_again(clock):
+    breaker = CircuitBreaker("endpoint", failure_threshold=3, reset_timeout=30)
+    for _ in range(3):
+        with pytest.raises(requests.ConnectionError):
+            breaker.call(fail(requests.ConnectionError()))
+
+    clock.now += 30
+    with pytest.raises(requests.ConnectionError):
+        breaker.call(fail(requests.ConnectionError()))
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now += 30
+    assert breaker.state == CircuitBreaker.HALF_OPEN
@@ -0,0 +1,242 @@
+"""
+Shared VictoriaMetrics exporter used by the ingesters
+
+Samples are rendered by a pluggable format backend and streamed to the
+matching import endpoint in chunks through a generator body, optionally gzip
+compressed, over a single pooled session.
+"""
+
+import json
+import logging
+import zlib
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple, Union
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_COMPRESSIONS = ("gzip", "none")
+
+
+class Sample(NamedTuple):
+    """A single metric sample, labels exclude the metric name"""
+
+    name: str
+    labels: Dict[str, str]
+    value: Union[int, float]
+    timestamp_ms: int
+
+
+def escape_label_value(value) -> str:
+    """Escape a label value for the Prometheus exposition format"""
+    return (
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    )
+
+
+def format_prometheus_line(sample: Sample) -> str:
+    labels = ",".join(
+        f'{key}="{escape_label_value(value)}"' for key, value in sample.labels.items()
+    )
+    return f"{sample.name}{{{labels}}} {sample.value} {sample.timestamp_ms}"
+
+
+class PrometheusTextFormat:
+    """One Prometheus exposition line per sample"""
+
+    name = "prometheus"
+    path = "api/v1/import/prometheus"
+    content_type = "text/plain"
+
+    def render(self, samples: Iterable[Sample]) -> Iterator[str]:
+        for sample in samples:
+            yield format_prometheus_line(sample)
+
+
+class JsonLineFormat:
+    """
+    VictoriaMetrics JSON line format, see
+    https://docs.victoriametrics.com/victoriametrics/#how-to-import-data-in-json-line-format
+
+    All samples of the same series are grouped into a single line, so the
+    input has to be fully consumed before the first line is produced.
+    """
+
+    name = "json"
+    path = "api/v1/import"
+    content_type = "application/json"
+
+    def render(self, samples: Iterable[Sample]) -> Iterator[str]:
+        series: Dict[Tuple, Tuple[Dict[str, str], List, List]] = {}
+        for sample in samples:
+            key = (sample.name, tuple(sorted(sample.labels.items())))
+            entry = series.get(key)
+            if entry is None:
+                metric = {"__name__": sample.name}
+                metric.update((k, str(v)) for k, v in sample.labels.items())
+                entry = series[key] = (metric, [], [])
+            # JSON values have to be numbers, text values such as "NaN" are converted
+            value = sample.value
+            entry[1].append(float(value) if isinstance(value, str) else value)
+            entry[2].append(sample.timestamp_ms)
+
+        for metric, values, timestamps in series.values():
+            # json.dumps takes care of escaping label names and values
+            yield json.dumps(
+                {"metric": metric, "values": values, "timestamps": timestamps},
+                separators=(",", ":"),
+            )
+
+
+EXPORT_FORMATS = {
+    PrometheusTextFormat.name: PrometheusTextFormat,
+    JsonLineFormat.name: JsonLineFormat,
+}
+
+
+class ImportStats:
+    """Counters filled while a request body is being streamed"""
+
+    __slots__ = ("samples", "lines", "raw_bytes", "sent_bytes")
+
+    def __init__(self):
+        self.samples = 0
+        self.lines = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def __repr__(self):
+        return (
+            f"ImportStats(samples={self.samples}, lines={self.lines}, "
+            f"raw_bytes={self.raw_bytes}, sent_bytes={self.sent_bytes})"
+        )
+
+
+class VictoriaExporter:
+    """
+    Streams metric samples to VictoriaMetrics
+
+    Args:
+        victoria_url: Base url of VictoriaMetrics
+        export_format: Wire format, one of EXPORT_FORMATS
+        compression: Request body compression, one of SUPPORTED_COMPRESSIONS
+        chunk_size: Number of uncompressed bytes buffered before a chunk is sent
+        timeout: Timeout in seconds for a single import request
+        pool_maxsize: Number of connections kept alive in the session pool
+    """
+
+    def __init__(
+        self,
+        victoria_url: str,
+        export_format: str = "prometheus",
+        compression: str = "gzip",
+        chunk_size: int = 256 * 1024,
+        timeout: int = 30,
+        pool_maxsize: int = 4,
+    ):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(
+                f"Unsupported export format {export_format}, expected one of {tuple(EXPORT_FORMATS)}"
+            )
+        if compression not in SUPPORTED_COMPRESSIONS:
+            raise ValueError(
+                f"Unsupported compression {compression}, expected one of {SUPPORTED_COMPRESSIONS}"
+            )
+
+        self.victoria_url = victoria_url
+        self.format = EXPORT_FORMATS[export_format]()
+        self.compression = compression
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def url(self, path: str) -> str:
+        return urljoin(self.victoria_url.rstrip("/") + "/", path)
+
+    def body(self, samples: Iterable[Sample], stats: ImportStats) -> Iterator[bytes]:
+        """Render samples and encode them into chunks, compressing them on the fly"""
+        compressor = None
+        if self.compression == "gzip":
+            # wbits=31 produces a gzip container instead of a raw zlib stream
+            compressor = zlib.compressobj(level=6, wbits=31)
+
+        def counted(samples):
+            for sample in samples:
+                stats.samples += 1
+                yield sample
+
+        buffer = []
+        buffered = 0
+
+        def flush():
+            data = b"".join(buffer)
+            buffer.clear()
+            if compressor is not None:
+                data = compressor.compress(data)
+            stats.sent_bytes += len(data)
+            return data
+
+        for line in self.format.render(counted(samples)):
+            encoded = (line + "\n").encode("utf-8")
+            buffer.append(encoded)
+            buffered += len(encoded)
+            stats.lines += 1
+            stats.raw_bytes += len(encoded)
+
+            if buffered >= self.chunk_size:
+                buffered = 0
+                data = flush()
+                if data:
+                    yield data
+
+        data = flush()
+        if compressor is not None:
+            tail = compressor.flush()
+            stats.sent_bytes += len(tail)
+            data += tail
+        if data:
+            yield data
+
+    def push_samples(self, samples: Iterable[Sample]) -> ImportStats:
+        """
+        Push samples to VictoriaMetrics
+
+        `samples` is consumed lazily so it can be a generator. Raises if the
+        request fails or nothing was pushed.
+        """
+        stats = ImportStats()
+        headers = {"Content-Type": self.format.content_type}
+        if self.compression == "gzip":
+            headers["Content-Encoding"] = "gzip"
+
+        response = self.session.post(
+            self.url(self.format.path),
+            data=self.body(samples, stats),
+            headers=headers,
+            timeout=self.timeout,
+        )
+        try:
+            response.raise_for_status()
+        except Exception:
+            logger.error(
+                f"Failed to push to VictoriaMetrics: {response.status_code} - {response.text}"
+            )
+            raise
+
+        if stats.samples == 0:
+            raise ValueError("There were no metrics to push")
+
+        logger.debug(
+            f"Pushed {stats.samples} samples in {stats.lines} lines "
+            f"({stats.raw_bytes} bytes, {stats.sent_bytes} on the wire)"
+        )
+        return stats
+
+    def close(self):
+        self.session.close()
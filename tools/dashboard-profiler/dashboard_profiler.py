@@ -0,0 +1,499 @@
+"""
+Query cost of the provisioned Grafana dashboards
+
+Opens every dashboard the way Grafana would with its saved time range and
+variable selection, runs each panel query against VictoriaMetrics and
+records the latency, the series VictoriaMetrics had to fetch and the bytes
+it returned. The ranked report shows which panels make a dashboard slow,
+`--baseline` compares against an earlier JSON report and fails on
+regressions.
+
+With `--seed` the tool first fills an empty VictoriaMetrics with a
+deterministic synthetic data set for every metric the dashboards read, so
+runs against a throwaway local instance are comparable with each other.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import requests
+from grafana_queries import dashboard_files, dashboard_queries, panel_targets
+from seed_data import metric_labels, samples, series
+from template_variables import (
+    TimeRange,
+    Value,
+    VariableSource,
+    builtin_values,
+    duration_seconds,
+    interpolate,
+    resolve,
+)
+from victoria_exporter import VictoriaExporter
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+VICTORIA_METRICS_URL = os.getenv("VICTORIA_METRICS_URL", "http://localhost:9090")
+
+# Grafana requests about one point per pixel, a typical panel is this wide
+DEFAULT_MAX_DATA_POINTS = 1000
+# Grafana never queries with a step below the scrape interval of the data source
+DEFAULT_SCRAPE_INTERVAL = "30s"
+
+_RELATIVE_TIME = re.compile(r"^now(?:-(\d+)([smhdwMy]))?(?:/[smhdwMy])?$")
+_RELATIVE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "M": 2592000, "y": 31536000}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "dashboard-profiler",
+        description="Run every panel query of the provisioned dashboards and rank them by cost",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--victoria-url",
+        dest="victoria_url",
+        default=VICTORIA_METRICS_URL,
+        help="Base url of VictoriaMetrics",
+    )
+
+    parser.add_argument(
+        "--dashboards-path",
+        dest="dashboards_path",
+        default="config/grafana/provisioning/dashboards",
+        help="Directory with the provisioned dashboards",
+    )
+
+    parser.add_argument(
+        "--range",
+        default=None,
+        help="Profile every dashboard over this duration (e.g. 24h) instead of its saved time range",
+    )
+
+    parser.add_argument(
+        "--end",
+        type=float,
+        default=None,
+        help="Unix timestamp the time ranges end at, now by default",
+    )
+
+    parser.add_argument(
+        "--scrape-interval",
+        dest="scrape_interval",
+        default=DEFAULT_SCRAPE_INTERVAL,
+        help="Minimum step and the scrape interval used for $__rate_interval",
+    )
+
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Runs per query, the median latency is reported",
+    )
+
+    parser.add_argument("--top", type=int, default=25, help="Queries listed in the report")
+
+    parser.add_argument(
+        "--json-output",
+        dest="json_output",
+        default=None,
+        help="Also write every measurement as JSON to this path",
+    )
+
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="JSON report of an earlier run, exit with an error when a query regressed",
+    )
+
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.5,
+        help="Factor by which series, bytes or latency may exceed the baseline",
+    )
+
+    parser.add_argument(
+        "--min-latency",
+        dest="min_latency",
+        type=float,
+        default=0.05,
+        help="Latency regressions below this many seconds are ignored as noise",
+    )
+
+    seeding = parser.add_argument_group("offline mode")
+    seeding.add_argument(
+        "--seed",
+        action="store_true",
+        help="Fill an empty VictoriaMetrics with synthetic series before profiling",
+    )
+    seeding.add_argument(
+        "--seed-range",
+        dest="seed_range",
+        default="6h",
+        help="Duration of synthetic data that is generated",
+    )
+    seeding.add_argument(
+        "--seed-instances",
+        dest="seed_instances",
+        type=int,
+        default=5,
+        help="Instances every synthetic metric is generated for",
+    )
+    seeding.add_argument(
+        "--seed-values",
+        dest="seed_values",
+        type=int,
+        default=2,
+        help="Generated values of every other label",
+    )
+    seeding.add_argument(
+        "--seed-max-series",
+        dest="seed_max_series",
+        type=int,
+        default=100,
+        help="Upper bound of synthetic series per metric",
+    )
+
+    return parser.parse_args()
+
+
+class Measurement(NamedTuple):
+    dashboard: str
+    panel: str
+    panel_id: Optional[int]
+    ref_id: Optional[str]
+    expr: str
+    query: str
+    instant: bool
+    range_seconds: float
+    step: float
+    latency: float
+    series_fetched: int
+    series_returned: int
+    points: int
+    bytes: int
+    error: Optional[str] = None
+
+    @property
+    def key(self):
+        return (self.dashboard, self.panel_id, self.ref_id, self.expr)
+
+
+def parse_time(value: str, now: float) -> float:
+    """Grafana time of a dashboard, `now-6h` style or an ISO timestamp"""
+    match = _RELATIVE_TIME.match(value)
+    if match:
+        if match.group(1) is None:
+            return now
+        return now - int(match.group(1)) * _RELATIVE_UNITS[match.group(2)]
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def panel_range(
+    dashboard: Dict[str, Any],
+    panel: Dict[str, Any],
+    target: Dict[str, Any],
+    args: argparse.Namespace,
+    end: float,
+) -> TimeRange:
+    """Time range and step Grafana would query a panel target with"""
+    scrape_interval = duration_seconds(args.scrape_interval)
+    if args.range:
+        start = end - duration_seconds(args.range)
+    else:
+        times = dashboard.get("time") or {}
+        start = parse_time(times.get("from", "now-6h"), end)
+        end = parse_time(times.get("to", "now"), end)
+
+    # Panel overrides: a relative range of its own and a shift back in time
+    if panel.get("timeFrom"):
+        start = end - duration_seconds(panel["timeFrom"].removeprefix("now-"))
+    if panel.get("timeShift"):
+        shift = duration_seconds(panel["timeShift"])
+        start, end = start - shift, end - shift
+
+    min_step = scrape_interval
+    for interval in (target.get("interval"), panel.get("interval")):
+        if interval and not interval.startswith("$"):
+            min_step = duration_seconds(interval.lstrip(">"))
+            break
+
+    points = panel.get("maxDataPoints") or DEFAULT_MAX_DATA_POINTS
+    step = max(min_step, math.ceil((end - start) / points))
+    step *= target.get("intervalFactor") or 1
+    return TimeRange(start, end, step, scrape_interval)
+
+
+def is_instant(target: Dict[str, Any]) -> bool:
+    return bool(target.get("instant")) and not target.get("range")
+
+
+class Profiler:
+    """Runs queries against VictoriaMetrics and measures them"""
+
+    def __init__(self, victoria_url: str, repeat: int, timeout: float = 120):
+        self.victoria_url = victoria_url.rstrip("/")
+        self.repeat = max(1, repeat)
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def get(self, path: str, params: Dict[str, Any]) -> Any:
+        response = self.session.get(
+            f"{self.victoria_url}/{path}", params=params, timeout=self.timeout
+        )
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get("status") != "success":
+            raise ValueError(payload.get("error"))
+        return payload["data"]
+
+    def variable_source(self, start: float, end: float) -> VariableSource:
+        def label_values(label: str, match: Optional[str]) -> List[str]:
+            params: Dict[str, Any] = {"start": int(start), "end": int(end)}
+            if match:
+                params["match[]"] = match
+            return [str(value) for value in self.get(f"api/v1/label/{label}/values", params)]
+
+        def query_values(expr: str) -> List[str]:
+            data = self.get("api/v1/query", {"query": expr, "time": int(end)})
+            return [
+                json.dumps(sample["metric"], sort_keys=True) for sample in data.get("result", [])
+            ]
+
+        return VariableSource(label_values, query_values)
+
+    def measure(self, query: str, time_range: TimeRange, instant: bool) -> Dict[str, Any]:
+        """Run a query `repeat` times without the rollup cache, keep the median latency"""
+        if instant:
+            path = "api/v1/query"
+            params = {"query": query, "time": int(time_range.end)}
+        else:
+            path = "api/v1/query_range"
+            params = {
+                "query": query,
+                "start": int(time_range.start),
+                "end": int(time_range.end),
+                "step": f"{int(time_range.step)}s",
+            }
+        # Every run has to do the full work, not read the previous result from the cache
+        params["nocache"] = "1"
+
+        latencies = []
+        response = None
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            response = self.session.get(
+                f"{self.victoria_url}/{path}", params=params, timeout=self.timeout
+            )
+            latencies.append(time.perf_counter() - started)
+
+        payload = response.json()
+        result = {"latency": statistics.median(latencies), "bytes": len(response.content)}
+        if response.status_code != 200 or payload.get("status") != "success":
+            result["error"] = payload.get("error") or f"HTTP {response.status_code}"
+            return result
+
+        series_list = payload["data"].get("result", [])
+        result["series_returned"] = len(series_list)
+        result["points"] = sum(len(item.get("values", [None])) for item in series_list)
+        # VictoriaMetrics reports the series it had to read, not only the returned ones
+        stats = payload.get("stats") or {}
+        result["series_fetched"] = int(stats.get("seriesFetched", len(series_list)))
+        return result
+
+
+def profile_dashboard(
+    profiler: Profiler, path: str, args: argparse.Namespace, end: float
+) -> List[Measurement]:
+    with open(path, "r") as f:
+        dashboard = json.load(f)
+    name = os.path.relpath(path, args.dashboards_path)
+
+    # Variables are resolved over the saved time range of the dashboard
+    dashboard_range = panel_range(dashboard, {}, {}, args, end)
+    try:
+        variables = resolve(
+            dashboard, profiler.variable_source(dashboard_range.start, dashboard_range.end)
+        )
+    except (requests.RequestException, ValueError) as e:
+        logging.warning(f"Could not resolve the variables of {name}: {e}")
+        variables = {}
+
+    measurements = []
+    for panel, target in panel_targets(dashboard):
+        if target.get("hide"):
+            continue
+        time_range = panel_range(dashboard, panel, target, args, end)
+        values: Dict[str, Value] = dict(variables)
+        values.update(builtin_values(time_range))
+        query = interpolate(target["expr"], values)
+        instant = is_instant(target)
+
+        try:
+            result = profiler.measure(query, time_range, instant)
+        except (requests.RequestException, ValueError) as e:
+            result = {"latency": 0.0, "bytes": 0, "error": str(e)}
+
+        measurements.append(
+            Measurement(
+                name,
+                panel.get("title", ""),
+                panel.get("id"),
+                target.get("refId"),
+                target["expr"],
+                query,
+                instant,
+                time_range.range,
+                time_range.step,
+                result["latency"],
+                result.get("series_fetched", 0),
+                result.get("series_returned", 0),
+                result.get("points", 0),
+                result["bytes"],
+                result.get("error"),
+            )
+        )
+    return measurements
+
+
+def seed(args: argparse.Namespace, end: float):
+    """Push the synthetic data set, refusing to touch an instance that has data"""
+    profiler = Profiler(args.victoria_url, 1)
+    existing = profiler.get("api/v1/series/count", {})
+    if existing and int(existing[0]) > 0:
+        raise ValueError(
+            f"{args.victoria_url} already stores {existing[0]} series, --seed only "
+            "writes to an empty VictoriaMetrics"
+        )
+
+    queries = []
+    for path in dashboard_files(args.dashboards_path):
+        queries.extend(dashboard_queries(path))
+    label_sets = series(
+        metric_labels(queries), args.seed_instances, args.seed_values, args.seed_max_series
+    )
+    start = int(end - duration_seconds(args.seed_range))
+    step = int(duration_seconds(args.scrape_interval))
+
+    exporter = VictoriaExporter(args.victoria_url, export_format="json", timeout=300)
+    stats = exporter.push_samples(samples(label_sets, start, int(end), step))
+    # Make the imported samples searchable right away
+    profiler.session.get(f"{profiler.victoria_url}/internal/force_flush", timeout=60)
+    logging.info(f"Seeded {len(label_sets)} series with {stats.samples} samples")
+
+
+def format_report(measurements: List[Measurement], top: int) -> str:
+    lines = []
+    dashboards: Dict[str, List[Measurement]] = {}
+    for measurement in measurements:
+        dashboards.setdefault(measurement.dashboard, []).append(measurement)
+
+    lines.append("Dashboards by total query latency:")
+    ranked = sorted(dashboards.items(), key=lambda item: -sum(m.latency for m in item[1]))
+    for name, items in ranked:
+        lines.append(
+            f"  {sum(m.latency for m in items):8.3f}s {sum(m.series_fetched for m in items):>9} series "
+            f"{sum(m.bytes for m in items) / 1024:>10.1f} KiB  {name} ({len(items)} queries)"
+        )
+
+    lines.append("")
+    lines.append(f"Top {top} queries by latency:")
+    lines.append(f"  {'latency':>8} {'fetched':>9} {'returned':>8} {'KiB':>9}  dashboard / panel")
+    for m in sorted(measurements, key=lambda m: (-m.latency, -m.series_fetched))[:top]:
+        lines.append(
+            f"  {m.latency:7.3f}s {m.series_fetched:>9} {m.series_returned:>8} {m.bytes / 1024:>9.1f}  "
+            f"{m.dashboard} / {m.panel} [{m.ref_id}]"
+        )
+        lines.append(f"{'':>40}{m.expr[:120]}")
+
+    errors = [m for m in measurements if m.error]
+    if errors:
+        lines.append("")
+        lines.append(f"{len(errors)} queries failed:")
+        for m in errors:
+            lines.append(f"  {m.dashboard} / {m.panel} [{m.ref_id}]: {m.error}")
+    return "\n".join(lines)
+
+
+def regressions(
+    measurements: List[Measurement], baseline: List[Dict[str, Any]], args: argparse.Namespace
+) -> List[str]:
+    """Queries whose cost grew beyond the tolerance compared to the baseline"""
+    previous = {
+        (item["dashboard"], item["panel_id"], item["ref_id"], item["expr"]): item
+        for item in baseline
+    }
+    found = []
+    for m in measurements:
+        before = previous.get(m.key)
+        if before is None:
+            continue
+        where = f"{m.dashboard} / {m.panel} [{m.ref_id}]"
+        if m.error and not before.get("error"):
+            found.append(f"{where}: fails now: {m.error}")
+        for field in ("series_fetched", "bytes"):
+            if getattr(m, field) > max(1, before[field]) * args.tolerance:
+                found.append(f"{where}: {field} {before[field]} -> {getattr(m, field)}")
+        if m.latency > max(args.min_latency, before["latency"] * args.tolerance):
+            found.append(f"{where}: latency {before['latency']:.3f}s -> {m.latency:.3f}s")
+    return found
+
+
+def main():
+    args = parse_args()
+    # A fixed end keeps seeded runs comparable, the step grid does not move
+    end = args.end or float(int(time.time()) // 60 * 60)
+
+    try:
+        if args.seed:
+            seed(args, end)
+
+        profiler = Profiler(args.victoria_url, args.repeat)
+        measurements = []
+        for path in dashboard_files(args.dashboards_path):
+            logging.info(f"Profiling {path}")
+            measurements.extend(profile_dashboard(profiler, path, args, end))
+    except (OSError, ValueError, requests.RequestException) as e:
+        sys.exit(f"Profiling failed: {e}")
+
+    print(format_report(measurements, args.top), flush=True)
+
+    if args.json_output:
+        with open(args.json_output, "w") as f:
+            json.dump(
+                {
+                    "end": datetime.fromtimestamp(end, timezone.utc).isoformat(),
+                    "queries": [
+                        dict(m._asdict()) for m in measurements
+                    ],
+                },
+                f,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            found = regressions(measurements, json.load(f)["queries"], args)
+        if found:
+            print(f"\n{len(found)} regressions against {args.baseline}:", flush=True)
+            for line in found:
+                print(f"  {line}", flush=True)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Synthetic series for profiling the dashboards offline
+
+Generates a deterministic data set for every metric the dashboards read,
+with the label names their selectors and groupings use, so the panel
+queries of a CI-like run touch comparable series on every run. Label values
+are shared between metrics, so joins such as `on(instance, device)` match.
+"""
+
+import hashlib
+import itertools
+import math
+import re
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from grafana_queries import Query, selectors
+from victoria_exporter import Sample
+
+# Labels of every generated series
+BASE_LABELS = ("job", "instance")
+DEFAULT_JOB = "host_node_exporter"
+HISTOGRAM_BUCKETS = ("0.005", "0.05", "0.5", "5", "+Inf")
+COUNTER_SUFFIXES = ("_total", "_count", "_sum", "_bucket")
+
+_GROUPING = re.compile(r"\b(?:by|without|on|ignoring|group_left|group_right)\s*\(([^)]*)\)")
+_SIMPLE_ALTERNATION = re.compile(r"^[a-zA-Z0-9_:./-]+(\|[a-zA-Z0-9_:./-]+)*$")
+
+
+def grouping_labels(expr: str) -> Set[str]:
+    labels = set()
+    for group in _GROUPING.findall(expr):
+        labels.update(label.strip() for label in group.split(",") if label.strip())
+    return labels
+
+
+def metric_labels(queries: Iterable[Query]) -> Dict[str, Dict[str, Set[str]]]:
+    """
+    Label names and fixed values of every metric the queries read
+
+    A matcher with a literal value (or a simple alternation) fixes the values
+    of its label, labels of templated matchers and groupings get generated
+    values.
+    """
+    metrics: Dict[str, Dict[str, Set[str]]] = {}
+    for query in queries:
+        grouped = grouping_labels(query.expr)
+        for selector in selectors(query.expr):
+            if not selector.literal:
+                continue
+            labels = metrics.setdefault(selector.name, {})
+            for label in grouped:
+                labels.setdefault(label, set())
+            for label, op, value in selector.matchers:
+                values = labels.setdefault(label, set())
+                if "$" in value or "[[" in value:
+                    continue
+                if op == "=":
+                    values.add(value)
+                elif op == "=~" and _SIMPLE_ALTERNATION.match(value):
+                    values.update(value.split("|"))
+    return metrics
+
+
+def _label_values(label: str, fixed: Set[str], instances: int, values_per_label: int) -> List[str]:
+    if fixed:
+        return sorted(fixed)
+    if label == "job":
+        return [DEFAULT_JOB]
+    if label == "instance":
+        return [f"node-{index}:9100" for index in range(instances)]
+    if label == "le":
+        return list(HISTOGRAM_BUCKETS)
+    return [f"{label}-{index}" for index in range(values_per_label)]
+
+
+def series(
+    metrics: Dict[str, Dict[str, Set[str]]],
+    instances: int,
+    values_per_label: int,
+    max_series_per_metric: int,
+) -> List[Tuple[str, Dict[str, str]]]:
+    """Label sets of the generated series, in a deterministic order"""
+    result = []
+    for name in sorted(metrics):
+        labels = dict(metrics[name])
+        for label in BASE_LABELS:
+            labels.setdefault(label, set())
+        if name.endswith("_bucket"):
+            labels.setdefault("le", set())
+        names = sorted(label for label in labels if label != "__name__")
+        choices = [
+            _label_values(label, labels[label], instances, values_per_label) for label in names
+        ]
+        combinations = itertools.islice(itertools.product(*choices), max_series_per_metric)
+        for combination in combinations:
+            result.append((name, dict(zip(names, combination))))
+    return result
+
+
+def _phase(name: str, labels: Dict[str, str]) -> float:
+    key = name + repr(sorted(labels.items()))
+    return int(hashlib.sha256(key.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+
+
+def samples(
+    label_sets: List[Tuple[str, Dict[str, str]]], start: int, end: int, step: int
+) -> Iterator[Sample]:
+    """
+    Samples of every series from `start` to `end` seconds, every `step`
+
+    Counters grow at a per-series rate, gauges oscillate around a per-series
+    level, both only depend on the series and the timestamp.
+    """
+    first = start - start % step
+    for name, labels in label_sets:
+        phase = _phase(name, labels)
+        counter = name.endswith(COUNTER_SUFFIXES)
+        for timestamp in range(first, end + 1, step):
+            if counter:
+                value = round((timestamp - first) * (1 + phase * 100), 3)
+            else:
+                value = round(100 * phase + 10 * math.sin(timestamp / 600 + phase * 6), 3)
+            yield Sample(name, labels, value, timestamp * 1000)
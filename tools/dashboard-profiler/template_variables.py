@@ -0,0 +1,202 @@
+"""
+Grafana template variable expansion for PromQL panel queries
+
+Resolves the variables of a dashboard the way Grafana does when the
+dashboard is opened with its saved selection: query variables are resolved
+against the data source in dashboard order (later variables may refer to
+earlier ones), the saved `current` value is used when it still exists and
+`All` expands to the `allValue` or to every value. Multi-value and `All`
+variables are regex escaped, as the Prometheus data source does.
+"""
+
+import math
+import re
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from grafana_queries import variable_promql
+
+ALL = "$__all"
+
+# ${var}, ${var:format}, [[var]], [[var:format]] and $var
+_VARIABLE = re.compile(
+    r"\$\{(?P<braced>[a-zA-Z0-9_]+)(?::(?P<format>[a-zA-Z]+))?\}"
+    r"|\[\[(?P<bracketed>[a-zA-Z0-9_]+)(?::(?P<bformat>[a-zA-Z]+))?\]\]"
+    r"|\$(?P<plain>[a-zA-Z0-9_]+)"
+)
+_REGEX_SPECIAL = re.compile(r"([\\^$.|?*+()\[\]{}])")
+_DURATION = re.compile(r"^(\d+)(ms|s|m|h|d|w|y)$")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "y": 31536000}
+
+
+class Value(NamedTuple):
+    """Selected values of a variable, `regex` when Grafana would regex escape them"""
+
+    values: List[str]
+    regex: bool = False
+    # Replaces the values when `All` is selected and the variable has an allValue
+    all_value: Optional[str] = None
+
+
+class TimeRange(NamedTuple):
+    """Time range and resolution of a panel query, in seconds"""
+
+    start: float
+    end: float
+    step: float
+    scrape_interval: float
+
+    @property
+    def range(self) -> float:
+        return self.end - self.start
+
+
+def duration_seconds(value: str) -> float:
+    match = _DURATION.match(value.strip())
+    if match is None:
+        raise ValueError(f"Invalid duration {value!r}")
+    return int(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+
+
+def format_duration(seconds: float) -> str:
+    """Prometheus duration of whole seconds, at least one second"""
+    return f"{max(1, int(math.ceil(seconds)))}s"
+
+
+def escape_regex(value: str) -> str:
+    return _REGEX_SPECIAL.sub(r"\\\1", value)
+
+
+def format_value(value: Value, format_name: Optional[str]) -> str:
+    if value.all_value is not None and format_name in (None, "regex", "raw"):
+        return value.all_value
+    values = value.values
+    if format_name in ("raw", "csv"):
+        return ",".join(values)
+    if format_name == "pipe":
+        return "|".join(values)
+    if format_name == "regex" or value.regex:
+        escaped = [escape_regex(item) for item in values]
+        return escaped[0] if len(escaped) == 1 else "(" + "|".join(escaped) + ")"
+    return ",".join(values)
+
+
+def builtin_values(time_range: TimeRange) -> Dict[str, Value]:
+    """Grafana global variables of a panel query with the given range and step"""
+    interval = time_range.step
+    # Grafana: max($__interval + scrape interval, 4 * scrape interval)
+    rate_interval = max(interval + time_range.scrape_interval, 4 * time_range.scrape_interval)
+    return {
+        "__interval": Value([format_duration(interval)]),
+        "__interval_ms": Value([str(int(interval * 1000))]),
+        "__rate_interval": Value([format_duration(rate_interval)]),
+        "__range": Value([format_duration(time_range.range)]),
+        "__range_s": Value([str(int(time_range.range))]),
+        "__range_ms": Value([str(int(time_range.range * 1000))]),
+    }
+
+
+def interpolate(expr: str, values: Dict[str, Value]) -> str:
+    """Replace every known variable of `expr`, unknown ones are left as they are"""
+
+    def replace(match: "re.Match") -> str:
+        name = match.group("braced") or match.group("bracketed") or match.group("plain")
+        format_name = match.group("format") or match.group("bformat")
+        value = values.get(name)
+        if value is None:
+            return match.group(0)
+        return format_value(value, format_name)
+
+    return _VARIABLE.sub(replace, expr)
+
+
+def _label_values_query(query: Any) -> Optional[re.Match]:
+    if isinstance(query, dict):
+        query = query.get("query")
+    if not isinstance(query, str):
+        return None
+    return re.match(r"^\s*label_values\s*\(\s*(?:(.*),\s*)?([a-zA-Z_][a-zA-Z0-9_]*)\s*\)\s*$", query, re.S)
+
+
+def _custom_options(query: str) -> List[str]:
+    # Grafana splits custom variables on commas that are not escaped, `key : value` keeps the value
+    options = []
+    for item in re.split(r"(?<!\\),", query):
+        item = item.replace("\\,", ",").strip()
+        if " : " in item:
+            item = item.split(" : ", 1)[1].strip()
+        if item:
+            options.append(item)
+    return options
+
+
+class VariableSource(NamedTuple):
+    """Data source lookups the resolver needs, bound to the dashboard time range"""
+
+    label_values: Callable[[str, Optional[str]], List[str]]
+    query_values: Callable[[str], List[str]]
+
+
+def options(variable: Dict[str, Any], values: Dict[str, Value], source: VariableSource) -> List[str]:
+    """Every value a variable can take, after the earlier variables are applied"""
+    kind = variable.get("type")
+    query = variable.get("query")
+
+    if kind == "custom":
+        return _custom_options(str(query or ""))
+    if kind in ("constant", "textbox"):
+        return [str(query or "")]
+    if kind == "interval":
+        return _custom_options(str(query or ""))
+    if kind != "query":
+        return []
+
+    match = _label_values_query(query) or _label_values_query(variable.get("definition"))
+    if match is not None:
+        match_expr = interpolate(match.group(1), values) if match.group(1) else None
+        found = source.label_values(match.group(2), match_expr)
+    else:
+        expr = variable_promql(query) or variable_promql(variable.get("definition"))
+        found = source.query_values(interpolate(expr, values)) if expr else []
+
+    regex = variable.get("regex")
+    if regex:
+        pattern = re.compile(regex.strip("/"))
+        filtered = []
+        for item in found:
+            matched = pattern.search(item)
+            if matched is None:
+                continue
+            filtered.append(matched.group(1) if matched.groups() else item)
+        found = filtered
+    return sorted(set(found))
+
+
+def select(variable: Dict[str, Any], available: List[str]) -> Value:
+    """The value Grafana selects when the dashboard is opened as saved"""
+    multi = bool(variable.get("multi") or variable.get("includeAll"))
+    current = (variable.get("current") or {}).get("value")
+    current = current if isinstance(current, list) else [current] if current is not None else []
+
+    if ALL in current and variable.get("includeAll"):
+        if variable.get("allValue"):
+            return Value(available, True, variable["allValue"])
+        return Value(available, True)
+
+    chosen = [str(item) for item in current if str(item) in available]
+    if not chosen and available:
+        chosen = available[:1]
+    if not chosen:
+        chosen = [str(item) for item in current]
+    return Value(chosen, multi)
+
+
+def resolve(dashboard: Dict[str, Any], source: VariableSource) -> Dict[str, Value]:
+    """Selected values of every template variable of a dashboard, in dashboard order"""
+    values: Dict[str, Value] = {}
+    for variable in dashboard.get("templating", {}).get("list", []):
+        name = variable.get("name")
+        kind = variable.get("type")
+        if not name or kind in ("datasource", "adhoc"):
+            continue
+        values[name] = select(variable, options(variable, values, source))
+    return values
@@ -0,0 +1,285 @@
+"""
+Offline benchmark of the node rewards pipeline
+
+Replays a `get_node_providers_rewards_calculation` reply, either a recorded
+fixture or a synthetic one at the requested scale, through every stage of
+the ingester and pushes the result to an in-process stub of the
+VictoriaMetrics import API. No network access is needed unless a fixture is
+recorded.
+
+For every stage the throughput, the peak RSS while it ran (the process peak
+where the high-water mark can not be reset) and the memory allocated by a
+single run (traced with tracemalloc) are reported.
+Results can be stored as JSON and compared against a previous run:
+
+    PYTHONPATH=tools/common python tools/node-rewards-scheduler/benchmark_pipeline.py --output before.json
+    PYTHONPATH=tools/common python tools/node-rewards-scheduler/benchmark_pipeline.py --compare before.json
+"""
+
+import argparse
+import json
+import logging
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import node_rewards_ingester as nri
+from rewards_aggregates import aggregate
+from rewards_columns import DailyRewardsColumns
+from rewards_fixtures import load_fixture, record_fixture, save_fixture, synthetic_reply
+from victoria_exporter import ImportStats
+
+DATE = "2025-01-01"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "benchmark-pipeline",
+        description="Benchmark decode, transform, render and push of one day of node rewards",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--fixture",
+        default=None,
+        help="Replay this recorded reply (.gz) instead of a synthetic one",
+    )
+    parser.add_argument(
+        "--record",
+        default=None,
+        metavar="DATE",
+        help="Record the reply of DATE from the IC into --fixture and exit",
+    )
+    parser.add_argument(
+        "--save-synthetic",
+        dest="save_synthetic",
+        default=None,
+        metavar="PATH",
+        help="Store the generated synthetic reply as a fixture",
+    )
+    parser.add_argument(
+        "--providers", type=int, default=500, help="Providers in the synthetic reply"
+    )
+    parser.add_argument(
+        "--nodes", type=int, default=20000, help="Nodes in the synthetic reply"
+    )
+    parser.add_argument(
+        "--iterations", type=int, default=3, help="Timed runs of every stage"
+    )
+    parser.add_argument(
+        "--output", default=None, help="Write the results as JSON to this file"
+    )
+    parser.add_argument(
+        "--compare",
+        default=None,
+        help="JSON results of a previous run to compare against",
+    )
+
+    return parser.parse_args()
+
+
+class StubVictoriaMetrics:
+    """Accepts imports on a local port and only counts what it receives"""
+
+    def __init__(self):
+        stub = self
+        self.requests = 0
+        self.bytes = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                if self.headers.get("Transfer-Encoding") == "chunked":
+                    received = 0
+                    while True:
+                        size = int(self.rfile.readline().strip(), 16)
+                        received += len(self.rfile.read(size + 2)) - 2
+                        if size == 0:
+                            break
+                else:
+                    received = len(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                stub.requests += 1
+                stub.bytes += received
+                self.send_response(204)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+
+def reset_peak_rss() -> bool:
+    """Reset the RSS high-water mark, only supported on Linux"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mib() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Peak of the whole process, ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def measure(name: str, func, iterations: int):
+    """Time `func` and trace the allocations of one extra run"""
+    reset_peak_rss()
+    result = func()
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - started
+    rss = peak_rss_mib()
+
+    # Tracing slows everything down, so it is kept out of the timed runs
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    func()
+    _, traced_peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(
+        stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0
+    )
+
+    return result, {
+        "stage": name,
+        "ops_per_second": iterations / elapsed,
+        "seconds_per_op": elapsed / iterations,
+        "peak_rss_mib": rss,
+        "traced_peak_mib": traced_peak / (1024 * 1024),
+        "retained_blocks": retained,
+    }
+
+
+def run(reply: bytes, iterations: int):
+    stub = StubVictoriaMetrics()
+    pusher = nri.NodeRewardsPusher(stub.url)
+    results = []
+
+    def decode_stage():
+        return nri.NodeRewardsClient._decode_rewards_daily(DATE, reply)
+
+    daily_results, stats = measure("decode", decode_stage, iterations)
+    results.append(stats)
+
+    def transform_stage():
+        columns = DailyRewardsColumns.from_daily_results(daily_results)
+        return columns, list(aggregate(columns))
+
+    (columns, _), stats = measure("transform", transform_stage, iterations)
+    results.append(stats)
+
+    def render_stage():
+        return pusher.render_metrics_for_date(DATE, daily_results, gov_timestamp=time.time())
+
+    samples, stats = measure("render", render_stage, iterations)
+    results.append(stats)
+
+    def encode_stage():
+        encoded = ImportStats()
+        for _ in pusher.exporter.body(samples, encoded):
+            pass
+        return encoded
+
+    encoded, stats = measure("encode", encode_stage, iterations)
+    results.append(stats)
+
+    _, stats = measure("push", lambda: pusher.exporter.push_samples(samples), iterations)
+    results.append(stats)
+
+    pusher.exporter.close()
+    stub.close()
+
+    summary = {
+        "providers": len(columns.provider_id),
+        "nodes": len(columns),
+        "reply_bytes": len(reply),
+        "samples": len(samples),
+        "raw_bytes": encoded.raw_bytes,
+        "wire_bytes": encoded.sent_bytes,
+        "stub_requests": stub.requests,
+    }
+    return summary, results
+
+
+def print_results(summary: dict, results, baseline=None):
+    print(
+        f"{summary['providers']} providers, {summary['nodes']} nodes, "
+        f"{summary['reply_bytes']} reply bytes -> {summary['samples']} samples, "
+        f"{summary['wire_bytes']} bytes on the wire"
+    )
+    print(
+        f"{'stage':<11}{'ops/s':>10}{'ms/op':>11}{'peak rss MiB':>14}"
+        f"{'traced MiB':>12}{'retained blocks':>17}"
+    )
+
+    previous = {stats["stage"]: stats for stats in (baseline or {}).get("stages", [])}
+    for stats in results:
+        line = (
+            f"{stats['stage']:<11}{stats['ops_per_second']:>10.2f}"
+            f"{stats['seconds_per_op'] * 1000:>11.1f}{stats['peak_rss_mib']:>14.1f}"
+            f"{stats['traced_peak_mib']:>12.1f}{stats['retained_blocks']:>17}"
+        )
+        if stats["stage"] in previous:
+            change = stats["seconds_per_op"] / previous[stats["stage"]]["seconds_per_op"] - 1
+            line += f"  {change:+.1%} ms/op"
+        print(line)
+
+
+def main():
+    # The ingester logs every rendered day
+    logging.getLogger().setLevel(logging.WARNING)
+    args = parse_args()
+
+    if args.record:
+        if not args.fixture:
+            sys.exit("--record needs --fixture to know where to store the reply")
+        reply = record_fixture(args.record, args.fixture)
+        print(f"Recorded {len(reply)} bytes for {args.record} into {args.fixture}")
+        return
+
+    if args.fixture:
+        reply = load_fixture(args.fixture)
+    else:
+        reply = synthetic_reply(args.providers, args.nodes)
+        if args.save_synthetic:
+            save_fixture(args.save_synthetic, reply)
+
+    summary, results = run(reply, args.iterations)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(summary, results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "stages": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
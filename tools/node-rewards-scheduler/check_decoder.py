@@ -0,0 +1,168 @@
+"""
+Parity check and benchmark of the streaming rewards decoder
+
+Decodes the same `get_node_providers_rewards_calculation` replies with the
+generic ic-py decoder and with `rewards_decoder`, verifies that both produce
+the same values for every field the pipeline reads and the same
+`DailyRewardsColumns`, and reports how long each decoder takes:
+
+    PYTHONPATH=tools/common python tools/node-rewards-scheduler/check_decoder.py
+    PYTHONPATH=tools/common python tools/node-rewards-scheduler/check_decoder.py --fixture day.json.gz
+
+Exits with status 1 when the decoders disagree. The same parity checks run
+on every test run in tests/test_rewards_decoder.py, this script adds the
+timings and checks recorded fixtures.
+"""
+
+import argparse
+import logging
+import math
+import sys
+import time
+from typing import Any, List
+
+import node_rewards_ingester as nri
+from ic.candid import decode
+from rewards_columns import DailyRewardsColumns
+from rewards_decoder import KEEP, REWARDS_CALCULATION_SPEC, MapOf, decode_rewards_calculation
+from rewards_fixtures import load_fixture, synthetic_reply
+
+DATE = "2025-01-01"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "check-decoder",
+        description="Compare the streaming rewards decoder against the generic candid decoder",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--fixture",
+        action="append",
+        default=[],
+        help="Recorded reply (.gz) to check, can be repeated. Synthetic replies are used otherwise",
+    )
+    parser.add_argument(
+        "--seeds", type=int, default=5, help="Synthetic replies checked, one per seed"
+    )
+    parser.add_argument(
+        "--providers", type=int, default=50, help="Providers in the synthetic replies"
+    )
+    parser.add_argument(
+        "--nodes", type=int, default=2000, help="Nodes in the synthetic replies"
+    )
+    parser.add_argument(
+        "--iterations", type=int, default=3, help="Timed runs of every decoder and reply"
+    )
+
+    return parser.parse_args()
+
+
+def generic_decode(reply: bytes):
+    response = decode(reply, nri.GET_NODE_PROVIDERS_CALCULATION_RESPONSE_TYPE)
+    return nri.NodeRewardsClient._parse_rewards_daily(DATE, response)
+
+
+def fast_decode(reply: bytes):
+    return nri.NodeRewardsClient._daily_results(DATE, decode_rewards_calculation(reply))
+
+
+def project(value: Any, spec) -> Any:
+    """Reduce a generically decoded value to the parts named in `spec`"""
+    if isinstance(value, (list, tuple)) and not isinstance(spec, tuple):
+        return [project(item, spec) for item in value]
+    if spec is KEEP:
+        return value if isinstance(value, (bool, int, float, str)) or value is None else str(value)
+    if isinstance(spec, MapOf):
+        return {str(key): project(item, spec.value) for key, item in value.items()}
+    if isinstance(spec, dict):
+        return {key: project(item, spec[key]) for key, item in value.items() if key in spec}
+    return value
+
+
+def differences(expected: Any, actual: Any, path: str = "", limit: int = 10) -> List[str]:
+    """Paths where two decoded values disagree, NaN equals NaN"""
+    found: List[str] = []
+
+    def walk(a, b, where):
+        if len(found) >= limit:
+            return
+        if isinstance(a, dict) and isinstance(b, dict):
+            for key in a.keys() | b.keys():
+                if key not in a or key not in b:
+                    found.append(f"{where}/{key}: only in {'generic' if key in a else 'fast'}")
+                else:
+                    walk(a[key], b[key], f"{where}/{key}")
+        elif isinstance(a, list) and isinstance(b, list):
+            if len(a) != len(b):
+                found.append(f"{where}: {len(a)} != {len(b)} items")
+                return
+            for index, (x, y) in enumerate(zip(a, b)):
+                walk(x, y, f"{where}[{index}]")
+        elif isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+            return
+        elif a != b or type(a) is not type(b):
+            found.append(f"{where}: {a!r} != {b!r}")
+
+    walk(expected, actual, path)
+    return found
+
+
+def column_differences(expected: DailyRewardsColumns, actual: DailyRewardsColumns) -> List[str]:
+    found = []
+    for name in DailyRewardsColumns.__slots__:
+        found.extend(differences(list(getattr(expected, name)), list(getattr(actual, name)), name))
+    return found
+
+
+def timed(func, reply: bytes, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func(reply)
+    return (time.perf_counter() - started) / iterations
+
+
+def check(name: str, reply: bytes, iterations: int) -> bool:
+    expected = generic_decode(reply)
+    actual = fast_decode(reply)
+
+    spec = REWARDS_CALCULATION_SPEC["Ok"]
+    found = differences(project(expected, spec), actual)
+    found += column_differences(
+        DailyRewardsColumns.from_daily_results(expected),
+        DailyRewardsColumns.from_daily_results(actual),
+    )
+
+    generic_seconds = timed(generic_decode, reply, iterations)
+    fast_seconds = timed(fast_decode, reply, iterations)
+    status = "✅" if not found else "❌"
+    print(
+        f"{status} {name}: {len(reply)} bytes, {len(actual.get('provider_results', {}))} providers, "
+        f"generic {generic_seconds * 1000:.1f} ms, fast {fast_seconds * 1000:.1f} ms "
+        f"({generic_seconds / fast_seconds:.1f}x)"
+    )
+    for difference in found:
+        print(f"    {difference}")
+    return not found
+
+
+def main():
+    # The ingester logs every decoded day
+    logging.getLogger().setLevel(logging.WARNING)
+    args = parse_args()
+
+    if args.fixture:
+        replies = [(path, load_fixture(path)) for path in args.fixture]
+    else:
+        replies = [
+            (f"synthetic seed {seed}", synthetic_reply(args.providers, args.nodes, seed=seed))
+            for seed in range(args.seeds)
+        ]
+
+    ok = all([check(name, reply, args.iterations) for name, reply in replies])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Connection pooling HTTP client for the IC agent
+
+The stock `ic.client.Client` opens a new connection (and TLS handshake) for
+every request, both in the blocking and in the asyncio variant.
+`PooledClient` keeps connections to the boundary node alive and, when the
+`h2` package is installed, multiplexes concurrent queries over HTTP/2.
+"""
+
+import contextlib
+import logging
+
+import httpx
+from ic.agent import Agent, sign_request
+from ic.client import Client
+from ic.principal import Principal
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+CBOR_HEADERS = {"Content-Type": "application/cbor"}
+
+
+# Reject code of errors that may succeed when retried, see the IC interface spec
+SYS_TRANSIENT = 2
+
+
+class QueryRejected(Exception):
+    """The replica rejected a query call"""
+
+    def __init__(self, message: str, reject_code: int = 0):
+        super().__init__(message)
+        self.reject_code = reject_code
+
+    @property
+    def retryable(self) -> bool:
+        return self.reject_code == SYS_TRANSIENT
+
+
+def _query_envelope(agent: Agent, canister_id: str, method_name: str, arg: bytes) -> bytes:
+    req = {
+        "request_type": "query",
+        "sender": agent.identity.sender().bytes,
+        "canister_id": Principal.from_str(canister_id).bytes,
+        "method_name": method_name,
+        "arg": arg,
+        "ingress_expiry": agent.get_expiry_date(),
+    }
+    _, data = sign_request(req, agent.identity)
+    return data
+
+
+def _reply_bytes(result, canister_id: str, method_name: str) -> bytes:
+    if type(result) != dict or "status" not in result:
+        raise ValueError("Malformed result: " + str(result))
+    if result["status"] == "rejected":
+        raise QueryRejected(
+            f"{canister_id}.{method_name} rejected: {result.get('reject_message')}",
+            result.get("reject_code", 0),
+        )
+    return result["reply"]["arg"]
+
+
+def query_reply(agent: Agent, canister_id: str, method_name: str, arg: bytes) -> bytes:
+    """
+    Same as `Agent.query_raw` but returns the undecoded candid reply
+
+    Keeping decoding separate lets callers measure it and pick the decoder.
+    """
+    data = _query_envelope(agent, canister_id, method_name, arg)
+    return _reply_bytes(agent.query_endpoint(canister_id, data), canister_id, method_name)
+
+
+async def query_reply_async(agent: Agent, canister_id: str, method_name: str, arg: bytes) -> bytes:
+    """Asyncio variant of `query_reply`"""
+    data = _query_envelope(agent, canister_id, method_name, arg)
+    result = await agent.query_endpoint_async(canister_id, data)
+    return _reply_bytes(result, canister_id, method_name)
+
+
+class PooledClient(Client):
+    """
+    Drop-in replacement for `ic.client.Client` reusing connections
+
+    Args:
+        url: Boundary node url
+        max_connections: Upper bound of open connections per pool
+        timeout: Timeout in seconds for a single request
+    """
+
+    def __init__(self, url: str = "https://ic0.app", max_connections: int = 10, timeout: float = 30):
+        super().__init__(url)
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        self._timeout = timeout
+        # httpx.Client is safe to share between the backfill worker threads
+        self._http = httpx.Client(
+            http2=HTTP2_AVAILABLE, limits=self._limits, timeout=self._timeout
+        )
+        self._async_http = None
+
+    def _endpoint(self, canister_id: str, kind: str) -> str:
+        return f"{self.url}/api/v2/canister/{canister_id}/{kind}"
+
+    def query(self, canister_id, data):
+        ret = self._http.post(self._endpoint(canister_id, "query"), content=data, headers=CBOR_HEADERS)
+        # Surface HTTP errors with their status instead of failing to decode the body
+        ret.raise_for_status()
+        return ret.content
+
+    def call(self, canister_id, req_id, data):
+        self._http.post(self._endpoint(canister_id, "call"), content=data, headers=CBOR_HEADERS)
+        return req_id
+
+    def read_state(self, canister_id, data):
+        ret = self._http.post(self._endpoint(canister_id, "read_state"), content=data, headers=CBOR_HEADERS)
+        return ret.content
+
+    async def query_async(self, canister_id, data):
+        if self._async_http is None:
+            return await super().query_async(canister_id, data)
+
+        ret = await self._async_http.post(
+            self._endpoint(canister_id, "query"), content=data, headers=CBOR_HEADERS
+        )
+        ret.raise_for_status()
+        return ret.content
+
+    @contextlib.asynccontextmanager
+    async def async_session(self):
+        """
+        Share one async connection pool between all queries issued inside the block
+
+        The async pool is bound to the running event loop, so it only lives
+        for the duration of the block.
+        """
+        async with httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE, limits=self._limits, timeout=self._timeout
+        ) as client:
+            self._async_http = client
+            try:
+                yield self
+            finally:
+                self._async_http = None
+
+    def close(self):
+        self._http.close()
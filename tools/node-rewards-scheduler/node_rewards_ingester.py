@@ -3,20 +3,46 @@ Node Rewards Scheduler for VictoriaMetrics
 Directly interacts with IC canisters to fetch node rewards data and push to VictoriaMetrics
 """
 
+import asyncio
+import json
 import logging
 import os
+import statistics
+import threading
 import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
-from functools import wraps
-from typing import Any, Dict, Optional
-from urllib.parse import urljoin
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
 import requests
+import yaml
 from ic.agent import Agent
-from ic.candid import Types, encode
-from ic.client import Client
+from ic.candid import Types, decode, encode
 from ic.identity import Identity
 
+from downsampling import DownsampleWorker, Watermarks, load_specs
+from ic_client import PooledClient, query_reply, query_reply_async
+from instrumentation import SIZE_BUCKETS, Registry
+from push_spool import PushSpool
+from resilience import (
+    CircuitOpenError,
+    ErrorKind,
+    RetryPolicy,
+    breaker_for,
+    classify,
+    deadline,
+    retry,
+)
+
+from rewards_aggregates import ROLLUP_PREFIX, aggregate
+from rewards_cache import RewardsCache
+from rewards_columns import MISSING_INT, DailyRewardsColumns
+from rewards_decoder import CandidDecodeError, decode_rewards_calculation
+from rewards_jobs import DONE, JobTable
+from rewards_range import RewardsRange, chunk_days, plan_days
+from victoria_exporter import ImportStats, Sample, VictoriaExporter
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -25,75 +51,201 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Self-instrumentation, pushed together with the data and optionally served on METRICS_PORT
+metrics = Registry("node_rewards_ingester_")
+SELF_METRICS_PUSH = os.environ.get("SELF_METRICS_PUSH", "true").lower() == "true"
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
 
-def retry_on_timeout(max_attempts=3, initial_delay=2, backoff_factor=2):
+
+class RateLimiter:
     """
-    Decorator to retry a function on timeout or connection errors with exponential backoff
-    
+    Thread-safe token bucket shared by all workers talking to the same endpoint
+
     Args:
-        max_attempts: Maximum number of retry attempts
-        initial_delay: Initial delay in seconds before first retry
-        backoff_factor: Multiplier for delay between retries
+        rate: Tokens added per second
+        burst: Maximum number of tokens that can be accumulated
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available"""
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._last) * self.rate
+                )
+                self._last = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class EndpointLimiter:
+    """
+    Caps the number of in-flight requests to an endpoint and paces them
+    through a shared rate limiter
     """
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            delay = initial_delay
-            last_exception = None
-            
-            for attempt in range(max_attempts):
-                try:
-                    return func(*args, **kwargs)
-                except (
-                    requests.exceptions.Timeout,
-                    requests.exceptions.ConnectionError,
-                    TimeoutError,
-                    ConnectionError,
-                    Exception
-                ) as e:
-                    last_exception = e
-                    error_msg = str(e)
-                    
-                    # Check if it's a timeout-related error
-                    is_timeout = (
-                        isinstance(e, (requests.exceptions.Timeout, TimeoutError)) or
-                        "timed out" in error_msg.lower() or
-                        "timeout" in error_msg.lower()
-                    )
-                    
-                    # Check if it's a connection error
-                    is_connection_error = isinstance(e, (requests.exceptions.ConnectionError, ConnectionError))
-                    
-                    # Only retry on timeout or connection errors
-                    if not (is_timeout or is_connection_error):
-                        # Re-raise if it's not a retryable error
-                        raise
-                    
-                    if attempt < max_attempts - 1:
-                        logger.warning(
-                            f"Attempt {attempt + 1}/{max_attempts} failed with {type(e).__name__}: {error_msg}. "
-                            f"Retrying in {delay} seconds..."
-                        )
-                        time.sleep(delay)
-                        delay *= backoff_factor
-                    else:
-                        logger.error(
-                            f"All {max_attempts} attempts failed. Last error: {error_msg}"
-                        )
-                        raise last_exception
-            
-            # This should never be reached, but just in case
-            raise last_exception
-        
-        return wrapper
-    return decorator
+
+    def __init__(self, max_concurrency: int, rate_limiter: Optional[RateLimiter] = None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate_limiter = rate_limiter
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+        return False
 
 
 IC_URL = "https://ic0.app"
 
+# Backfill tuning, overridable through the environment
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", "4"))
+# Number of days fetched as one range and pushed in one bulk import during backfill
+BACKFILL_PREFETCH_DAYS = int(os.environ.get("BACKFILL_PREFETCH_DAYS", "20"))
+# Upper bound of the replies of a range query chunk, in flight and decoded together
+RANGE_CHUNK_MAX_BYTES = int(os.environ.get("RANGE_CHUNK_MAX_BYTES", str(64 * 1024**2)))
+# Assumed reply size of a single day until the first reply was seen
+RANGE_REPLY_BYTES_ESTIMATE = int(
+    os.environ.get("RANGE_REPLY_BYTES_ESTIMATE", str(3 * 1024**2))
+)
+IC_MAX_CONCURRENT_QUERIES = int(os.environ.get("IC_MAX_CONCURRENT_QUERIES", "4"))
+IC_QUERIES_PER_SECOND = float(os.environ.get("IC_QUERIES_PER_SECOND", "2"))
+VICTORIA_MAX_CONCURRENT_PUSHES = int(
+    os.environ.get("VICTORIA_MAX_CONCURRENT_PUSHES", "2")
+)
+
+# Local cache of decoded daily results, disabled when the directory is empty
+REWARDS_CACHE_DIR = os.environ.get("REWARDS_CACHE_DIR", "")
+REWARDS_CACHE_MAX_AGE_DAYS = int(os.environ.get("REWARDS_CACHE_MAX_AGE_DAYS", "400"))
+REWARDS_CACHE_MAX_BYTES = int(
+    os.environ.get("REWARDS_CACHE_MAX_BYTES", str(512 * 1024**2))
+)
+
+VICTORIA_COMPRESSION = os.environ.get("VICTORIA_COMPRESSION", "gzip")
+# Wire format used for imports, "prometheus" text or VictoriaMetrics "json" lines
+VICTORIA_EXPORT_FORMAT = os.environ.get("VICTORIA_EXPORT_FORMAT", "prometheus")
+
+# Decode rewards replies with the streaming decoder, which skips unused fields
+CANDID_FAST_DECODE = os.environ.get("CANDID_FAST_DECODE", "true").lower() == "true"
+
+# How long governance reward events are memoized before querying the canister again
+GOVERNANCE_CACHE_TTL_SECONDS = int(os.environ.get("GOVERNANCE_CACHE_TTL_SECONDS", "3600"))
+
+# How far back gaps are detected, should not exceed the VictoriaMetrics retention
+BACKFILL_MAX_LOOKBACK_DAYS = int(os.environ.get("BACKFILL_MAX_LOOKBACK_DAYS", "365"))
+# A day with fewer providers than this fraction of the usual count is re-pushed
+BACKFILL_COMPLETENESS_RATIO = float(
+    os.environ.get("BACKFILL_COMPLETENESS_RATIO", "0.9")
+)
+
+# Failed pushes are spooled here and replayed later, disabled when empty
+PUSH_SPOOL_DIR = os.environ.get("PUSH_SPOOL_DIR", "")
+PUSH_SPOOL_MAX_BYTES = int(os.environ.get("PUSH_SPOOL_MAX_BYTES", str(256 * 1024**2)))
+PUSH_SPOOL_FLUSH_SECONDS = float(os.environ.get("PUSH_SPOOL_FLUSH_SECONDS", "30"))
+
+# Providers whose nodes get per-node series, comma separated or "*" for all.
+# When empty the node_provider_id of the generated Prometheus config is used.
+DETAIL_PROVIDER_IDS = os.environ.get("DETAIL_PROVIDER_IDS", "")
+PROMETHEUS_CONFIG_PATH = os.environ.get(
+    "PROMETHEUS_CONFIG_PATH", "/config/prometheus/config.yaml"
+)
+
+# Job table of the daily scheduler, kept in memory only when empty
+SCHEDULER_STATE_FILE = os.environ.get("SCHEDULER_STATE_FILE", "")
+# Days the scheduler keeps track of and catches up if they are missing
+SCHEDULER_CATCHUP_DAYS = int(os.environ.get("SCHEDULER_CATCHUP_DAYS", "40"))
+# How often a day whose result is not published yet is polled
+SCHEDULER_POLL_SECONDS = float(os.environ.get("SCHEDULER_POLL_SECONDS", "600"))
+# Failed days are retried after this delay, doubling up to the maximum
+SCHEDULER_RETRY_BASE_SECONDS = float(os.environ.get("SCHEDULER_RETRY_BASE_SECONDS", "300"))
+SCHEDULER_RETRY_MAX_SECONDS = float(
+    os.environ.get("SCHEDULER_RETRY_MAX_SECONDS", str(6 * 3600))
+)
+
+# Hourly and daily downsampled series of the DOWNSAMPLE_METRICS, see downsampling.py
+DOWNSAMPLE_ENABLED = os.environ.get("DOWNSAMPLE_ENABLED", "false").lower() == "true"
+# Watermarks of the downsampled windows, kept in memory only when empty
+DOWNSAMPLE_STATE_FILE = os.environ.get("DOWNSAMPLE_STATE_FILE", "")
+DOWNSAMPLE_INTERVAL_SECONDS = float(os.environ.get("DOWNSAMPLE_INTERVAL_SECONDS", "300"))
+# How far back metrics without a watermark are downsampled
+DOWNSAMPLE_BACKFILL_DAYS = int(os.environ.get("DOWNSAMPLE_BACKFILL_DAYS", "30"))
+DOWNSAMPLE_MAX_WINDOWS_PER_RUN = int(os.environ.get("DOWNSAMPLE_MAX_WINDOWS_PER_RUN", "744"))
+
+# Total seconds a single canister query or push may spend retrying
+IC_RETRY_DEADLINE_SECONDS = float(os.environ.get("IC_RETRY_DEADLINE_SECONDS", "120"))
+VICTORIA_RETRY_DEADLINE_SECONDS = float(
+    os.environ.get("VICTORIA_RETRY_DEADLINE_SECONDS", "60")
+)
+# Consecutive transient failures after which calls to an endpoint fail fast
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.environ.get("CIRCUIT_RESET_SECONDS", "60"))
+# Upper bound of rendering and pushing a single day, retries included
+DAY_DEADLINE_SECONDS = float(os.environ.get("DAY_DEADLINE_SECONDS", "300"))
+
+IC_RETRY_POLICY = RetryPolicy(
+    max_attempts=5, initial_delay=3, max_delay=30, deadline=IC_RETRY_DEADLINE_SECONDS
+)
+VICTORIA_RETRY_POLICY = RetryPolicy(
+    max_attempts=3, initial_delay=5, max_delay=30, deadline=VICTORIA_RETRY_DEADLINE_SECONDS
+)
+
 NODE_REWARDS_CANISTER_ID = "sgymv-uiaaa-aaaaa-aaaia-cai"
 GOVERNANCE_CANISTER_ID = "rrkah-fqaaa-aaaaa-aaaaq-cai"  # NNS Governance canister
 
+
+class IngestTarget(NamedTuple):
+    """A node rewards canister to ingest, series are labelled with `network`"""
+
+    network: str
+    ic_url: str
+    canister_id: str
+    governance_canister_id: str = GOVERNANCE_CANISTER_ID
+
+
+MAINNET = IngestTarget("mainnet", IC_URL, NODE_REWARDS_CANISTER_ID)
+
+
+def load_targets(config: Optional[str] = None) -> List[IngestTarget]:
+    """
+    Parse the INGEST_TARGETS configuration, a JSON list of objects, e.g.
+
+        [{"network": "mainnet", "ic_url": "https://ic0.app", "canister_id": "sgymv-uiaaa-aaaaa-aaaia-cai"},
+         {"network": "testnet", "ic_url": "https://...", "canister_id": "...", "governance_canister_id": "..."}]
+
+    Only mainnet is ingested when nothing is configured.
+    """
+    if config is None:
+        config = os.environ.get("INGEST_TARGETS", "")
+    if not config.strip():
+        return [MAINNET]
+
+    targets = [IngestTarget(**entry) for entry in json.loads(config)]
+    networks = [target.network for target in targets]
+    if len(set(networks)) != len(networks):
+        raise ValueError(f"Network names of INGEST_TARGETS must be unique: {networks}")
+    return targets
+
 ###################### TYPE DEFINITIONS ###########################
 DATE_UTC_TYPE = Types.Record(
     {
@@ -183,6 +335,8 @@ DAILY_RESULTS_TYPE = Types.Record(
     }
 )
 
+REWARDS_CALCULATION_METHOD = "get_node_providers_rewards_calculation"
+
 GET_NODE_PROVIDERS_CALCULATION_RESPONSE_TYPE = Types.Variant(
     {
         "Ok": DAILY_RESULTS_TYPE,
@@ -216,19 +370,234 @@ LIST_NODE_PROVIDER_REWARDS_RESPONSE_TYPE = Types.Record({
 })
 
 
+class NoDataAvailable(ValueError):
+    """The canister has no result for the date, usually because it is not published yet"""
+
+
 class NodeRewardsClient:
     """Client for interacting with the node rewards canister"""
 
-    def __init__(self, ic_url: str, canister_id: str):
+    def __init__(
+        self,
+        ic_url: str,
+        canister_id: str,
+        limiter: Optional[EndpointLimiter] = None,
+        cache: Optional[RewardsCache] = None,
+        client: Optional[PooledClient] = None,
+        governance_canister_id: str = GOVERNANCE_CANISTER_ID,
+    ):
         # Create anonymous identity
         self.identity = Identity()
-        self.client = Client(url=ic_url)
+        self.limiter = limiter or EndpointLimiter(
+            IC_MAX_CONCURRENT_QUERIES, RateLimiter(IC_QUERIES_PER_SECOND)
+        )
+        # Clients of canisters behind the same boundary node share its connection pool
+        self.client = client or PooledClient(
+            url=ic_url, max_connections=self.limiter.max_concurrency
+        )
         self.agent = Agent(self.identity, self.client)
+        self.breaker = endpoint_breaker(ic_url)
         self.canister_id = canister_id
+        self.governance_canister_id = governance_canister_id
+        self.cache = cache
+
+        self._governance_lock = threading.Lock()
+        self._governance_events: Optional[List[Dict[str, Any]]] = None
+        self._governance_expires_at = 0.0
+        # Largest rewards reply seen so far, sizes the chunks of range queries
+        self.largest_reply = 0
+
+    def _query(self, canister_id: str, method: str, arg_bytes: bytes, return_type):
+        """Run a query call while respecting the endpoint limits"""
+        reply = self._query_reply(canister_id, method, arg_bytes)
+        return self._decode(method, reply, return_type)
+
+    def _query_reply(self, canister_id: str, method: str, arg_bytes: bytes) -> bytes:
+        """Raw reply of a query call, see `_query`"""
+        # Fail fast without waiting for a rate limiter token while the circuit is open
+        self.breaker.before_call()
+        try:
+            with self.limiter:
+                with metrics.time("canister_query", method=method):
+                    reply = query_reply(self.agent, canister_id, method, arg_bytes)
+        except Exception as e:
+            self.breaker.record_failure(e)
+            raise
+        self.breaker.record_success()
+
+        metrics.observe(
+            "reply_bytes", len(reply), buckets=SIZE_BUCKETS, method=method
+        )
+        return reply
+
+    @staticmethod
+    def _decode(method: str, reply: bytes, return_type):
+        with metrics.time("candid_decode", method=method):
+            return decode(reply, return_type)
+
+    async def _query_reply_async(
+        self,
+        semaphore: asyncio.Semaphore,
+        canister_id: str,
+        method: str,
+        arg_bytes: bytes,
+    ) -> bytes:
+        """Asyncio variant of `_query_reply`, the rate limiter is shared with the blocking path"""
+        async with semaphore:
+            self.breaker.before_call()
+            if self.limiter.rate_limiter is not None:
+                await asyncio.to_thread(self.limiter.rate_limiter.acquire)
+            try:
+                with metrics.time("canister_query", method=method):
+                    reply = await query_reply_async(
+                        self.agent, canister_id, method, arg_bytes
+                    )
+            except Exception as e:
+                self.breaker.record_failure(e)
+                raise
+            self.breaker.record_success()
+
+        metrics.observe(
+            "reply_bytes", len(reply), buckets=SIZE_BUCKETS, method=method
+        )
+        return reply
+
+    def _store(self, date: str, result: Dict[str, Any]):
+        if self.cache is None or not result:
+            return
+        try:
+            self.cache.put(date, result)
+        except OSError as e:
+            logger.warning(f"Failed to cache rewards for {date}: {e}")
 
-    @retry_on_timeout(max_attempts=5, initial_delay=3, backoff_factor=2)
     def get_rewards_daily(self, date: str) -> Dict[str, Any]:
-        """Fetch daily rewards data from node rewards canister"""
+        """Fetch daily rewards data, served from the local cache when possible"""
+        if self.cache is not None:
+            cached = self.cache.get(date)
+            metrics.inc(
+                "rewards_cache_requests_total",
+                result="miss" if cached is None else "hit",
+            )
+            if cached is not None:
+                logger.info(
+                    f"Loaded rewards for {date} from cache ({len(cached.get('provider_results', {}))} providers)"
+                )
+                return cached
+
+        result = self._fetch_rewards_daily(date)
+        self._store(date, result)
+        return result
+
+    def prefetch_rewards_daily(self, dates: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Fetch several days at once by pipelining the canister queries
+
+        Cached days are served from disk, the remaining queries are issued
+        concurrently over a shared connection pool. Days that fail are
+        left out of the result so callers can fall back to
+        `get_rewards_daily`, which retries.
+        """
+        results = {}
+        missing = []
+        for date in dates:
+            cached = self.cache.get(date) if self.cache is not None else None
+            if self.cache is not None:
+                metrics.inc(
+                    "rewards_cache_requests_total",
+                    result="miss" if cached is None else "hit",
+                )
+            if cached is not None:
+                results[date] = cached
+            else:
+                missing.append(date)
+
+        if missing:
+            started = time.monotonic()
+            fetched = asyncio.run(self._fetch_many_async(missing))
+            logger.info(
+                f"Pipelined {len(missing)} rewards queries in {time.monotonic() - started:.1f}s "
+                f"({len(fetched)} succeeded, {len(dates) - len(missing)} served from cache)"
+            )
+            results.update(fetched)
+
+        return results
+
+    def get_rewards_range(self, start: str, end: str) -> RewardsRange:
+        """Fetch every day from `start` to `end`, both included, see `fetch_rewards_days`"""
+        return self.fetch_rewards_days(plan_days(start, end))
+
+    def fetch_rewards_days(self, dates: List[str]) -> RewardsRange:
+        """
+        Fetch several days and merge them into one date indexed RewardsRange
+
+        The canister answers one day per query, so the days are split into
+        chunks whose replies together stay below RANGE_CHUNK_MAX_BYTES, sized
+        by the largest reply seen so far. The queries of a chunk are
+        pipelined, days that fail there are queried again one at a time with
+        retries. Days without a published result are recorded as
+        NoDataAvailable errors.
+        """
+        rewards_range = RewardsRange(dates)
+        started = time.monotonic()
+
+        reply_bytes = self.largest_reply or RANGE_REPLY_BYTES_ESTIMATE
+        for chunk in chunk_days(rewards_range.dates, reply_bytes, RANGE_CHUNK_MAX_BYTES):
+            try:
+                fetched = self.prefetch_rewards_daily(chunk)
+            except Exception as e:
+                logger.warning(f"Failed to prefetch rewards for {chunk[0]}..{chunk[-1]}: {e}")
+                fetched = {}
+            for date, daily_results in fetched.items():
+                rewards_range.add(date, daily_results)
+
+        for date in rewards_range.missing():
+            try:
+                daily_results = self.get_rewards_daily(date)
+            except Exception as e:
+                rewards_range.fail(date, e)
+                continue
+            if daily_results:
+                rewards_range.add(date, daily_results)
+            else:
+                rewards_range.fail(date, NoDataAvailable(f"No rewards data available for {date}"))
+
+        logger.info(
+            f"Fetched {len(rewards_range)}/{len(rewards_range.dates)} days "
+            f"({rewards_range.start}..{rewards_range.end}) in {time.monotonic() - started:.1f}s"
+        )
+        return rewards_range
+
+    async def _fetch_many_async(self, dates: List[str]) -> Dict[str, Dict[str, Any]]:
+        semaphore = asyncio.Semaphore(self.limiter.max_concurrency)
+
+        async def fetch(date):
+            reply = await self._query_reply_async(
+                semaphore,
+                self.canister_id,
+                REWARDS_CALCULATION_METHOD,
+                self._rewards_daily_arg(date),
+            )
+            self.largest_reply = max(self.largest_reply, len(reply))
+            return self._decode_rewards_daily(date, reply)
+
+        async with self.client.async_session():
+            responses = await asyncio.gather(
+                *(fetch(date) for date in dates), return_exceptions=True
+            )
+
+        results = {}
+        for date, response in zip(dates, responses):
+            if isinstance(response, Exception):
+                logger.warning(f"Pipelined query for {date} failed: {response}")
+                continue
+            if response:
+                self._store(date, response)
+                results[date] = response
+
+        return results
+
+    @staticmethod
+    def _rewards_daily_arg(date: str) -> bytes:
         parsed_date = datetime.strptime(date, "%Y-%m-%d")
         arg_value = {
             "day": {
@@ -237,23 +606,72 @@ class NodeRewardsClient:
                 "day": parsed_date.day,
             }
         }
-        arg_bytes = encode(
-            [{"type": GET_REWARDS_DAILY_REQUEST_TYPE, "value": arg_value}]
-        )
+        return encode([{"type": GET_REWARDS_DAILY_REQUEST_TYPE, "value": arg_value}])
 
-        response = self.agent.query_raw(
+    @retry(IC_RETRY_POLICY, registry=metrics)
+    def _fetch_rewards_daily(self, date: str) -> Dict[str, Any]:
+        """Fetch daily rewards data from node rewards canister"""
+        reply = self._query_reply(
             self.canister_id,
-            "get_node_providers_rewards_calculation",
-            arg_bytes,
-            GET_NODE_PROVIDERS_CALCULATION_RESPONSE_TYPE,
+            REWARDS_CALCULATION_METHOD,
+            self._rewards_daily_arg(date),
         )
+        self.largest_reply = max(self.largest_reply, len(reply))
+        return self._decode_rewards_daily(date, reply)
+
+    @classmethod
+    def _decode_rewards_daily(cls, date: str, reply: bytes) -> Dict[str, Any]:
+        """Decode a raw rewards calculation reply, preferring the streaming decoder"""
+        if CANDID_FAST_DECODE:
+            try:
+                with metrics.time(
+                    "candid_decode", method=REWARDS_CALCULATION_METHOD, decoder="fast"
+                ):
+                    result = decode_rewards_calculation(reply)
+            except CandidDecodeError as e:
+                metrics.inc("candid_fast_decode_fallbacks_total")
+                logger.warning(
+                    f"⚠️  Streaming decode of the rewards for {date} failed, "
+                    f"falling back to the generic decoder: {e}"
+                )
+            else:
+                return cls._daily_results(date, result)
 
+        response = cls._decode(
+            REWARDS_CALCULATION_METHOD, reply, GET_NODE_PROVIDERS_CALCULATION_RESPONSE_TYPE
+        )
+        return cls._parse_rewards_daily(date, response)
+
+    @classmethod
+    def _parse_rewards_daily(cls, date: str, response) -> Dict[str, Any]:
+        """Convert a decoded `get_node_providers_rewards_calculation` response"""
         if not response or len(response) == 0:
             logger.error(f"Empty response for {date}")
             return {}
 
         result = response[0].get("value", {})
+        if "Ok" in result:
+            daily_results = result["Ok"]
+            # Convert lists of tuples to dictionaries for easier processing
+            # provider_results: [[Principal, {...}], ...] -> {Principal: {...}}
+            # subnets_failure_rate: [[Principal, float], ...] -> {Principal: float}
+            result = {
+                "Ok": {
+                    "provider_results": {
+                        str(principal): provider_data
+                        for principal, provider_data in daily_results.get("provider_results", [])
+                    },
+                    "subnets_failure_rate": {
+                        str(principal): failure_rate
+                        for principal, failure_rate in daily_results.get("subnets_failure_rate", [])
+                    },
+                }
+            }
+        return cls._daily_results(date, result)
 
+    @staticmethod
+    def _daily_results(date: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Unpack the `Ok` variant of a rewards calculation keyed by principal text"""
         if "Err" in result:
             error_msg = result["Err"]
             logger.error(f"Canister returned error for {date}: {error_msg}")
@@ -264,32 +682,49 @@ class NodeRewardsClient:
                 f"Unexpected result, contains neither `Err` nur `Ok`: {result}"
             )
 
-        daily_results = result["Ok"]
+        result_dict = result["Ok"]
+        logger.info(
+            f"Successfully fetched rewards for {date} ({len(result_dict['provider_results'])} providers)"
+        )
+        return result_dict
 
-        # Convert lists of tuples to dictionaries for easier processing
-        # provider_results: [[Principal, {...}], ...] -> {Principal: {...}}
-        provider_results_dict = {}
-        for principal, provider_data in daily_results.get("provider_results", []):
-            provider_results_dict[str(principal)] = provider_data
+    def invalidate_governance_cache(self):
+        """Drop memoized governance data so the next lookup queries the canister"""
+        with self._governance_lock:
+            self._governance_events = None
+            self._governance_expires_at = 0.0
 
-        # subnets_failure_rate: [[Principal, float], ...] -> {Principal: float}
-        subnets_failure_rate_dict = {}
-        for principal, failure_rate in daily_results.get("subnets_failure_rate", []):
-            subnets_failure_rate_dict[str(principal)] = failure_rate
+    def get_governance_reward_events(self) -> List[Dict[str, Any]]:
+        """
+        Return all governance node provider reward distributions, newest first
 
-        result_dict = {
-            "provider_results": provider_results_dict,
-            "subnets_failure_rate": subnets_failure_rate_dict,
-        }
+        The result is memoized for GOVERNANCE_CACHE_TTL_SECONDS. Concurrent
+        callers wait for a single in-flight query instead of issuing their own.
+        """
+        with self._governance_lock:
+            if (
+                self._governance_events is not None
+                and time.monotonic() < self._governance_expires_at
+            ):
+                return self._governance_events
 
-        logger.info(
-            f"Successfully fetched rewards for {date} ({len(provider_results_dict)} providers)"
-        )
-        return result_dict
+            events = self._fetch_governance_reward_events()
+            self._governance_events = events
+            self._governance_expires_at = time.monotonic() + GOVERNANCE_CACHE_TTL_SECONDS
+            return events
 
-    @retry_on_timeout(max_attempts=5, initial_delay=3, backoff_factor=2)
-    def get_latest_governance_reward_event(self) -> Optional[float]:
-        """Fetch latest governance reward event timestamp from governance canister"""
+    @staticmethod
+    def _parse_date(value) -> Optional[str]:
+        """Convert an optional candid date record to YYYY-MM-DD"""
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if not value:
+            return None
+        return f"{value['year']:04d}-{value['month']:02d}-{value['day']:02d}"
+
+    @retry(IC_RETRY_POLICY, registry=metrics)
+    def _fetch_governance_reward_events(self) -> List[Dict[str, Any]]:
+        """Fetch the governance reward events from governance canister"""
 
         arg_bytes = encode(
             [
@@ -302,8 +737,8 @@ class NodeRewardsClient:
             ]
         )
 
-        response = self.agent.query_raw(
-            GOVERNANCE_CANISTER_ID,
+        response = self._query(
+            self.governance_canister_id,
             "list_node_provider_rewards",
             arg_bytes,
             LIST_NODE_PROVIDER_REWARDS_RESPONSE_TYPE,
@@ -311,38 +746,237 @@ class NodeRewardsClient:
 
         if not response or len(response) == 0:
             logger.warning("Empty response from governance canister")
-            return None
+            return []
 
         result = response[0].get("value", {})
-        rewards_list = result.get("rewards", [])
 
-        if rewards_list and len(rewards_list) > 0:
-            first_reward = rewards_list[0]
-            timestamp = first_reward.get("timestamp")
-            if timestamp:
-                logger.info(f"Latest governance reward timestamp: {timestamp}")
-                return float(timestamp)
+        events = []
+        for reward in result.get("rewards", []):
+            timestamp = reward.get("timestamp")
+            if not timestamp:
+                continue
+
+            registry_version = reward.get("registry_version")
+            if isinstance(registry_version, list):
+                registry_version = registry_version[0] if registry_version else None
+
+            events.append(
+                {
+                    "timestamp": float(timestamp),
+                    "start_date": self._parse_date(reward.get("start_date")),
+                    "end_date": self._parse_date(reward.get("end_date")),
+                    "registry_version": registry_version,
+                }
+            )
 
+        events.sort(key=lambda event: event["timestamp"], reverse=True)
+        logger.info(f"Fetched {len(events)} governance reward events")
+        return events
+
+    def get_latest_governance_reward_event(self) -> Optional[float]:
+        """Latest governance reward event timestamp from governance canister"""
+        events = self.get_governance_reward_events()
+        if not events:
+            return None
+
+        timestamp = events[0]["timestamp"]
+        logger.info(f"Latest governance reward timestamp: {timestamp}")
+        return timestamp
+
+
+# Marks that the governance timestamp was not provided by the caller and has to be queried
+FETCH_GOVERNANCE = object()
+
+# Node level metrics, one series per node and day
+NODE_METRICS = ("performance_multiplier", "original_failure_rate", "relative_failure_rate")
+
+
+def estimate_series(samples: List[Sample]) -> Dict[str, int]:
+    """Number of series of a rendered day per scope: node, provider, rollup and other"""
+    counts = {"node": 0, "provider": 0, "rollup": 0, "other": 0}
+    for sample in samples:
+        if sample.name in NODE_METRICS:
+            counts["node"] += 1
+        elif sample.name.startswith(ROLLUP_PREFIX):
+            counts["rollup"] += 1
+        elif "provider_id" in sample.labels:
+            counts["provider"] += 1
+        else:
+            counts["other"] += 1
+    return counts
+
+
+def load_detail_providers(
+    config: str = DETAIL_PROVIDER_IDS, prometheus_config_path: str = PROMETHEUS_CONFIG_PATH
+) -> Optional[frozenset]:
+    """
+    Providers that get per-node series, None meaning all of them
+
+    Explicitly configured ids take precedence, otherwise the providers the
+    stack scrapes are read from the http_sd urls that `prom_config_builder.py`
+    rendered into the Prometheus config.
+    """
+    if config.strip() == "*":
+        return None
+    if config.strip():
+        return frozenset(p.strip() for p in config.split(",") if p.strip())
+
+    providers = set()
+    try:
+        with open(prometheus_config_path) as f:
+            prometheus_config = yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError) as e:
+        logger.warning(
+            f"⚠️  Cannot read {prometheus_config_path} ({e}), pushing node details of all providers"
+        )
+        return None
+
+    for scrape_config in prometheus_config.get("scrape_configs", []):
+        for sd_config in scrape_config.get("http_sd_configs", []):
+            query = urllib.parse.urlparse(sd_config.get("url", "")).query
+            providers.update(urllib.parse.parse_qs(query).get("node_provider_id", []))
+
+    if not providers:
+        logger.warning(
+            f"⚠️  No node_provider_id in {prometheus_config_path}, pushing node details of all providers"
+        )
         return None
+    return frozenset(providers)
+
+
+def endpoint_breaker(url: str):
+    """Breaker with the CIRCUIT_* settings, shared per endpoint of `url` through `breaker_for`"""
+    return breaker_for(
+        url,
+        failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=CIRCUIT_RESET_SECONDS,
+    )
+
+
+class IngestContext:
+    """
+    Resources shared by the pushers of all ingest targets
+
+    One exporter, spool and render worker pool serve every target, and the
+    IC connection pool and limits are shared per boundary node url. The
+    optional downsampling worker pushes through the same exporter and limits.
+    """
+
+    def __init__(self, victoria_url: str, workers: int = BACKFILL_WORKERS):
+        self.victoria_url = victoria_url
+        self.exporter = VictoriaExporter(
+            victoria_url,
+            export_format=VICTORIA_EXPORT_FORMAT,
+            compression=VICTORIA_COMPRESSION,
+            pool_maxsize=VICTORIA_MAX_CONCURRENT_PUSHES,
+        )
+        self.victoria_limiter = EndpointLimiter(VICTORIA_MAX_CONCURRENT_PUSHES)
+        self.victoria_breaker = endpoint_breaker(victoria_url)
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="render"
+        )
+        self._ic_clients: Dict[str, Tuple[PooledClient, EndpointLimiter]] = {}
+        self._lock = threading.Lock()
+
+        self.spool = None
+        if PUSH_SPOOL_DIR:
+            self.spool = PushSpool(
+                PUSH_SPOOL_DIR, max_bytes=PUSH_SPOOL_MAX_BYTES, registry=metrics
+            )
+            # Also replays whatever a previous run left behind
+            self.spool.start_flusher(self.replay_spooled, PUSH_SPOOL_FLUSH_SECONDS)
+
+        self.downsampler = None
+        if DOWNSAMPLE_ENABLED:
+            self.downsampler = DownsampleWorker(
+                victoria_url,
+                self.replay_spooled,
+                load_specs(),
+                Watermarks(DOWNSAMPLE_STATE_FILE),
+                backfill_days=DOWNSAMPLE_BACKFILL_DAYS,
+                max_windows_per_run=DOWNSAMPLE_MAX_WINDOWS_PER_RUN,
+                registry=metrics,
+            )
+
+    def ic_client(self, ic_url: str) -> Tuple[PooledClient, EndpointLimiter]:
+        """Connection pool and limits of a boundary node, created on first use"""
+        with self._lock:
+            if ic_url not in self._ic_clients:
+                limiter = EndpointLimiter(
+                    IC_MAX_CONCURRENT_QUERIES, RateLimiter(IC_QUERIES_PER_SECOND)
+                )
+                client = PooledClient(url=ic_url, max_connections=limiter.max_concurrency)
+                self._ic_clients[ic_url] = (client, limiter)
+            return self._ic_clients[ic_url]
+
+    def replay_spooled(self, samples: List[Sample]):
+        with self.victoria_limiter:
+            self.victoria_breaker.call(self.exporter.push_samples, samples)
 
 
 class NodeRewardsPusher:
-    """Pushes node rewards metrics to VictoriaMetrics"""
+    """
+    Pushes node rewards metrics of one ingest target to VictoriaMetrics
 
-    def __init__(self, victoria_url: str):
+    Args:
+        victoria_url: VictoriaMetrics to push to
+        target: Network and canister to ingest, mainnet by default
+        context: Resources shared with the pushers of other targets
+    """
+
+    def __init__(
+        self,
+        victoria_url: str,
+        target: IngestTarget = MAINNET,
+        context: Optional[IngestContext] = None,
+    ):
         self.victoria_url = victoria_url
-        self.nrc_client = NodeRewardsClient(IC_URL, NODE_REWARDS_CANISTER_ID)
+        self.target = target
+        self.context = context or IngestContext(victoria_url)
+
+        cache = None
+        if REWARDS_CACHE_DIR:
+            cache = RewardsCache(
+                os.path.join(REWARDS_CACHE_DIR, target.network),
+                max_age_days=REWARDS_CACHE_MAX_AGE_DAYS,
+                max_bytes=REWARDS_CACHE_MAX_BYTES,
+            )
+            # Mainnet entries used to be stored directly in REWARDS_CACHE_DIR
+            if target.network == MAINNET.network:
+                cache.adopt(REWARDS_CACHE_DIR)
+        client, limiter = self.context.ic_client(target.ic_url)
+        self.nrc_client = NodeRewardsClient(
+            target.ic_url,
+            target.canister_id,
+            limiter=limiter,
+            cache=cache,
+            client=client,
+            governance_canister_id=target.governance_canister_id,
+        )
+        self.exporter = self.context.exporter
+        self.victoria_limiter = self.context.victoria_limiter
+        self.victoria_breaker = self.context.victoria_breaker
+        self.spool = self.context.spool
+        self.detail_providers = load_detail_providers()
+        if self.detail_providers is not None:
+            logger.info(
+                f"Pushing node details of {len(self.detail_providers)} providers, aggregates for the rest"
+            )
 
-    @staticmethod
-    def _unwrap_optional(value):
-        """Unwrap Candid optional values (represented as lists)"""
-        if isinstance(value, list):
-            return value[0] if len(value) > 0 else None
-        return value
+        jobs_path = ""
+        if SCHEDULER_STATE_FILE:
+            root, ext = os.path.splitext(SCHEDULER_STATE_FILE)
+            jobs_path = f"{root}-{target.network}{ext}"
+        self.jobs = JobTable(
+            jobs_path,
+            retry_base_seconds=SCHEDULER_RETRY_BASE_SECONDS,
+            retry_max_seconds=SCHEDULER_RETRY_MAX_SECONDS,
+        )
 
     @staticmethod
-    def _make_line(metric_name: str, value: int, ts: int, **kwargs) -> str:
-        return f"{metric_name}{{{','.join([f'{key}="{value}"' for key, value in kwargs.items()])}}} {value} {ts}"
+    def _make_sample(metric_name: str, value: int, ts: int, **kwargs) -> Sample:
+        return Sample(metric_name, kwargs, value, ts)
 
     def wait_for_victoria_metrics(self):
         """Wait for VictoriaMetrics to be ready"""
@@ -361,143 +995,132 @@ class NodeRewardsPusher:
             logger.info(f"  Waiting for VictoriaMetrics at {self.victoria_url}...")
             time.sleep(2)
 
-    @retry_on_timeout(max_attempts=3, initial_delay=5, backoff_factor=2)
-    def push_metrics_for_date(self, date: str):
+    def render_metrics_for_date(
+        self,
+        date: str,
+        daily_results: Optional[Dict[str, Any]] = None,
+        gov_timestamp=FETCH_GOVERNANCE,
+    ) -> List[Sample]:
         """
-        Fetch node rewards data from IC canisters and push to VictoriaMetrics for a specific date
-        Returns True if successful, False otherwise
+        Fetch node rewards data from IC canisters and render the metric samples for a specific date
+
+        Already fetched `daily_results` and `gov_timestamp` can be passed in
+        to avoid querying the canisters again.
         """
 
-        logger.info(f"Pushing node rewards data for {date}")
+        logger.info(f"Rendering node rewards data for {date}")
         target_date = datetime.strptime(date, "%Y-%m-%d")
 
         target_dt = target_date.replace(hour=0, minute=0, second=0, microsecond=0)
         timestamp_ms = int(target_dt.replace(tzinfo=timezone.utc).timestamp() * 1000)
 
-        metrics_lines = []
-        daily_results = self.nrc_client.get_rewards_daily(date)
+        samples = []
+        if not daily_results:
+            daily_results = self.nrc_client.get_rewards_daily(date)
 
         if not daily_results:
-            raise ValueError(f"⚠️  No data available for {date}")
+            raise NoDataAvailable(f"⚠️  No data available for {date}")
 
         # Helper function to not repeat the labels all the
         # time and to single out the place for changing labels
         def add_line_helper(metric_name: str, value, **kwargs):
-            metrics_lines.append(
-                self._make_line(
+            samples.append(
+                self._make_sample(
                     metric_name,
                     value,
                     timestamp_ms,
                     canister_id=self.nrc_client.canister_id,
+                    network=self.target.network,
                     **kwargs,
                 )
             )
 
-        # Provider-level metrics
-        provider_results = daily_results.get("provider_results", {})
-        for provider_id, provider_rewards in provider_results.items():
-            provider_id_str = str(provider_id)
+        render_started = time.perf_counter()
+        columns = DailyRewardsColumns.from_daily_results(daily_results)
 
-            def add_line_helper_with_provider(
-                metric_name: str, value: int, **kwargs
-            ):
+        # Provider-level metrics
+        for provider_id, nodes_count, base_rewards, adjusted_rewards in zip(
+            columns.provider_id,
+            columns.provider_nodes_count,
+            columns.provider_total_base_rewards,
+            columns.provider_total_adjusted_rewards,
+        ):
+            add_line_helper("nodes_count", nodes_count, provider_id=provider_id)
+            if base_rewards != MISSING_INT:
                 add_line_helper(
-                    metric_name, value, provider_id=provider_id_str, **kwargs
+                    "total_base_rewards_xdr_permyriad",
+                    base_rewards,
+                    provider_id=provider_id,
                 )
-
-            # nodes_count
-            nodes_count = len(provider_rewards.get("daily_nodes_rewards", []))
-            add_line_helper_with_provider("nodes_count", nodes_count)
-
-            # base_rewards
-            base_rewards = self._unwrap_optional(
-                provider_rewards.get("total_base_rewards_xdr_permyriad")
-            )
-            if base_rewards is not None:
-                add_line_helper_with_provider(
-                    "total_base_rewards_xdr_permyriad", base_rewards
+            if adjusted_rewards != MISSING_INT:
+                add_line_helper(
+                    "total_adjusted_rewards_xdr_permyriad",
+                    adjusted_rewards,
+                    provider_id=provider_id,
                 )
 
-            adjusted_rewards = self._unwrap_optional(
-                provider_rewards.get("total_adjusted_rewards_xdr_permyriad")
-            )
-            if adjusted_rewards is not None:
-                add_line_helper_with_provider(
-                    "total_adjusted_rewards_xdr_permyriad", adjusted_rewards
+        # Node-level metrics, missing float values are NaN and skipped. Only
+        # providers in `detail_providers` get them, the rollups below cover
+        # everyone else.
+        detail_providers = self.detail_providers
+        skipped_series = 0
+        for (
+            provider_id,
+            node_id,
+            subnet_id,
+            performance_multiplier,
+            original_fr,
+            relative_fr,
+        ) in zip(
+            columns.node_provider_ids(),
+            columns.node_id,
+            columns.node_subnet_id,
+            columns.node_performance_multiplier,
+            columns.node_original_failure_rate,
+            columns.node_relative_failure_rate,
+        ):
+            if detail_providers is not None and provider_id not in detail_providers:
+                skipped_series += (
+                    (performance_multiplier == performance_multiplier)
+                    + (original_fr == original_fr)
+                    + (relative_fr == relative_fr)
                 )
-
-            # Node-level metrics
-            for node_result in provider_rewards.get("daily_nodes_rewards", []):
-                node_id = self._unwrap_optional(node_result.get("node_id"))
-                node_id_str = str(node_id) if node_id else ""
-
-                # performance_multiplier
-                performance_multiplier = self._unwrap_optional(
-                    node_result.get("performance_multiplier")
+                continue
+            if performance_multiplier == performance_multiplier:
+                add_line_helper(
+                    "performance_multiplier",
+                    performance_multiplier,
+                    provider_id=provider_id,
+                    node_id=node_id,
                 )
-                if performance_multiplier is not None:
-                    add_line_helper_with_provider(
-                        "performance_multiplier",
-                        performance_multiplier,
-                        node_id=node_id_str,
-                    )
-
-                # daily_node_failure_rate is optional and contains a variant
-                failure_rate_data = self._unwrap_optional(
-                    node_result.get("daily_node_failure_rate")
+            if original_fr == original_fr:
+                add_line_helper(
+                    "original_failure_rate",
+                    original_fr,
+                    provider_id=provider_id,
+                    node_id=node_id,
+                    subnet_id=subnet_id,
+                )
+            if relative_fr == relative_fr:
+                add_line_helper(
+                    "relative_failure_rate",
+                    relative_fr,
+                    provider_id=provider_id,
+                    node_id=node_id,
+                    subnet_id=subnet_id,
                 )
-                if (
-                    isinstance(failure_rate_data, dict)
-                    and "SubnetMember" in failure_rate_data
-                ):
-                    # Extract node_metrics from SubnetMember variant
-                    subnet_member = failure_rate_data["SubnetMember"]
-                    node_metrics = self._unwrap_optional(
-                        subnet_member.get("node_metrics")
-                    )
-
-                    if not node_metrics:
-                        continue
-
-                    subnet_id = self._unwrap_optional(
-                        node_metrics.get("subnet_assigned")
-                    )
-                    subnet_id_str = str(subnet_id) if subnet_id else ""
-
-                    # original_failure_rate
-                    original_fr = self._unwrap_optional(
-                        node_metrics.get("original_failure_rate")
-                    )
-                    if original_fr is not None:
-                        add_line_helper_with_provider(
-                            "original_failure_rate",
-                            original_fr,
-                            node_id=node_id_str,
-                            subnet_id=subnet_id_str,
-                        )
-
-                    # relative_failure_rate
-                    relative_fr = self._unwrap_optional(
-                        node_metrics.get("relative_failure_rate")
-                    )
-                    if relative_fr is not None:
-                        add_line_helper_with_provider(
-                            "relative_failure_rate",
-                            relative_fr,
-                            node_id=node_id_str,
-                            subnet_id=subnet_id_str,
-                        )
 
         # Subnet-level metrics
-        subnets_failure_rate = daily_results.get("subnets_failure_rate", {})
-        for subnet_id, failure_rate in subnets_failure_rate.items():
-            subnet_id_str = str(subnet_id)
-            add_line_helper(
-                "subnets_failure_rate", failure_rate, subnet_id=subnet_id_str
-            )
+        for subnet_id, failure_rate in zip(columns.subnet_id, columns.subnet_failure_rate):
+            add_line_helper("subnets_failure_rate", failure_rate, subnet_id=subnet_id)
+
+        # Provider, data center, region and reward type rollups
+        for metric_name, labels, value in aggregate(columns):
+            add_line_helper(metric_name, value, **labels)
 
         # Governance timestamp
-        gov_timestamp = self.nrc_client.get_latest_governance_reward_event()
+        if gov_timestamp is FETCH_GOVERNANCE:
+            gov_timestamp = self.nrc_client.get_latest_governance_reward_event()
         if gov_timestamp:
             add_line_helper(
                 "governance_latest_reward_event_timestamp_seconds", gov_timestamp
@@ -511,88 +1134,530 @@ class NodeRewardsPusher:
                 "days_since_governance_distribution", days_since
             )
 
-        if not metrics_lines:
+        if not samples:
             raise ValueError("After evaluation there were no metrics to upload")
 
-        metrics_payload = "\n".join(metrics_lines) + "\n"
-        import_url = urljoin(
-            self.victoria_url.rstrip("/") + "/", "api/v1/import/prometheus"
+        metrics.observe(
+            "stage_duration_seconds", time.perf_counter() - render_started, stage="render"
         )
-
-        response = requests.post(
-            import_url,
-            data=metrics_payload.encode("utf-8"),
-            headers={"Content-Type": "text/plain"},
-            timeout=30,
+        metrics.set("last_day_samples", len(samples), network=self.target.network)
+        metrics.set("last_day_nodes", len(columns), network=self.target.network)
+        metrics.inc("rendered_samples_total", len(samples))
+        self._report_series(date, samples, skipped_series)
+        return samples
+
+    def _report_series(self, date: str, samples: List[Sample], skipped_series: int):
+        """Log and export how many series a day adds, every sample is its own series"""
+        estimate = estimate_series(samples)
+        network = self.target.network
+        for scope, count in estimate.items():
+            metrics.set("estimated_series", count, scope=scope, network=network)
+        metrics.set("skipped_node_series", skipped_series, network=network)
+
+        breakdown = ", ".join(f"{scope} {count}" for scope, count in estimate.items())
+        logger.info(
+            f"Series for {date}: {len(samples)} ({breakdown}), "
+            f"{skipped_series} node series of other providers skipped"
         )
+
+    def push_samples(self, *batches: List[Sample]) -> ImportStats:
+        """
+        Stream one or more rendered batches to VictoriaMetrics in a single request
+
+        When VictoriaMetrics stays unreachable the batches are written to the
+        spool (if configured) and replayed later instead of being dropped.
+        """
         try:
-            response.raise_for_status()
-        except Exception:
-            logger.error(
-                f"❌ Failed to push to VictoriaMetrics: {response.status_code} - {response.text}"
-            )
+            return self._push_now(*batches)
+        except Exception as e:
+            if self.spool is None or not (
+                classify(e) is ErrorKind.TRANSIENT or isinstance(e, CircuitOpenError)
+            ):
+                raise
+            stats = ImportStats()
+            stats.samples = self.spool.append(sample for batch in batches for sample in batch)
+            return stats
+
+    @retry(VICTORIA_RETRY_POLICY, registry=metrics)
+    def _push_now(self, *batches: List[Sample]) -> ImportStats:
+        """
+        Push without spooling, retrying transient failures
+
+        The ingester's own metrics are appended to every push unless
+        SELF_METRICS_PUSH is disabled.
+        """
+        if SELF_METRICS_PUSH:
+            batches = batches + (metrics.samples(),)
+
+        try:
+            with self.victoria_limiter, metrics.time("victoria_push"):
+                stats = self.victoria_breaker.call(
+                    self.exporter.push_samples,
+                    (sample for batch in batches for sample in batch),
+                )
+        except Exception as e:
+            metrics.inc("push_failures_total", exception=type(e).__name__)
             raise
 
+        metrics.observe("push_payload_bytes", stats.raw_bytes, buckets=SIZE_BUCKETS, encoding="raw")
+        metrics.observe("push_payload_bytes", stats.sent_bytes, buckets=SIZE_BUCKETS, encoding="wire")
+        metrics.inc("pushed_samples_total", stats.samples)
+        metrics.set("last_success_timestamp_seconds", time.time(), operation="push")
+        return stats
+
+    def push_metrics_for_date(self, date: str):
+        """
+        Fetch node rewards data from IC canisters and push to VictoriaMetrics for a specific date
+        Returns the number of pushed samples
+        """
+        with deadline(DAY_DEADLINE_SECONDS):
+            samples = self.render_metrics_for_date(date)
+            stats = self.push_samples(samples)
+
         logger.info(
-            f"✅ Successfully pushed data for {date} ({len(metrics_lines)} metrics)"
+            f"✅ Successfully pushed data for {date} ({stats.samples} metrics, {stats.sent_bytes} bytes sent)"
+        )
+        return stats.samples
+
+    def render_governance_history(self) -> List[Sample]:
+        """Render every governance reward distribution at its own timestamp"""
+        samples = []
+        for event in self.nrc_client.get_governance_reward_events():
+            timestamp_ms = int(event["timestamp"] * 1000)
+            labels = {
+                "canister_id": self.nrc_client.governance_canister_id,
+                "network": self.target.network,
+            }
+
+            samples.append(
+                self._make_sample(
+                    "governance_reward_distribution_timestamp_seconds",
+                    event["timestamp"],
+                    timestamp_ms,
+                    **labels,
+                )
+            )
+
+            if event["start_date"] and event["end_date"]:
+                start = datetime.strptime(event["start_date"], "%Y-%m-%d")
+                end = datetime.strptime(event["end_date"], "%Y-%m-%d")
+                samples.append(
+                    self._make_sample(
+                        "governance_reward_distribution_period_days",
+                        (end - start).days + 1,
+                        timestamp_ms,
+                        **labels,
+                    )
+                )
+
+            if event["registry_version"] is not None:
+                samples.append(
+                    self._make_sample(
+                        "governance_reward_distribution_registry_version",
+                        event["registry_version"],
+                        timestamp_ms,
+                        **labels,
+                    )
+                )
+
+        return samples
+
+    def push_governance_history(self):
+        """Push the history of governance reward distributions"""
+        samples = self.render_governance_history()
+        if not samples:
+            logger.warning("No governance reward distributions to push")
+            return 0
+
+        stats = self.push_samples(samples)
+        logger.info(f"✅ Pushed governance reward distribution history ({stats.samples} metrics)")
+        return stats.samples
+
+    def _backfill_date(
+        self,
+        date: str,
+        daily_results: Optional[Dict[str, Any]] = None,
+        gov_timestamp=FETCH_GOVERNANCE,
+    ) -> Dict[str, Any]:
+        """Render a single date and measure how long it took"""
+        started = time.monotonic()
+        try:
+            with deadline(DAY_DEADLINE_SECONDS):
+                samples = self.render_metrics_for_date(date, daily_results, gov_timestamp)
+            error = None
+        except Exception as e:
+            samples = []
+            error = e
+
+        return {
+            "date": date,
+            "samples": samples,
+            "seconds": time.monotonic() - started,
+            "error": error,
+        }
+
+    def push_range(
+        self, rewards_range: RewardsRange, gov_timestamp=FETCH_GOVERNANCE
+    ) -> List[Dict[str, Any]]:
+        """
+        Render all fetched days of a range and push them in one bulk import
+
+        Days are rendered concurrently on the shared worker pool. Every date
+        is rendered once, so the import carries one sample per series and
+        day. Returns a result per date of the range like `_backfill_date`
+        with the number of pushed samples, days that failed carry their error.
+        """
+        futures = [
+            self.context.executor.submit(self._backfill_date, date, daily_results, gov_timestamp)
+            for date, daily_results in rewards_range
+        ]
+
+        results = []
+        for date, error in rewards_range.errors.items():
+            logger.error(f"Failed to fetch rewards for {date} due to: {error}")
+            results.append({"date": date, "samples": 0, "seconds": 0.0, "error": error})
+
+        rendered = []
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result["error"] is not None:
+                logger.error(
+                    f"Failed to render {result['date']} after {result['seconds']:.1f}s "
+                    f"due to: {result['error']}"
+                )
+                result["samples"] = 0
+                continue
+            logger.info(
+                f"Rendered {result['date']} in {result['seconds']:.1f}s "
+                f"({len(result['samples'])} metrics)"
+            )
+            rendered.append(result)
+
+        results.sort(key=lambda r: r["date"])
+        if not rendered:
+            return results
+
+        rendered.sort(key=lambda r: r["date"])
+        dates = f"{rendered[0]['date']}..{rendered[-1]['date']}"
+        started = time.monotonic()
+        try:
+            stats = self.push_samples(*(r["samples"] for r in rendered))
+        except Exception as e:
+            logger.error(f"Failed to push {len(rendered)} days ({dates}) due to: {e}")
+            for result in rendered:
+                result["error"] = e
+        else:
+            logger.info(
+                f"Pushed {len(rendered)} days ({dates}) in one import in "
+                f"{time.monotonic() - started:.1f}s ({stats.samples} metrics in "
+                f"{stats.lines} lines, {stats.raw_bytes} bytes, {stats.sent_bytes} sent)"
+            )
+
+        # Rendered samples are no longer needed, only keep the counts
+        for result in rendered:
+            result["samples"] = len(result["samples"]) if result["error"] is None else 0
+        return results
+
+    def get_ingested_days(self, start: datetime, end: datetime) -> Dict[str, int]:
+        """
+        Ask VictoriaMetrics which days already have `nodes_count` samples
+
+        Uses a single export call over the whole range and returns the
+        number of provider series found for each date.
+        """
+        export_url = self.exporter.url("api/v1/export")
+        # Testnets reuse the NNS canister ids. Series pushed before ingest targets
+        # existed carry no network label and all come from mainnet.
+        network = self.target.network
+        if network == MAINNET.network:
+            network_match = f'network=~"{network}|"'
+        else:
+            network_match = f'network="{network}"'
+        params = {
+            "match[]": f'nodes_count{{canister_id="{self.nrc_client.canister_id}",{network_match}}}',
+            "start": int(start.timestamp()),
+            "end": int(end.timestamp()),
+        }
+
+        def export():
+            response = self.exporter.session.get(export_url, params=params, timeout=60)
+            response.raise_for_status()
+            return response
+
+        with self.victoria_limiter:
+            response = self.victoria_breaker.call(export)
+
+        counts: Dict[str, int] = {}
+        for line in response.iter_lines():
+            if not line:
+                continue
+            series = json.loads(line)
+            # A series can have several samples for the same day if it was pushed more than once
+            days = {
+                datetime.fromtimestamp(ts / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+                for ts in series.get("timestamps", [])
+            }
+            for day in days:
+                counts[day] = counts.get(day, 0) + 1
+
+        return counts
+
+    def plan_backfill(self, days: int = 40) -> List[str]:
+        """
+        Return the dates that are missing or incomplete in VictoriaMetrics
+
+        The last `days` days are always checked. If older data exists the
+        check extends back to the oldest ingested day (bounded by
+        BACKFILL_MAX_LOOKBACK_DAYS) so gaps left by long outages are healed.
+        """
+        today = datetime.now(timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0
         )
+        lookback = max(days, BACKFILL_MAX_LOOKBACK_DAYS)
+        window_start = today - timedelta(days=lookback)
 
-    def backfill(self, days: int = 40):
-        """Backfill historical data"""
+        counts = self.get_ingested_days(window_start, today)
 
-        logger.info(f"Starting backfill of last {days} days...")
+        start_offset = days
+        if counts:
+            oldest = datetime.strptime(min(counts), "%Y-%m-%d").replace(
+                tzinfo=timezone.utc
+            )
+            start_offset = max(days, (today - oldest).days)
 
-        for i in range(days, 0, -1):
-            date = datetime.now(timezone.utc) - timedelta(days=i)
-            date = date.strftime("%Y-%m-%d")
+        expected = statistics.median(counts.values()) if counts else 0
+        threshold = expected * BACKFILL_COMPLETENESS_RATIO
 
-            logger.info(f"[{days - i + 1:2d}/{days}] Backfilling data for {date}...")
-            try:
-                self.push_metrics_for_date(date)
-            except Exception as e:
-                logger.error(f"Failed to backfill data due to: {e}")
+        missing = []
+        incomplete = []
+        for i in range(start_offset, 0, -1):
+            date = (today - timedelta(days=i)).strftime("%Y-%m-%d")
+            count = counts.get(date, 0)
+            if count == 0:
+                missing.append(date)
+            elif count < threshold:
+                incomplete.append(date)
 
-        logger.info("✅ Backfill complete!")
+        logger.info(
+            f"Checked {start_offset} days: {len(counts)} ingested, "
+            f"{len(missing)} missing, {len(incomplete)} incomplete"
+        )
+        return sorted(missing + incomplete)
+
+    def backfill(self, days: int = 40, incremental: bool = True):
+        """
+        Backfill historical data
+
+        With `incremental` only days that VictoriaMetrics is missing are
+        pushed (see `plan_backfill`), otherwise the last `days` days are
+        pushed unconditionally. Windows of BACKFILL_PREFETCH_DAYS days are
+        fetched as one range, rendered by the worker pool shared between all
+        ingest targets and pushed in one bulk import each. The number of in-flight canister
+        queries and VictoriaMetrics pushes is capped by the endpoint limiters
+        shared between all workers.
+        """
 
-    def wait_until_next_run(self):
-        """Wait until 00:10 UTC tomorrow"""
         now = datetime.now(timezone.utc)
+        dates = None
+        if incremental:
+            try:
+                dates = self.plan_backfill(days)
+            except Exception as e:
+                logger.warning(
+                    f"Failed to query ingested days, falling back to full backfill: {e}"
+                )
 
-        next_run = now.replace(hour=0, minute=10, second=0, microsecond=0)
-        if now >= next_run:
-            next_run += timedelta(days=1)
+        window = [
+            (now - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days, 0, -1)
+        ]
+        if dates is None:
+            dates = window
+
+        # Days the plan skipped are already in VictoriaMetrics
+        planned = set(dates)
+        for date in window:
+            job = self.jobs.get(date)
+            if date not in planned and (job is None or job["state"] != DONE):
+                self.jobs.mark_done(date)
+
+        if not dates:
+            logger.info("✅ Nothing to backfill, all days are already ingested")
+            metrics.set(
+                "last_success_timestamp_seconds",
+                time.time(),
+                operation="backfill",
+                network=self.target.network,
+            )
+            return []
 
-        wait_seconds = (next_run - now).total_seconds()
+        days = len(dates)
         logger.info(
-            f"Next run scheduled for {next_run.strftime('%Y-%m-%d %H:%M:%S')} UTC"
+            f"Starting backfill of {days} days of {self.target.network} "
+            f"with {self.context.workers} workers..."
         )
+
+        started = time.monotonic()
+
+        # The governance data does not depend on the date, query it once per run
+        self.nrc_client.invalidate_governance_cache()
+        try:
+            gov_timestamp = self.nrc_client.get_latest_governance_reward_event()
+        except Exception as e:
+            logger.warning(f"Failed to fetch governance reward event: {e}")
+            gov_timestamp = None
+
+        results: List[Dict[str, Any]] = []
+        for offset in range(0, days, BACKFILL_PREFETCH_DAYS):
+            rewards_range = self.nrc_client.fetch_rewards_days(
+                dates[offset : offset + BACKFILL_PREFETCH_DAYS]
+            )
+            results.extend(self.push_range(rewards_range, gov_timestamp))
+            logger.info(f"[{len(results):2d}/{days}] days of the backfill processed")
+
+        elapsed = time.monotonic() - started
+        succeeded = [r for r in results if r["error"] is None]
+        total_samples = sum(r["samples"] for r in succeeded)
+        busy = sum(r["seconds"] for r in results)
+
+        network = self.target.network
+        metrics.set("backfill_duration_seconds", elapsed, network=network)
+        metrics.set("backfill_days", len(succeeded), status="succeeded", network=network)
+        metrics.set("backfill_days", days - len(succeeded), status="failed", network=network)
+        if len(succeeded) == days:
+            metrics.set(
+                "last_success_timestamp_seconds",
+                time.time(),
+                operation="backfill",
+                network=network,
+            )
+
+        # Also carries the backfill metrics above
+        try:
+            self.push_governance_history()
+        except Exception as e:
+            logger.error(f"Failed to push governance reward history due to: {e}")
+
         logger.info(
-            f"Waiting {wait_seconds:.0f} seconds ({wait_seconds / 3600:.1f} hours)..."
+            f"✅ Backfill complete! {len(succeeded)}/{days} days in {elapsed:.1f}s "
+            f"({len(succeeded) / elapsed if elapsed else 0:.2f} days/s, "
+            f"{total_samples / elapsed if elapsed else 0:.0f} metrics/s, "
+            f"summed per-day time {busy:.1f}s)"
         )
 
-        time.sleep(wait_seconds)
+        failed = sorted(r["date"] for r in results if r["error"] is not None)
+        if failed:
+            logger.warning(f"Days that failed to backfill: {', '.join(failed)}")
+
+        # Failed days are left to the scheduler, which retries them
+        for result in results:
+            if result["error"] is None:
+                self.jobs.mark_done(result["date"], result["samples"])
+            elif isinstance(result["error"], NoDataAvailable):
+                self.jobs.postpone(result["date"], SCHEDULER_POLL_SECONDS)
+            else:
+                self.jobs.mark_failed(result["date"], str(result["error"]))
+
+        return results
+
+    def run_job(self, date: str) -> bool:
+        """Push a single scheduled day and record the outcome in the job table"""
+        network = self.target.network
+        try:
+            samples = self.push_metrics_for_date(date)
+        except NoDataAvailable:
+            self.jobs.postpone(date, SCHEDULER_POLL_SECONDS)
+            metrics.inc("scheduler_jobs_total", result="not_published", network=network)
+            logger.info(
+                f"Rewards of {network} for {date} are not published yet, "
+                f"polling again in {SCHEDULER_POLL_SECONDS:.0f}s"
+            )
+            return False
+        except Exception as e:
+            delay = self.jobs.mark_failed(date, str(e))
+            metrics.inc("scheduler_jobs_total", result="failed", network=network)
+            logger.error(f"❌ Failed to push {network} {date}, retrying in {delay:.0f}s: {e}")
+            return False
+
+        self.jobs.mark_done(date, samples)
+        metrics.inc("scheduler_jobs_total", result="done", network=network)
+        metrics.set(
+            "last_success_timestamp_seconds", time.time(), operation="daily", network=network
+        )
+        return True
+
+    def schedule_recent_days(self, now: datetime):
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        self.jobs.ensure(
+            (today - timedelta(days=i)).strftime("%Y-%m-%d")
+            for i in range(SCHEDULER_CATCHUP_DAYS, 0, -1)
+        )
 
     def run_daily_scheduler(self):
-        """Run the daily scheduler loop"""
+        """Run the catch-up scheduler loop for this target only"""
+        run_scheduler([self])
 
-        while True:
-            try:
-                self.wait_until_next_run()
 
-                # Push yesterday's data
-                yesterday = (datetime.now(timezone.utc) - timedelta(days=1)).strftime(
-                    "%Y-%m-%d"
-                )
-                logger.info(f"Running scheduled push for {yesterday}")
-                self.push_metrics_for_date(yesterday)
+def _seconds_until_next_job(pushers: List[NodeRewardsPusher], now: datetime) -> float:
+    """Sleep until the next retry or poll of any target, or until a new day starts"""
+    tomorrow = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    wake_up = tomorrow.timestamp()
+    for pusher in pushers:
+        next_attempt = pusher.jobs.next_attempt()
+        if next_attempt is not None:
+            wake_up = min(wake_up, next_attempt)
+    return max(1.0, wake_up - now.timestamp())
 
-            except KeyboardInterrupt:
-                logger.info("Scheduler stopped by user")
-                break
-            except Exception as e:
-                logger.error(f"Error in scheduler loop: {e}", exc_info=True)
-                # Wait a bit before retrying
-                time.sleep(60)
+
+def run_scheduler(pushers: List[NodeRewardsPusher]):
+    """
+    Run the catch-up scheduler loop for all ingest targets
+
+    Every finished UTC day of the last SCHEDULER_CATCHUP_DAYS days gets a
+    job per target. A new day is polled right after midnight and then every
+    SCHEDULER_POLL_SECONDS until the canister publishes its result, failed
+    days are retried with increasing delays. Due jobs of all targets run on
+    the shared worker pool.
+    """
+
+    while True:
+        try:
+            futures = {}
+            for pusher in pushers:
+                pusher.schedule_recent_days(datetime.now(timezone.utc))
+                for date in pusher.jobs.due():
+                    logger.info(f"Running scheduled push of {pusher.target.network} for {date}")
+                    future = pusher.context.executor.submit(pusher.run_job, date)
+                    futures[future] = pusher
+
+            pushed = set()
+            for future in as_completed(futures):
+                if future.result():
+                    pushed.add(futures[future])
+
+            for pusher in pushers:
+                counts = pusher.jobs.counts()
+                for state, count in counts.items():
+                    metrics.set("scheduler_jobs", count, state=state, network=pusher.target.network)
+                logger.info(f"Jobs of {pusher.target.network}: {counts}")
+                if pusher in pushed:
+                    pusher.push_governance_history()
+
+            now = datetime.now(timezone.utc)
+            wait_seconds = _seconds_until_next_job(pushers, now)
+            logger.info(
+                f"Next check at "
+                f"{(now + timedelta(seconds=wait_seconds)).strftime('%Y-%m-%d %H:%M:%S')} UTC"
+            )
+            time.sleep(wait_seconds)
+
+        except KeyboardInterrupt:
+            logger.info("Scheduler stopped by user")
+            break
+        except Exception as e:
+            logger.error(f"Error in scheduler loop: {e}", exc_info=True)
+            # Wait a bit before retrying
+            time.sleep(60)
 
 
 def main():
@@ -604,18 +1669,34 @@ def main():
 
     # Get configuration from environment
     victoria_url = os.environ.get("VICTORIA_METRICS_URL", "http://localhost:9090")
+    targets = load_targets()
+
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
 
-    # Create pusher
-    pusher = NodeRewardsPusher(victoria_url)
+    # One pusher per target, all sharing the exporter, worker pool and connection pools
+    context = IngestContext(victoria_url)
+    pushers = [NodeRewardsPusher(victoria_url, target, context) for target in targets]
+    logger.info(
+        "Ingesting " + ", ".join(f"{t.network} ({t.canister_id} on {t.ic_url})" for t in targets)
+    )
 
     # Wait for VictoriaMetrics
-    pusher.wait_for_victoria_metrics()
+    pushers[0].wait_for_victoria_metrics()
+
+    # Downsampling reads what is already stored, it runs next to the backfill
+    if context.downsampler is not None:
+        logger.info(
+            "Downsampling " + ", ".join(spec.metric for spec in context.downsampler.specs)
+        )
+        context.downsampler.start(DOWNSAMPLE_INTERVAL_SECONDS)
 
     # Backfill historical data
-    pusher.backfill(days=40)
+    for pusher in pushers:
+        pusher.backfill(days=40)
 
     # Run daily scheduler
-    pusher.run_daily_scheduler()
+    run_scheduler(pushers)
 
 
 if __name__ == "__main__":
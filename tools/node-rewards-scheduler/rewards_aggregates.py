@@ -0,0 +1,138 @@
+"""
+Low cardinality rollups of a day of node rewards
+
+Aggregates the node columns per provider, data center, region and node
+reward type so that dashboards can read a handful of precomputed series
+instead of aggregating tens of thousands of per-node series at query time.
+"""
+
+from typing import Dict, Iterator, List, Tuple
+
+from rewards_columns import DailyRewardsColumns
+
+ROLLUP_PREFIX = "node_rewards_rollup_"
+
+# Failure rate quantiles exported for every group
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Nodes with a performance multiplier below this value had their rewards reduced
+PENALTY_THRESHOLD = 1.0
+
+# (value of the `by` label, label holding the group key)
+DIMENSIONS = (
+    ("provider", "provider_id"),
+    ("dc", "dc_id"),
+    ("region", "region"),
+    ("reward_type", "node_reward_type"),
+)
+
+
+def quantile(sorted_values: List[float], q: float) -> float:
+    """Linear interpolation between closest ranks, values must be sorted"""
+    if not sorted_values:
+        return float("nan")
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = position - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+class _Group:
+    __slots__ = (
+        "nodes",
+        "assigned",
+        "penalized",
+        "base_rewards",
+        "adjusted_rewards",
+        "multiplier_sum",
+        "multiplier_count",
+        "relative_failure_rates",
+    )
+
+    def __init__(self):
+        self.nodes = 0
+        self.assigned = 0
+        self.penalized = 0
+        self.base_rewards = 0.0
+        self.adjusted_rewards = 0.0
+        self.multiplier_sum = 0.0
+        self.multiplier_count = 0
+        self.relative_failure_rates: List[float] = []
+
+
+def aggregate(columns: DailyRewardsColumns) -> Iterator[Tuple[str, Dict[str, str], float]]:
+    """
+    Yield (metric name, labels, value) for every rollup of the given day
+
+    Every metric carries a `by` label naming the dimension and one label with
+    the group key, e.g. `node_rewards_rollup_nodes{by="dc",dc_id="zh1"}`.
+    """
+    keys = (
+        columns.node_provider_ids(),
+        columns.node_dc_id,
+        columns.node_region,
+        columns.node_reward_type,
+    )
+    groups: Tuple[Dict[str, _Group], ...] = tuple({} for _ in DIMENSIONS)
+
+    for i, (has_metrics, multiplier, relative_fr, base, adjusted) in enumerate(
+        zip(
+            columns.node_has_metrics,
+            columns.node_performance_multiplier,
+            columns.node_relative_failure_rate,
+            columns.node_base_rewards,
+            columns.node_adjusted_rewards,
+        )
+    ):
+        for dimension_groups, dimension_keys in zip(groups, keys):
+            key = dimension_keys[i]
+            group = dimension_groups.get(key)
+            if group is None:
+                group = dimension_groups[key] = _Group()
+
+            group.nodes += 1
+            group.assigned += has_metrics
+            # NaN compares unequal to itself, missing values are skipped
+            if base == base:
+                group.base_rewards += base
+            if adjusted == adjusted:
+                group.adjusted_rewards += adjusted
+            if multiplier == multiplier:
+                group.multiplier_sum += multiplier
+                group.multiplier_count += 1
+                if multiplier < PENALTY_THRESHOLD:
+                    group.penalized += 1
+            if relative_fr == relative_fr:
+                group.relative_failure_rates.append(relative_fr)
+
+    for (by, label), dimension_groups in zip(DIMENSIONS, groups):
+        for key, group in dimension_groups.items():
+            labels = {"by": by, label: key or "unknown"}
+
+            yield f"{ROLLUP_PREFIX}nodes", labels, group.nodes
+            yield f"{ROLLUP_PREFIX}assigned_nodes", labels, group.assigned
+            yield f"{ROLLUP_PREFIX}penalized_nodes", labels, group.penalized
+            yield f"{ROLLUP_PREFIX}base_rewards_xdr_permyriad", labels, group.base_rewards
+            yield f"{ROLLUP_PREFIX}adjusted_rewards_xdr_permyriad", labels, group.adjusted_rewards
+
+            if group.multiplier_count:
+                yield (
+                    f"{ROLLUP_PREFIX}performance_multiplier_avg",
+                    labels,
+                    group.multiplier_sum / group.multiplier_count,
+                )
+
+            rates = sorted(group.relative_failure_rates)
+            if rates:
+                yield (
+                    f"{ROLLUP_PREFIX}relative_failure_rate_avg",
+                    labels,
+                    sum(rates) / len(rates),
+                )
+                for q in QUANTILES:
+                    yield (
+                        f"{ROLLUP_PREFIX}relative_failure_rate",
+                        {**labels, "quantile": str(q)},
+                        quantile(rates, q),
+                    )
@@ -0,0 +1,196 @@
+"""
+On-disk cache of decoded daily rewards results
+
+Results for days that are already finished never change on the node rewards
+canister, so they are stored locally, one file per date, and served from disk
+on subsequent runs instead of being queried again.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the shape of the stored data changes. Entries written with
+# a different version are treated as missing and removed.
+CACHE_FORMAT_VERSION = 1
+
+CACHE_FILE_SUFFIX = ".json.gz"
+
+
+def _to_jsonable(value):
+    """Convert decoded candid values (principals, tuples, ...) to plain JSON types"""
+    if isinstance(value, dict):
+        return {str(key): _to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_jsonable(item) for item in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def _checksum(data: Any) -> str:
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RewardsCache:
+    """
+    Versioned per-date cache of `get_rewards_daily` results
+
+    Args:
+        cache_dir: Directory where cache entries are stored
+        max_age_days: Entries for dates older than this are evicted
+        max_bytes: Oldest entries are evicted once the cache grows past this size
+    """
+
+    def __init__(self, cache_dir: str, max_age_days: int = 400, max_bytes: int = 512 * 1024**2):
+        self.cache_dir = cache_dir
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, date: str) -> str:
+        return os.path.join(self.cache_dir, f"{date}{CACHE_FILE_SUFFIX}")
+
+    @staticmethod
+    def is_cacheable(date: str) -> bool:
+        """Only days that have fully passed in UTC are final"""
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        return date < today
+
+    def get(self, date: str) -> Optional[Dict[str, Any]]:
+        """Return the cached result for `date` or None if missing or invalid"""
+        path = self._path(date)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, EOFError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache entry for {date}: {e}")
+            self._remove(path)
+            return None
+
+        if entry.get("version") != CACHE_FORMAT_VERSION or entry.get("date") != date:
+            logger.info(f"Dropping outdated cache entry for {date}")
+            self._remove(path)
+            return None
+
+        data = entry.get("data")
+        if _checksum(data) != entry.get("sha256"):
+            logger.warning(f"Dropping corrupted cache entry for {date}")
+            self._remove(path)
+            return None
+
+        logger.debug(f"Cache hit for {date}")
+        return data
+
+    def put(self, date: str, data: Dict[str, Any]):
+        """Store the result for `date` if the day is final and the result is not empty"""
+        if not data or not self.is_cacheable(date):
+            return
+
+        data = _to_jsonable(data)
+        entry = {
+            "version": CACHE_FORMAT_VERSION,
+            "date": date,
+            "stored_at": int(time.time()),
+            "sha256": _checksum(data),
+            "data": data,
+        }
+
+        # Write to a temporary file first so that readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f".{date}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                f.write(json.dumps(entry, separators=(",", ":")).encode("utf-8"))
+            os.replace(tmp_path, self._path(date))
+        except Exception:
+            self._remove(tmp_path)
+            raise
+
+        self.evict()
+
+    def adopt(self, legacy_dir: str) -> int:
+        """
+        Move the entries stored directly in `legacy_dir` into this cache
+
+        Entries this cache already has and leftover temporary files are
+        removed, returns the number of moved entries.
+        """
+        moved = 0
+        with self._lock:
+            for name in os.listdir(legacy_dir):
+                path = os.path.join(legacy_dir, name)
+                if name.startswith(".") and name.endswith(".tmp"):
+                    self._remove(path)
+                elif name.endswith(CACHE_FILE_SUFFIX) and os.path.isfile(path):
+                    target = os.path.join(self.cache_dir, name)
+                    if os.path.exists(target):
+                        self._remove(path)
+                    else:
+                        os.replace(path, target)
+                        moved += 1
+        if moved:
+            logger.info(f"Moved {moved} cache entries from {legacy_dir} to {self.cache_dir}")
+            self.evict()
+        return moved
+
+    def evict(self):
+        """Remove entries that are too old and, if still too large, the oldest ones"""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(CACHE_FILE_SUFFIX):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                entries.append((name[: -len(CACHE_FILE_SUFFIX)], path, size))
+
+            # Dates sort lexicographically in YYYY-MM-DD format
+            entries.sort()
+
+            now = datetime.now(timezone.utc)
+            kept = []
+            for date, path, size in entries:
+                try:
+                    age = now - datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+                except ValueError:
+                    self._remove(path)
+                    continue
+
+                if age.days > self.max_age_days:
+                    logger.debug(f"Evicting expired cache entry for {date}")
+                    self._remove(path)
+                else:
+                    kept.append((date, path, size))
+
+            total = sum(size for _, _, size in kept)
+            for date, path, size in kept:
+                if total <= self.max_bytes:
+                    break
+                logger.debug(f"Evicting cache entry for {date} to stay within size limit")
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
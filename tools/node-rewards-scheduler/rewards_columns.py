@@ -0,0 +1,160 @@
+"""
+Columnar representation of a decoded daily rewards result
+
+The candid decoder produces nested dicts of lists of dicts with optional
+values wrapped in lists. `DailyRewardsColumns` flattens that once per day
+into parallel columns so metric generation and aggregations can run as
+single passes over arrays instead of walking the nested structure again.
+"""
+
+import math
+import sys
+from array import array
+from typing import Any, Dict, List
+
+# Sentinel for missing float values
+MISSING = math.nan
+# Sentinel for missing non-negative integer values
+MISSING_INT = -1
+
+
+def _unwrap(value):
+    """Unwrap Candid optional values (represented as lists)"""
+    if isinstance(value, list):
+        return value[0] if len(value) > 0 else None
+    return value
+
+
+def _text(value) -> str:
+    """Interned string for principals and other repeated label values"""
+    value = _unwrap(value)
+    return sys.intern(str(value)) if value else ""
+
+
+def _float(value) -> float:
+    value = _unwrap(value)
+    return MISSING if value is None else float(value)
+
+
+def _int(value) -> int:
+    value = _unwrap(value)
+    return MISSING_INT if value is None else int(value)
+
+
+class DailyRewardsColumns:
+    """
+    Parallel columns of a single day of node rewards
+
+    Provider columns are indexed by provider position, node columns by node
+    position with `node_provider` pointing back into the provider columns.
+    Missing values are stored as MISSING (floats) or MISSING_INT (integers).
+    """
+
+    __slots__ = (
+        # Provider columns
+        "provider_id",
+        "provider_nodes_count",
+        "provider_total_base_rewards",
+        "provider_total_adjusted_rewards",
+        # Node columns
+        "node_provider",
+        "node_id",
+        "node_reward_type",
+        "node_region",
+        "node_dc_id",
+        "node_subnet_id",
+        "node_has_metrics",
+        "node_performance_multiplier",
+        "node_original_failure_rate",
+        "node_relative_failure_rate",
+        "node_base_rewards",
+        "node_adjusted_rewards",
+        # Subnet columns
+        "subnet_id",
+        "subnet_failure_rate",
+    )
+
+    def __init__(self):
+        self.provider_id: List[str] = []
+        self.provider_nodes_count = array("q")
+        self.provider_total_base_rewards = array("q")
+        self.provider_total_adjusted_rewards = array("q")
+
+        self.node_provider = array("l")
+        self.node_id: List[str] = []
+        self.node_reward_type: List[str] = []
+        self.node_region: List[str] = []
+        self.node_dc_id: List[str] = []
+        self.node_subnet_id: List[str] = []
+        self.node_has_metrics = array("b")
+        self.node_performance_multiplier = array("d")
+        self.node_original_failure_rate = array("d")
+        self.node_relative_failure_rate = array("d")
+        self.node_base_rewards = array("d")
+        self.node_adjusted_rewards = array("d")
+
+        self.subnet_id: List[str] = []
+        self.subnet_failure_rate = array("d")
+
+    def __len__(self):
+        return len(self.node_id)
+
+    def add_node(self, provider_index: int, node: Dict[str, Any]):
+        """Append a single `DAILY_NODE_REWARDS_TYPE` record"""
+        self.node_provider.append(provider_index)
+        self.node_id.append(_text(node.get("node_id")))
+        self.node_reward_type.append(_text(node.get("node_reward_type")))
+        self.node_region.append(_text(node.get("region")))
+        self.node_dc_id.append(_text(node.get("dc_id")))
+        self.node_performance_multiplier.append(_float(node.get("performance_multiplier")))
+        self.node_base_rewards.append(_float(node.get("base_rewards_xdr_permyriad")))
+        self.node_adjusted_rewards.append(_float(node.get("adjusted_rewards_xdr_permyriad")))
+
+        # daily_node_failure_rate is optional and contains a variant
+        node_metrics = None
+        failure_rate_data = _unwrap(node.get("daily_node_failure_rate"))
+        if isinstance(failure_rate_data, dict) and "SubnetMember" in failure_rate_data:
+            node_metrics = _unwrap(failure_rate_data["SubnetMember"].get("node_metrics"))
+
+        if node_metrics:
+            self.node_has_metrics.append(1)
+            self.node_subnet_id.append(_text(node_metrics.get("subnet_assigned")))
+            self.node_original_failure_rate.append(_float(node_metrics.get("original_failure_rate")))
+            self.node_relative_failure_rate.append(_float(node_metrics.get("relative_failure_rate")))
+        else:
+            self.node_has_metrics.append(0)
+            self.node_subnet_id.append("")
+            self.node_original_failure_rate.append(MISSING)
+            self.node_relative_failure_rate.append(MISSING)
+
+    @classmethod
+    def from_daily_results(cls, daily_results: Dict[str, Any]) -> "DailyRewardsColumns":
+        """Build the columns from the result of `NodeRewardsClient.get_rewards_daily`"""
+        columns = cls()
+
+        for provider_id, provider_rewards in daily_results.get("provider_results", {}).items():
+            provider_index = len(columns.provider_id)
+            nodes = provider_rewards.get("daily_nodes_rewards", [])
+
+            columns.provider_id.append(_text(provider_id))
+            columns.provider_nodes_count.append(len(nodes))
+            columns.provider_total_base_rewards.append(
+                _int(provider_rewards.get("total_base_rewards_xdr_permyriad"))
+            )
+            columns.provider_total_adjusted_rewards.append(
+                _int(provider_rewards.get("total_adjusted_rewards_xdr_permyriad"))
+            )
+
+            for node in nodes:
+                columns.add_node(provider_index, node)
+
+        for subnet_id, failure_rate in daily_results.get("subnets_failure_rate", {}).items():
+            columns.subnet_id.append(_text(subnet_id))
+            columns.subnet_failure_rate.append(float(failure_rate))
+
+        return columns
+
+    def node_provider_ids(self) -> List[str]:
+        """Provider id of every node, aligned with the node columns"""
+        provider_id = self.provider_id
+        return [provider_id[i] for i in self.node_provider]
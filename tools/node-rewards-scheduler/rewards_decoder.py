@@ -0,0 +1,512 @@
+"""
+Streaming Candid decoder for the rewards calculation reply
+
+The generic ic-py decoder walks the reply through a byte pipe and builds
+every value, including fields the pipeline never reads such as the base
+rewards tables of every provider. For a full day that takes longer than
+the rest of the pipeline together.
+
+This decoder reads the type table the canister sent, compiles one small
+decode function per wire type and field, and runs them over the raw reply
+bytes. Fields that are not part of the requested spec are skipped without
+building any objects. The output has the shape `DailyRewardsColumns`
+expects: records become dicts, optionals lists of zero or one element,
+principals their textual form.
+
+Replies whose type table does not match the spec raise CandidDecodeError so
+callers can fall back to the generic decoder.
+"""
+
+import base64
+import struct
+import sys
+import zlib
+from typing import Any, Callable, Dict, List, Tuple
+
+MAGIC = b"DIDL"
+
+# Primitive and constructor type codes of the Candid binary format
+NULL = -1
+BOOL = -2
+NAT = -3
+INT = -4
+NAT8 = -5
+NAT16 = -6
+NAT32 = -7
+NAT64 = -8
+INT8 = -9
+INT16 = -10
+INT32 = -11
+INT64 = -12
+FLOAT32 = -13
+FLOAT64 = -14
+TEXT = -15
+RESERVED = -16
+EMPTY = -17
+OPT = -18
+VEC = -19
+RECORD = -20
+VARIANT = -21
+FUNC = -22
+SERVICE = -23
+PRINCIPAL = -24
+
+_FIXED = {
+    NAT8: struct.Struct("<B"),
+    NAT16: struct.Struct("<H"),
+    NAT32: struct.Struct("<I"),
+    NAT64: struct.Struct("<Q"),
+    INT8: struct.Struct("<b"),
+    INT16: struct.Struct("<h"),
+    INT32: struct.Struct("<i"),
+    INT64: struct.Struct("<q"),
+    FLOAT32: struct.Struct("<f"),
+    FLOAT64: struct.Struct("<d"),
+}
+
+Decoder = Callable[[bytes, int], Tuple[Any, int]]
+
+
+class CandidDecodeError(ValueError):
+    """The reply is malformed or does not match the expected spec"""
+
+
+class _Keep:
+    def __repr__(self):
+        return "KEEP"
+
+
+# Decode the value completely, whatever its wire type
+KEEP = _Keep()
+
+
+class MapOf:
+    """Spec of a vector of (key, value) tuples decoded into a dict"""
+
+    __slots__ = ("key", "value")
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+
+def idl_hash(name: str) -> int:
+    """Candid field id of a record field or variant tag name"""
+    h = 0
+    for b in name.encode("utf-8"):
+        h = (h * 223 + b) & 0xFFFFFFFF
+    return h
+
+
+def principal_text(raw: bytes) -> str:
+    """Textual form of a principal, as printed by `Principal.to_str`"""
+    checksum = (zlib.crc32(raw) & 0xFFFFFFFF).to_bytes(4, "big")
+    encoded = base64.b32encode(checksum + raw).decode("ascii").lower().rstrip("=")
+    return "-".join(encoded[i : i + 5] for i in range(0, len(encoded), 5))
+
+
+def _leb(data: bytes, pos: int) -> Tuple[int, int]:
+    b = data[pos]
+    if b < 0x80:
+        return b, pos + 1
+    result = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _sleb(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        shift += 7
+        if b < 0x80:
+            if b & 0x40:
+                result -= 1 << shift
+            return result, pos
+
+
+def read_header(data: bytes) -> Tuple[List[Tuple[int, Any]], List[int], int]:
+    """Parse magic, type table and argument types, returns them and the value offset"""
+    if data[:4] != MAGIC:
+        raise CandidDecodeError("Reply does not start with DIDL")
+    pos = 4
+    count, pos = _leb(data, pos)
+    table: List[Tuple[int, Any]] = []
+    for _ in range(count):
+        code, pos = _sleb(data, pos)
+        if code in (OPT, VEC):
+            inner, pos = _sleb(data, pos)
+            table.append((code, inner))
+        elif code in (RECORD, VARIANT):
+            length, pos = _leb(data, pos)
+            fields = []
+            for _ in range(length):
+                field_id, pos = _leb(data, pos)
+                field_type, pos = _sleb(data, pos)
+                fields.append((field_id, field_type))
+            table.append((code, fields))
+        elif code == FUNC:
+            for _ in range(2):
+                length, pos = _leb(data, pos)
+                for _ in range(length):
+                    _, pos = _sleb(data, pos)
+            length, pos = _leb(data, pos)
+            pos += length
+            table.append((code, None))
+        elif code == SERVICE:
+            length, pos = _leb(data, pos)
+            for _ in range(length):
+                name_length, pos = _leb(data, pos)
+                pos += name_length
+                _, pos = _sleb(data, pos)
+            table.append((code, None))
+        else:
+            raise CandidDecodeError(f"Unsupported type code {code} in the type table")
+
+    count, pos = _leb(data, pos)
+    args = []
+    for _ in range(count):
+        arg, pos = _sleb(data, pos)
+        args.append(arg)
+    return table, args, pos
+
+
+class _Compiler:
+    """Builds decode functions for the type table of one reply"""
+
+    def __init__(self, table: List[Tuple[int, Any]]):
+        self.table = table
+        self._keep: Dict[int, Decoder] = {}
+        self._skip: Dict[int, Decoder] = {}
+        # Principals and texts repeat a lot, e.g. subnet ids and regions
+        self._principals: Dict[bytes, str] = {}
+
+    def _entry(self, ref: int) -> Tuple[int, Any]:
+        if ref < 0:
+            return ref, None
+        try:
+            return self.table[ref]
+        except IndexError:
+            raise CandidDecodeError(f"Type reference {ref} is out of range") from None
+
+    def _principal(self, data: bytes, pos: int) -> Tuple[str, int]:
+        if data[pos] != 1:
+            raise CandidDecodeError("Opaque principal references are not supported")
+        length, pos = _leb(data, pos + 1)
+        raw = data[pos : pos + length]
+        text = self._principals.get(raw)
+        if text is None:
+            text = self._principals[raw] = sys.intern(principal_text(raw))
+        return text, pos + length
+
+    def _primitive(self, code: int) -> Decoder:
+        if code in _FIXED:
+            fixed = _FIXED[code]
+            unpack, size = fixed.unpack_from, fixed.size
+            return lambda data, pos: (unpack(data, pos)[0], pos + size)
+        if code == NAT:
+            return _leb
+        if code == INT:
+            return _sleb
+        if code == TEXT:
+
+            def text(data, pos):
+                length, pos = _leb(data, pos)
+                end = pos + length
+                return data[pos:end].decode("utf-8"), end
+
+            return text
+        if code == BOOL:
+            return lambda data, pos: (data[pos] == 1, pos + 1)
+        if code in (NULL, RESERVED):
+            return lambda data, pos: (None, pos)
+        if code == PRINCIPAL:
+            return self._principal
+        raise CandidDecodeError(f"Can not decode values of type {code}")
+
+    def keep(self, ref: int) -> Decoder:
+        """Decoder building the complete value of `ref`"""
+        if ref < 0:
+            return self._primitive(ref)
+        if ref in self._keep:
+            return self._keep[ref]
+
+        # Recursive types refer to themselves, resolve the decoder late
+        def deferred(data, pos):
+            return self._keep[ref](data, pos)
+
+        self._keep[ref] = deferred
+        code, inner = self._entry(ref)
+        if code in (RECORD, VARIANT):
+            spec = {f"_{field_id}": KEEP for field_id, _ in inner}
+            decoder = self._composite(code, inner, spec, by_id=True)
+        elif code == FUNC:
+            principal = self._principal
+            text = self._primitive(TEXT)
+
+            def decoder(data, pos):
+                canister, pos = principal(data, pos + 1)
+                method, pos = text(data, pos)
+                return (canister, method), pos
+
+        elif code == SERVICE:
+            decoder = self._principal
+        else:
+            decoder = self._container(code, inner, KEEP)
+        self._keep[ref] = decoder
+        return decoder
+
+    def skip(self, ref: int) -> Decoder:
+        """Decoder only advancing past a value of `ref`"""
+        if ref < 0:
+            if ref in _FIXED:
+                size = _FIXED[ref].size
+                return lambda data, pos: (None, pos + size)
+            if ref in (TEXT, PRINCIPAL):
+                # Principals carry an id tag before the length
+                offset = 1 if ref == PRINCIPAL else 0
+
+                def skip_sized(data, pos):
+                    length, pos = _leb(data, pos + offset)
+                    return None, pos + length
+
+                return skip_sized
+            decode = self._primitive(ref)
+
+            def skip_primitive(data, pos):
+                return None, decode(data, pos)[1]
+
+            return skip_primitive
+        if ref in self._skip:
+            return self._skip[ref]
+
+        def deferred(data, pos):
+            return self._skip[ref](data, pos)
+
+        self._skip[ref] = deferred
+        code, inner = self._entry(ref)
+        if code == OPT:
+            skip_inner = self.skip(inner)
+
+            def skipper(data, pos):
+                if data[pos]:
+                    return skip_inner(data, pos + 1)
+                return None, pos + 1
+
+        elif code == VEC:
+            if inner < 0 and inner in _FIXED:
+                size = _FIXED[inner].size
+
+                def skipper(data, pos):
+                    length, pos = _leb(data, pos)
+                    return None, pos + length * size
+
+            else:
+                skip_inner = self.skip(inner)
+
+                def skipper(data, pos):
+                    length, pos = _leb(data, pos)
+                    for _ in range(length):
+                        pos = skip_inner(data, pos)[1]
+                    return None, pos
+
+        elif code == RECORD:
+            skips = [self.skip(field_type) for _, field_type in inner]
+
+            def skipper(data, pos):
+                for skip_field in skips:
+                    pos = skip_field(data, pos)[1]
+                return None, pos
+
+        elif code == VARIANT:
+            skips = [self.skip(field_type) for _, field_type in inner]
+
+            def skipper(data, pos):
+                index, pos = _leb(data, pos)
+                return skips[index](data, pos)
+
+        else:
+            decode = self.keep(ref)
+
+            def skipper(data, pos):
+                return None, decode(data, pos)[1]
+
+        self._skip[ref] = skipper
+        return skipper
+
+    def compile(self, ref: int, spec) -> Decoder:
+        """Decoder producing only the parts of `ref` named in `spec`"""
+        if spec is KEEP:
+            return self.keep(ref)
+        code, inner = self._entry(ref)
+        if code in (OPT, VEC):
+            return self._container(code, inner, spec)
+        if isinstance(spec, MapOf):
+            raise CandidDecodeError(f"Expected a vector of tuples, got type {code}")
+        if isinstance(spec, tuple):
+            if code != RECORD or [field_id for field_id, _ in inner] != list(range(len(spec))):
+                raise CandidDecodeError(f"Expected a {len(spec)} tuple, got type {code}")
+            decoders = [self.compile(field_type, item) for (_, field_type), item in zip(inner, spec)]
+
+            def tuple_decoder(data, pos):
+                values = []
+                for decode in decoders:
+                    value, pos = decode(data, pos)
+                    values.append(value)
+                return tuple(values), pos
+
+            return tuple_decoder
+        if isinstance(spec, dict) and code in (RECORD, VARIANT):
+            return self._composite(code, inner, spec)
+        raise CandidDecodeError(f"Spec {spec!r} does not match type {code}")
+
+    def _container(self, code: int, inner: int, spec) -> Decoder:
+        if code == OPT:
+            decode = self.compile(inner, spec)
+
+            def opt(data, pos):
+                if data[pos]:
+                    value, pos = decode(data, pos + 1)
+                    return [value], pos
+                return [], pos + 1
+
+            return opt
+
+        if code != VEC:
+            raise CandidDecodeError(f"Expected an optional or vector, got type {code}")
+
+        if isinstance(spec, MapOf):
+            decode_key = self.compile(inner, (spec.key, spec.value))
+
+            def mapping(data, pos):
+                length, pos = _leb(data, pos)
+                result = {}
+                for _ in range(length):
+                    (key, value), pos = decode_key(data, pos)
+                    result[key] = value
+                return result, pos
+
+            return mapping
+
+        decode = self.compile(inner, spec)
+
+        def vec(data, pos):
+            length, pos = _leb(data, pos)
+            values = []
+            append = values.append
+            for _ in range(length):
+                value, pos = decode(data, pos)
+                append(value)
+            return values, pos
+
+        return vec
+
+    def _composite(self, code: int, fields, spec: Dict[str, Any], by_id: bool = False) -> Decoder:
+        names = {(int(name[1:]) if by_id else idl_hash(name)): name for name in spec}
+        steps = []
+        for field_id, field_type in fields:
+            name = names.get(field_id)
+            if name is None:
+                steps.append((None, self.skip(field_type)))
+            else:
+                steps.append((name, self.compile(field_type, spec[name])))
+
+        if code == VARIANT:
+
+            def variant(data, pos):
+                index, pos = _leb(data, pos)
+                if index >= len(steps):
+                    raise CandidDecodeError(f"Variant index {index} is out of range")
+                name, decode = steps[index]
+                value, pos = decode(data, pos)
+                # Tags outside the spec keep their id so the caller sees which one it was
+                return {name if name is not None else f"_{fields[index][0]}": value}, pos
+
+            return variant
+
+        def record(data, pos):
+            result = {}
+            for name, decode in steps:
+                value, pos = decode(data, pos)
+                if name is not None:
+                    result[name] = value
+            return result, pos
+
+        return record
+
+
+def decode_reply(reply: bytes, spec) -> Any:
+    """Decode the first value of a reply, keeping only the parts named in `spec`"""
+    try:
+        table, args, pos = read_header(reply)
+        if not args:
+            raise CandidDecodeError("Reply carries no values")
+        value, pos = _Compiler(table).compile(args[0], spec)(reply, pos)
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise CandidDecodeError(f"Truncated or malformed reply: {e}") from e
+    if len(args) == 1 and pos != len(reply):
+        raise CandidDecodeError(f"{len(reply) - pos} trailing bytes after the reply")
+    return value
+
+
+NODE_METRICS_SPEC = {
+    "subnet_assigned": KEEP,
+    "original_failure_rate": KEEP,
+    "relative_failure_rate": KEEP,
+}
+
+DAILY_NODE_REWARDS_SPEC = {
+    "node_id": KEEP,
+    "node_reward_type": KEEP,
+    "region": KEEP,
+    "dc_id": KEEP,
+    "daily_node_failure_rate": {
+        "SubnetMember": {"node_metrics": NODE_METRICS_SPEC},
+        "NonSubnetMember": {},
+    },
+    "performance_multiplier": KEEP,
+    "base_rewards_xdr_permyriad": KEEP,
+    "adjusted_rewards_xdr_permyriad": KEEP,
+}
+
+# Everything `DailyRewardsColumns` reads, base_rewards and base_rewards_type3 are skipped
+REWARDS_CALCULATION_SPEC = {
+    "Ok": {
+        "provider_results": MapOf(
+            KEEP,
+            {
+                "total_base_rewards_xdr_permyriad": KEEP,
+                "total_adjusted_rewards_xdr_permyriad": KEEP,
+                "daily_nodes_rewards": DAILY_NODE_REWARDS_SPEC,
+            },
+        ),
+        "subnets_failure_rate": MapOf(KEEP, KEEP),
+    },
+    "Err": KEEP,
+}
+
+
+def decode_rewards_calculation(reply: bytes) -> Dict[str, Any]:
+    """
+    Decode a `get_node_providers_rewards_calculation` reply
+
+    Returns {"Ok": {"provider_results": {...}, "subnets_failure_rate": {...}}}
+    keyed by principal text, or {"Err": message}.
+    """
+    result = decode_reply(reply, REWARDS_CALCULATION_SPEC)
+    if "Ok" in result:
+        daily_results = result["Ok"]
+        daily_results.setdefault("provider_results", {})
+        daily_results.setdefault("subnets_failure_rate", {})
+    elif "Err" not in result:
+        raise CandidDecodeError(f"Unexpected variant tag {next(iter(result))}")
+    return result
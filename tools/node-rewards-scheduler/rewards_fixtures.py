@@ -0,0 +1,149 @@
+"""
+Canister reply fixtures for offline runs of the rewards pipeline
+
+Fixtures are raw candid replies of `get_node_providers_rewards_calculation`,
+either recorded from the network once or generated synthetically at any
+scale, stored gzip compressed.
+"""
+
+import gzip
+import random
+
+from ic.candid import encode
+from ic.principal import Principal
+
+import node_rewards_ingester as nri
+from ic_client import query_reply
+
+REGIONS = (
+    "Europe,Switzerland,Zurich",
+    "Europe,Belgium,Brussels",
+    "North America,US,California",
+    "Asia,Japan,Tokyo",
+    "Africa,South Africa,Gauteng",
+)
+NODE_REWARD_TYPES = ("type1", "type1.1", "type3", "type3.1")
+
+
+def _principal(kind: int, index: int) -> Principal:
+    return Principal(bytes([kind]) + index.to_bytes(8, "big"))
+
+
+def synthetic_reply(providers: int = 500, nodes: int = 20000, subnets: int = 40, seed: int = 0) -> bytes:
+    """
+    Candid encoded reply with `providers` providers sharing `nodes` nodes
+
+    Optional fields are randomly left out and nodes are spread over subnet
+    members, non members and nodes without failure rate data to exercise
+    every branch of the pipeline.
+    """
+    rng = random.Random(seed)
+    subnet_ids = [_principal(2, i).to_str() for i in range(subnets)]
+    dcs = [f"{chr(97 + i % 26)}{chr(97 + i // 26 % 26)}{i % 9 + 1}" for i in range(max(1, providers // 4))]
+
+    def maybe(value, probability=0.95):
+        return [value] if rng.random() < probability else []
+
+    provider_results = []
+    for p in range(providers):
+        daily_nodes_rewards = []
+        for n in range(nodes // providers + (1 if p < nodes % providers else 0)):
+            kind = rng.random()
+            if kind < 0.7:
+                failure_rate = [
+                    {
+                        "SubnetMember": {
+                            "node_metrics": maybe(
+                                {
+                                    "subnet_assigned": maybe(rng.choice(subnet_ids)),
+                                    "subnet_assigned_failure_rate": maybe(rng.random() * 0.1),
+                                    "num_blocks_proposed": maybe(rng.randrange(100000)),
+                                    "num_blocks_failed": maybe(rng.randrange(100)),
+                                    "original_failure_rate": maybe(rng.random() * 0.2),
+                                    "relative_failure_rate": maybe(rng.random() * 0.2),
+                                }
+                            )
+                        }
+                    }
+                ]
+            elif kind < 0.95:
+                failure_rate = [{"NonSubnetMember": {"extrapolated_failure_rate": maybe(rng.random() * 0.1)}}]
+            else:
+                failure_rate = []
+
+            base = rng.uniform(1000, 30000)
+            multiplier = 1.0 if rng.random() < 0.9 else rng.uniform(0.2, 1.0)
+            daily_nodes_rewards.append(
+                {
+                    "node_id": maybe(_principal(3, p * 1000 + n).to_str(), 0.99),
+                    "node_reward_type": maybe(rng.choice(NODE_REWARD_TYPES)),
+                    "region": maybe(rng.choice(REGIONS)),
+                    "dc_id": maybe(rng.choice(dcs)),
+                    "daily_node_failure_rate": failure_rate,
+                    "performance_multiplier": maybe(multiplier),
+                    "rewards_reduction": maybe(1 - multiplier),
+                    "base_rewards_xdr_permyriad": maybe(base),
+                    "adjusted_rewards_xdr_permyriad": maybe(base * multiplier),
+                }
+            )
+
+        total_base = sum(node["base_rewards_xdr_permyriad"][0] for node in daily_nodes_rewards if node["base_rewards_xdr_permyriad"])
+        provider_results.append(
+            (
+                _principal(1, p).to_str(),
+                {
+                    "total_base_rewards_xdr_permyriad": maybe(int(total_base)),
+                    "total_adjusted_rewards_xdr_permyriad": maybe(int(total_base * 0.95)),
+                    "base_rewards": [
+                        {
+                            "monthly_xdr_permyriad": [30.0 * 10000],
+                            "daily_xdr_permyriad": [10000.0],
+                            "node_reward_type": [reward_type],
+                            "region": [rng.choice(REGIONS)],
+                        }
+                        for reward_type in NODE_REWARD_TYPES[:2]
+                    ],
+                    "base_rewards_type3": [
+                        {
+                            "region": [rng.choice(REGIONS)],
+                            "nodes_count": [len(daily_nodes_rewards)],
+                            "avg_rewards_xdr_permyriad": [15000.0],
+                            "avg_coefficient": [0.95],
+                            "daily_xdr_permyriad": [14000.0],
+                        }
+                    ],
+                    "daily_nodes_rewards": daily_nodes_rewards,
+                },
+            )
+        )
+
+    value = {
+        "Ok": {
+            "subnets_failure_rate": [(subnet_id, rng.random() * 0.05) for subnet_id in subnet_ids],
+            "provider_results": provider_results,
+        }
+    }
+    return encode([{"type": nri.GET_NODE_PROVIDERS_CALCULATION_RESPONSE_TYPE, "value": value}])
+
+
+def record_fixture(date: str, path: str, ic_url: str = nri.IC_URL):
+    """Query the node rewards canister once and store the raw reply"""
+    client = nri.NodeRewardsClient(ic_url, nri.NODE_REWARDS_CANISTER_ID)
+    reply = query_reply(
+        client.agent,
+        client.canister_id,
+        nri.REWARDS_CALCULATION_METHOD,
+        client._rewards_daily_arg(date),
+    )
+    save_fixture(path, reply)
+    return reply
+
+
+def save_fixture(path: str, reply: bytes):
+    with gzip.open(path, "wb") as f:
+        f.write(reply)
+
+
+def load_fixture(path: str) -> bytes:
+    with gzip.open(path, "rb") as f:
+        return f.read()
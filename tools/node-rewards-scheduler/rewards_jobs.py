@@ -0,0 +1,169 @@
+"""
+Persisted table of daily ingestion jobs
+
+Every UTC day the node rewards canister publishes one result. The scheduler
+tracks one job per date in this table so that failed or not yet published
+days are retried at increasing intervals and days missed while the ingester
+was down are caught up after a restart.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+JOBS_FORMAT_VERSION = 1
+
+
+class JobTable:
+    """
+    Date keyed job states, persisted as a single JSON file
+
+    Args:
+        path: File the table is stored in, kept in memory only when empty
+        retry_base_seconds: Delay before the first retry of a failed job
+        retry_max_seconds: Upper bound of the delay between retries
+        max_age_days: Jobs for dates older than this are dropped
+    """
+
+    def __init__(
+        self,
+        path: str = "",
+        retry_base_seconds: float = 300,
+        retry_max_seconds: float = 6 * 3600,
+        max_age_days: int = 400,
+    ):
+        self.path = path
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.max_age_days = max_age_days
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Starting with an empty job table, {self.path} is unreadable: {e}")
+            return {}
+        if stored.get("version") != JOBS_FORMAT_VERSION:
+            logger.info(f"Starting with an empty job table, {self.path} has an outdated format")
+            return {}
+        return stored.get("jobs", {})
+
+    def _save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file first so that a crash never leaves a partial table
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".jobs.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"version": JOBS_FORMAT_VERSION, "jobs": self._jobs},
+                    f,
+                    indent=1,
+                    sort_keys=True,
+                )
+            os.replace(tmp_path, self.path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def get(self, date: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(date)
+            return dict(job) if job is not None else None
+
+    def ensure(self, dates: Iterable[str], now: Optional[float] = None):
+        """Add a pending job for every date that is not tracked yet"""
+        now = time.time() if now is None else now
+        with self._lock:
+            added = [date for date in dates if date not in self._jobs]
+            for date in added:
+                self._jobs[date] = {"state": PENDING, "attempts": 0, "next_attempt": now}
+            if added:
+                self._prune()
+                self._save()
+
+    def due(self, now: Optional[float] = None) -> List[str]:
+        """Dates whose job should run now, newest first so fresh data lands first"""
+        now = time.time() if now is None else now
+        with self._lock:
+            return sorted(
+                (
+                    date
+                    for date, job in self._jobs.items()
+                    if job["state"] != DONE and job["next_attempt"] <= now
+                ),
+                reverse=True,
+            )
+
+    def next_attempt(self) -> Optional[float]:
+        """Earliest time any job becomes due, None when all jobs are done"""
+        with self._lock:
+            pending = [job["next_attempt"] for job in self._jobs.values() if job["state"] != DONE]
+            return min(pending) if pending else None
+
+    def mark_done(self, date: str, samples: int = 0):
+        with self._lock:
+            job = self._jobs.setdefault(date, {"attempts": 0})
+            job.update(
+                state=DONE,
+                attempts=job.get("attempts", 0) + 1,
+                next_attempt=0,
+                samples=samples,
+                finished=time.time(),
+            )
+            job.pop("error", None)
+            self._save()
+
+    def mark_failed(self, date: str, error: str, now: Optional[float] = None) -> float:
+        """Record a failed attempt, returns the delay until the next one"""
+        now = time.time() if now is None else now
+        with self._lock:
+            job = self._jobs.setdefault(date, {"attempts": 0})
+            attempts = job.get("attempts", 0) + 1
+            delay = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** (attempts - 1))
+            job.update(state=FAILED, attempts=attempts, next_attempt=now + delay, error=error)
+            self._save()
+            return delay
+
+    def postpone(self, date: str, delay: float, now: Optional[float] = None):
+        """Try again after `delay` without counting an attempt, e.g. not published yet"""
+        now = time.time() if now is None else now
+        with self._lock:
+            job = self._jobs.setdefault(date, {"state": PENDING, "attempts": 0})
+            job["next_attempt"] = now + delay
+            self._save()
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            result = {PENDING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                result[job["state"]] += 1
+            return result
+
+    def _prune(self):
+        cutoff = (
+            datetime.now(timezone.utc) - timedelta(days=self.max_age_days)
+        ).strftime("%Y-%m-%d")
+        for date in [date for date in self._jobs if date < cutoff]:
+            del self._jobs[date]
@@ -0,0 +1,99 @@
+"""
+Multi-day rewards queries
+
+The node rewards canister answers one day per query. A range of days is
+planned into chunks whose replies together stay below a byte budget, the
+queries of a chunk run concurrently, and the decoded days are merged into a
+single `RewardsRange` indexed by date.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def plan_days(start: str, end: str) -> List[str]:
+    """Every date from `start` to `end`, both included"""
+    first = datetime.strptime(start, "%Y-%m-%d")
+    last = datetime.strptime(end, "%Y-%m-%d")
+    if last < first:
+        raise ValueError(f"Range end {end} is before its start {start}")
+    return [
+        (first + timedelta(days=offset)).strftime("%Y-%m-%d")
+        for offset in range((last - first).days + 1)
+    ]
+
+
+def chunk_days(
+    dates: List[str], reply_bytes: int, max_bytes: int, max_days: Optional[int] = None
+) -> List[List[str]]:
+    """
+    Split dates into chunks whose replies fit into `max_bytes` together
+
+    Args:
+        dates: Dates to query, in order
+        reply_bytes: Expected size of the reply of a single day
+        max_bytes: Budget of the replies of one chunk, at least one day per chunk
+        max_days: Optional upper bound of days per chunk
+    """
+    size = max(1, max_bytes // max(1, reply_bytes))
+    if max_days is not None:
+        size = max(1, min(size, max_days))
+    return [dates[offset : offset + size] for offset in range(0, len(dates), size)]
+
+
+class RewardsRange:
+    """
+    Daily results of a range of days, indexed by date
+
+    Days that could not be fetched are kept in `errors` with the exception
+    that occurred, so callers can tell failed days from days they did not
+    ask for.
+    """
+
+    __slots__ = ("dates", "days", "errors")
+
+    def __init__(self, dates: Iterable[str]):
+        self.dates: List[str] = sorted(set(dates))
+        self.days: Dict[str, Dict[str, Any]] = {}
+        self.errors: Dict[str, Exception] = {}
+
+    @property
+    def start(self) -> Optional[str]:
+        return self.dates[0] if self.dates else None
+
+    @property
+    def end(self) -> Optional[str]:
+        return self.dates[-1] if self.dates else None
+
+    def add(self, date: str, daily_results: Dict[str, Any]):
+        self.days[date] = daily_results
+        self.errors.pop(date, None)
+
+    def fail(self, date: str, error: Exception):
+        self.days.pop(date, None)
+        self.errors[date] = error
+
+    def missing(self) -> List[str]:
+        """Planned dates that are neither fetched nor failed yet"""
+        return [date for date in self.dates if date not in self.days and date not in self.errors]
+
+    def get(self, date: str) -> Optional[Dict[str, Any]]:
+        return self.days.get(date)
+
+    def __contains__(self, date: str) -> bool:
+        return date in self.days
+
+    def __iter__(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Fetched days in date order"""
+        for date in self.dates:
+            if date in self.days:
+                yield date, self.days[date]
+
+    def __len__(self):
+        return len(self.days)
+
+    def __repr__(self):
+        return (
+            f"RewardsRange({self.start}..{self.end}, {len(self.days)} days, "
+            f"{len(self.errors)} failed)"
+        )
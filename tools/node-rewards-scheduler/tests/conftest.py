@@ -0,0 +1,7 @@
+import os
+import sys
+
+TOOLS = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The tools import their modules flat, as with PYTHONPATH in the containers
+sys.path[:0] = [os.path.join(TOOLS, "node-rewards-scheduler"), os.path.join(TOOLS, "common")]
@@ -0,0 +1,73 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from rewards_cache import RewardsCache
+
+
+def days_ago(days):
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def test_finished_days_are_served_from_disk(tmp_path):
+    cache = RewardsCache(str(tmp_path))
+    date = days_ago(2)
+    cache.put(date, {"provider": {"rewards": 1}})
+    assert RewardsCache(str(tmp_path)).get(date) == {"provider": {"rewards": 1}}
+
+
+def test_today_and_empty_results_are_not_cached(tmp_path):
+    cache = RewardsCache(str(tmp_path))
+    cache.put(days_ago(0), {"provider": 1})
+    cache.put(days_ago(2), {})
+    assert os.listdir(tmp_path) == []
+
+
+def test_corrupted_entries_are_dropped(tmp_path):
+    cache = RewardsCache(str(tmp_path))
+    date = days_ago(2)
+    cache.put(date, {"provider": 1})
+    path = tmp_path / f"{date}.json.gz"
+    with gzip.open(path, "rt") as f:
+        entry = json.load(f)
+    entry["data"]["provider"] = 2
+    with gzip.open(path, "wt") as f:
+        json.dump(entry, f)
+
+    assert cache.get(date) is None
+    assert not path.exists()
+
+
+def test_unreadable_entries_are_dropped(tmp_path):
+    cache = RewardsCache(str(tmp_path))
+    date = days_ago(2)
+    path = tmp_path / f"{date}.json.gz"
+    path.write_bytes(b"not gzip")
+    assert cache.get(date) is None
+    assert not path.exists()
+
+
+def test_expired_entries_are_evicted(tmp_path):
+    cache = RewardsCache(str(tmp_path), max_age_days=10)
+    cache.put(days_ago(20), {"provider": 1})
+    cache.put(days_ago(2), {"provider": 1})
+    assert sorted(os.listdir(tmp_path)) == [f"{days_ago(2)}.json.gz"]
+
+
+def test_oldest_entries_are_evicted_over_the_size_limit(tmp_path):
+    cache = RewardsCache(str(tmp_path))
+    cache.put(days_ago(5), {"provider": 1})
+    # Room for two entries, whose sizes differ by a few bytes
+    cache.max_bytes = int(2.5 * os.path.getsize(tmp_path / f"{days_ago(5)}.json.gz"))
+    cache.put(days_ago(4), {"provider": 1})
+    cache.put(days_ago(3), {"provider": 1})
+    assert sorted(os.listdir(tmp_path)) == [f"{days_ago(4)}.json.gz", f"{days_ago(3)}.json.gz"]
+
+
+def test_adopts_entries_of_the_flat_layout(tmp_path):
+    RewardsCache(str(tmp_path)).put(days_ago(2), {"provider": 1})
+    cache = RewardsCache(str(tmp_path / "mainnet"))
+    assert cache.adopt(str(tmp_path)) == 1
+    assert cache.get(days_ago(2)) == {"provider": 1}
+    assert os.listdir(tmp_path) == ["mainnet"]
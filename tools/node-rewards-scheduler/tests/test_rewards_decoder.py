@@ -0,0 +1,70 @@
+import pytest
+from ic.candid import encode
+
+import node_rewards_ingester as nri
+from check_decoder import column_differences, differences, fast_decode, generic_decode, project
+from rewards_columns import DailyRewardsColumns
+from rewards_decoder import REWARDS_CALCULATION_SPEC, CandidDecodeError, decode_rewards_calculation
+from rewards_fixtures import synthetic_reply
+
+DATE = "2025-01-01"
+
+
+def fallbacks() -> float:
+    return sum(
+        sample.value
+        for sample in nri.metrics.samples()
+        if sample.name == "node_rewards_ingester_candid_fast_decode_fallbacks_total"
+    )
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_synthetic_reply_matches_generic_decoder(seed):
+    reply = synthetic_reply(providers=20, nodes=400, subnets=8, seed=seed)
+    expected = generic_decode(reply)
+    actual = fast_decode(reply)
+
+    assert actual["provider_results"]
+    assert differences(project(expected, REWARDS_CALCULATION_SPEC["Ok"]), actual) == []
+    assert (
+        column_differences(
+            DailyRewardsColumns.from_daily_results(expected),
+            DailyRewardsColumns.from_daily_results(actual),
+        )
+        == []
+    )
+
+
+def test_err_variant_matches_generic_decoder():
+    reply = encode(
+        [{"type": nri.GET_NODE_PROVIDERS_CALCULATION_RESPONSE_TYPE, "value": {"Err": "not ready"}}]
+    )
+    assert decode_rewards_calculation(reply) == {"Err": "not ready"}
+    assert fast_decode(reply) == generic_decode(reply) == {}
+
+
+@pytest.mark.parametrize("cut", [3, 10, None])
+def test_malformed_reply_falls_back_to_generic_decoder(monkeypatch, cut):
+    reply = synthetic_reply(providers=2, nodes=10, subnets=2)
+    malformed = reply[: cut if cut is not None else len(reply) // 2]
+    with pytest.raises(CandidDecodeError):
+        decode_rewards_calculation(malformed)
+
+    generic_calls = []
+
+    def generic(method, data, return_type):
+        generic_calls.append(data)
+        # What the generic decoder returns for the complete reply
+        return nri.decode(reply, return_type)
+
+    monkeypatch.setattr(nri, "CANDID_FAST_DECODE", True)
+    monkeypatch.setattr(nri.NodeRewardsClient, "_decode", staticmethod(generic))
+    before = fallbacks()
+
+    result = nri.NodeRewardsClient._decode_rewards_daily(DATE, malformed)
+
+    assert generic_calls == [malformed]
+    assert fallbacks() == before + 1
+    expected = generic_decode(reply)
+    assert result["provider_results"].keys() == expected["provider_results"].keys()
+    assert result["subnets_failure_rate"] == expected["subnets_failure_rate"]
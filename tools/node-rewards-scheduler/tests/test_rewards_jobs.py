@@ -0,0 +1,80 @@
+import json
+import time
+from datetime import datetime, timezone
+
+from rewards_jobs import DONE, FAILED, PENDING, JobTable
+
+NOW = time.time()
+# Jobs older than max_age_days are pruned, the dates have to be recent
+YEAR = datetime.now(timezone.utc).year
+DAY1 = f"{YEAR}-01-01"
+DAY2 = f"{YEAR}-01-02"
+
+
+def test_new_dates_are_pending_and_due():
+    jobs = JobTable()
+    jobs.ensure([DAY1, DAY2], now=NOW)
+    assert jobs.counts() == {PENDING: 2, DONE: 0, FAILED: 0}
+    assert jobs.due(now=NOW) == [DAY2, DAY1]
+
+
+def test_done_jobs_are_not_due_again():
+    jobs = JobTable()
+    jobs.ensure([DAY1], now=NOW)
+    jobs.mark_done(DAY1, samples=10)
+    assert jobs.get(DAY1)["state"] == DONE
+    assert jobs.due(now=NOW) == []
+    assert jobs.next_attempt() is None
+    # Ensuring a tracked date again does not reset it
+    jobs.ensure([DAY1], now=NOW)
+    assert jobs.get(DAY1)["state"] == DONE
+
+
+def test_failed_jobs_back_off_up_to_the_maximum():
+    jobs = JobTable(retry_base_seconds=100, retry_max_seconds=250)
+    jobs.ensure([DAY1], now=NOW)
+    delays = [jobs.mark_failed(DAY1, "boom", now=NOW) for _ in range(3)]
+    assert delays == [100, 200, 250]
+
+    job = jobs.get(DAY1)
+    assert (job["state"], job["attempts"], job["error"]) == (FAILED, 3, "boom")
+    assert jobs.due(now=NOW + 249) == []
+    assert jobs.due(now=NOW + 250) == [DAY1]
+
+
+def test_done_after_failure_clears_the_error():
+    jobs = JobTable()
+    jobs.mark_failed(DAY1, "boom", now=NOW)
+    jobs.mark_done(DAY1)
+    job = jobs.get(DAY1)
+    assert job["state"] == DONE and "error" not in job and job["attempts"] == 2
+
+
+def test_postpone_does_not_count_an_attempt():
+    jobs = JobTable()
+    jobs.ensure([DAY1], now=NOW)
+    jobs.postpone(DAY1, 600, now=NOW)
+    job = jobs.get(DAY1)
+    assert (job["state"], job["attempts"], job["next_attempt"]) == (PENDING, 0, NOW + 600)
+
+
+def test_table_survives_a_reload(tmp_path):
+    path = str(tmp_path / "jobs.json")
+    jobs = JobTable(path)
+    jobs.ensure([DAY1, DAY2], now=NOW)
+    jobs.mark_done(DAY1)
+    jobs.mark_failed(DAY2, "boom", now=NOW)
+
+    reloaded = JobTable(path)
+    assert reloaded.get(DAY1)["state"] == DONE
+    assert reloaded.get(DAY2)["state"] == FAILED
+    assert not [name for name in tmp_path.iterdir() if name.suffix == ".tmp"]
+
+
+def test_unreadable_or_outdated_tables_start_empty(tmp_path):
+    path = tmp_path / "jobs.json"
+    path.write_text("{not json")
+    assert JobTable(str(path)).counts() == {PENDING: 0, DONE: 0, FAILED: 0}
+
+    path.write_text(json.dumps({"version": 0, "jobs": {DAY1: {"state": DONE}}}))
+    assert JobTable(str(path)).get(DAY1) is None
@@ -2,9 +2,11 @@ import logging
 import os
 import subprocess
 import time
-from urllib.parse import urljoin
 
 import requests
+from push_spool import PushSpool
+from resilience import ErrorKind, classify
+from victoria_exporter import Sample, VictoriaExporter
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -14,6 +16,8 @@ logging.basicConfig(
 
 REMOTE_URL = "https://github.com/dfinity/ic-observability-stack.git"
 VICTORIA_METRICS_URL = os.getenv("VICTORIA_METRICS_URL", "http://localhost:9090")
+# Samples that fail to push are kept here and replayed later, disabled when empty
+PUSH_SPOOL_DIR = os.getenv("PUSH_SPOOL_DIR", "")
 
 
 def wait_for_victoria_metrics(victoria_url):
@@ -129,34 +133,28 @@ def get_commits_difference(local_commit, remote_commit):
     return {"ahead": ahead_count, "behind": behind_count}
 
 
-def make_line(metric_name, value, ts, **kwargs):
+def make_sample(metric_name, value, ts, **kwargs):
     """
-    Make a prometheus metric line
+    Make a metric sample, labels are escaped by the exporter
     """
 
-    return f"{metric_name}{{ {', '.join([f'{key}="{value}"' for key, value in kwargs.items()])}  }} {value} {ts}"
+    return Sample(metric_name, kwargs, value, ts)
 
 
-def send_to_victoria(metrics, victoria_url):
-    import_url = urljoin(victoria_url.rstrip("/") + "/", "api/v1/import/prometheus")
-
-    response = requests.post(
-        import_url,
-        data=metrics.encode("utf-8"),
-        headers={"Content-Type": "text/plain"},
-        timeout=30,
-    )
-
+def send_to_victoria(metrics, exporter, spool=None):
     try:
-        response.raise_for_status()
-    except Exception:
-        logging.error("Failed to send metrics. Response: %s", response.text)
+        exporter.push_samples(metrics)
+    except Exception as e:
+        logging.error("Failed to send metrics: %s", e)
+        # Rejected samples would be rejected again when replayed
+        if spool is not None and classify(e) is ErrorKind.TRANSIENT:
+            spool.append(metrics)
         return
 
     logging.info("Successfully sent metrics to victoria")
 
 
-def ingest_metrics(installed_commit, victoria_url):
+def ingest_metrics(installed_commit, exporter, spool=None):
     timestamp_ms = int(time.time() * 1000)
     state = get_local_state()
 
@@ -167,22 +165,15 @@ def ingest_metrics(installed_commit, victoria_url):
     # stack.
     difference = get_commits_difference(get_current_commit(), remote_commit)
 
-    metrics = (
-        "\n".join(
-            [
-                make_line(
-                    "git_installed_commit", 1, timestamp_ms, commit=installed_commit
-                ),
-                make_line("git_local_state", 1, timestamp_ms, state=state),
-                make_line("git_remote_commit", 1, timestamp_ms, commit=remote_commit),
-                make_line("git_commits_ahead", difference["ahead"], timestamp_ms),
-                make_line("git_commits_behind", difference["behind"], timestamp_ms),
-            ]
-        )
-        + "\n"
-    )
+    metrics = [
+        make_sample("git_installed_commit", 1, timestamp_ms, commit=installed_commit),
+        make_sample("git_local_state", 1, timestamp_ms, state=state),
+        make_sample("git_remote_commit", 1, timestamp_ms, commit=remote_commit),
+        make_sample("git_commits_ahead", difference["ahead"], timestamp_ms),
+        make_sample("git_commits_behind", difference["behind"], timestamp_ms),
+    ]
 
-    send_to_victoria(metrics, victoria_url)
+    send_to_victoria(metrics, exporter, spool)
 
 
 def main():
@@ -191,9 +182,17 @@ def main():
     # Only fetch installed commit on startup
     installed_commit = get_current_commit()
 
+    # Reuse a single pooled connection for all pushes
+    exporter = VictoriaExporter(VICTORIA_METRICS_URL, pool_maxsize=1)
+
+    spool = None
+    if PUSH_SPOOL_DIR:
+        spool = PushSpool(PUSH_SPOOL_DIR, max_bytes=16 * 1024**2)
+        spool.start_flusher(exporter.push_samples, interval=60)
+
     while True:
         try:
-            ingest_metrics(installed_commit, VICTORIA_METRICS_URL)
+            ingest_metrics(installed_commit, exporter, spool)
         except Exception as e:
             logging.error("Something went wrong during last execution: %s", e)
 
@@ -0,0 +1,147 @@
+"""
+Metrics the provisioned dashboards and alerts read, per scrape job
+
+Every node exposes thousands of series but the dashboards and alert rules
+shipped with the stack only read a fraction of them. The `used-only`
+relabel profile keeps, per job, just the metric names some query reads and
+drops the rest at scrape time, before they are stored.
+
+A selector with a `job` matcher counts for the jobs it names, a selector
+without one (or with a templated one) counts for every job. `up` and the
+`scrape_*` series are generated by the scraper itself and are not subject
+to metric relabeling.
+"""
+
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+import requests
+
+from grafana_queries import Query, selectors
+
+
+class JobReport(NamedTuple):
+    job: str
+    total_series: int
+    kept_series: int
+    dropped: Dict[str, int]
+
+    @property
+    def dropped_series(self) -> int:
+        return self.total_series - self.kept_series
+
+
+def used_patterns(queries: Iterable[Query], jobs: List[str]) -> Dict[str, Set[str]]:
+    """Regexes of the metric names each job needs, literal names are escaped"""
+    usage: Dict[str, Set[str]] = {job: set() for job in jobs}
+    for query in queries:
+        for selector in selectors(query.expr):
+            pattern = re.escape(selector.name) if selector.literal else selector.name
+            selected = selector.label_values("job")
+            for job in jobs if selected is None else selected:
+                if job in usage:
+                    usage[job].add(pattern)
+    return usage
+
+
+def alternation(patterns: Iterable[str]) -> str:
+    return "(" + "|".join(sorted(patterns)) + ")"
+
+
+def keep_rule(patterns: Iterable[str]) -> Dict[str, object]:
+    return {"source_labels": ["__name__"], "regex": alternation(patterns), "action": "keep"}
+
+
+def drop_rule(patterns: Iterable[str]) -> Dict[str, object]:
+    return {"source_labels": ["__name__"], "regex": alternation(patterns), "action": "drop"}
+
+
+def metric_relabel_configs(
+    jobs: List[str],
+    usage: Optional[Dict[str, Set[str]]],
+    keep: List[str],
+    drop: List[str],
+) -> Dict[str, List[Dict[str, object]]]:
+    """
+    Metric relabel rules per job
+
+    Args:
+        jobs: Job names of the template
+        usage: Patterns per job to keep, None keeps every metric
+        keep: Extra patterns kept for every job in addition to `usage`
+        drop: Patterns dropped for every job, even when a query reads them
+    """
+    rules: Dict[str, List[Dict[str, object]]] = {job: [] for job in jobs}
+    for job in jobs:
+        if usage is not None:
+            patterns = usage.get(job, set()) | set(keep)
+            if not patterns:
+                raise ValueError(
+                    f"No dashboard or alert reads metrics of job {job}, "
+                    "the used-only profile would drop all of them, add --keep-metric"
+                )
+            rules[job].append(keep_rule(patterns))
+        if drop:
+            rules[job].append(drop_rule(drop))
+    return rules
+
+
+def _matches(name: str, rules: List[Dict[str, object]]) -> bool:
+    """Whether relabeling keeps a series named `name`, regexes are anchored"""
+    for rule in rules:
+        matched = re.fullmatch(str(rule["regex"]), name) is not None
+        if matched != (rule["action"] == "keep"):
+            return False
+    return True
+
+
+def series_per_metric(url: str, job: str, timeout: float = 60) -> Dict[str, int]:
+    """Current series count of every metric name of `job` in VictoriaMetrics"""
+    response = requests.get(
+        f"{url.rstrip('/')}/api/v1/query",
+        params={"query": f'count by (__name__) ({{job="{job}"}})'},
+        timeout=timeout,
+    )
+    response.raise_for_status()
+    payload = response.json()
+    if payload.get("status") != "success":
+        raise ValueError(f"Series query for job {job} failed: {payload.get('error')}")
+    return {
+        sample["metric"].get("__name__", ""): int(float(sample["value"][1]))
+        for sample in payload["data"]["result"]
+    }
+
+
+def series_report(
+    url: str, rules: Dict[str, List[Dict[str, object]]]
+) -> List[JobReport]:
+    """Series each job stores now and how many of them `rules` would keep"""
+    reports = []
+    for job, job_rules in rules.items():
+        counts = series_per_metric(url, job)
+        dropped = {
+            name: count
+            for name, count in counts.items()
+            if not re.match(r"^(up|scrape_.*)$", name) and not _matches(name, job_rules)
+        }
+        total = sum(counts.values())
+        reports.append(JobReport(job, total, total - sum(dropped.values()), dropped))
+    return reports
+
+
+def format_report(reports: List[JobReport], top: int = 10) -> str:
+    lines = []
+    total = sum(report.total_series for report in reports)
+    dropped = sum(report.dropped_series for report in reports)
+    for report in reports:
+        share = report.dropped_series / report.total_series if report.total_series else 0
+        lines.append(
+            f"{report.job}: {report.total_series} series, keeps {report.kept_series}, "
+            f"drops {report.dropped_series} ({share:.0%}) of {len(report.dropped)} metrics"
+        )
+        ranked = sorted(report.dropped.items(), key=lambda item: (-item[1], item[0]))
+        for name, count in ranked[:top]:
+            lines.append(f"    {count:>8} {name}")
+    share = dropped / total if total else 0
+    lines.append(f"total: {total} series, would save {dropped} ({share:.0%})")
+    return "\n".join(lines)
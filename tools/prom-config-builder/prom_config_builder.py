@@ -1,8 +1,28 @@
 import argparse
+import copy
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import time
 import urllib.parse
+from typing import Any, Dict, List, NamedTuple, Optional
 
+import requests
 import yaml
 
+from grafana_queries import dashboard_files, load_queries
+from metric_usage import format_report, metric_relabel_configs, series_report, used_patterns
+from scrape_config_schema import check_with_binary, validate
+
+# Regex of the relabel rule that restricts a job to the targets of its type
+JOB_RELABEL_PLACEHOLDER = "<job-relabel-placeholder>"
+
+SHARD_FIELDS = ("node_provider_id", "dc_id", "scrape_interval", "scrape_timeout", "name")
+
+RELABEL_PROFILES = ("all", "used-only")
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
@@ -27,15 +47,41 @@ def parse_args() -> argparse.Namespace:
 
     parser.add_argument(
         "--node-provider-id",
-        dest="node_provider_id",
-        help="The principal id for the node provider",
+        dest="node_provider_ids",
+        action="append",
+        default=[],
+        help="The principal id for the node provider, can be repeated",
     )
 
     parser.add_argument(
         "--dc-id",
-        dest="dc_id",
+        dest="dc_ids",
+        action="append",
+        default=[],
+        help="The data center id represented with two letters and a number, can be repeated. "
+        "Every node provider is combined with every data center",
+    )
+
+    parser.add_argument(
+        "--shards-file",
+        dest="shards_file",
+        default=None,
+        help="YAML file with a list of shards, each with a node_provider_id and optionally "
+        "a dc_id, name, scrape_interval and scrape_timeout",
+    )
+
+    parser.add_argument(
+        "--scrape-interval",
+        dest="scrape_interval",
+        default=None,
+        help="Scrape interval of the shards given on the command line",
+    )
+
+    parser.add_argument(
+        "--scrape-timeout",
+        dest="scrape_timeout",
         default=None,
-        help="The data center id represented with two letters and a number",
+        help="Scrape timeout of the shards given on the command line",
     )
 
     parser.add_argument(
@@ -45,49 +91,383 @@ def parse_args() -> argparse.Namespace:
         help="Override the host for multiservice-discovery container. If not running in network_mode: host it will be multiservice-discovery:8000",
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "--relabel-profile",
+        dest="relabel_profile",
+        choices=RELABEL_PROFILES,
+        default="all",
+        help="Store every scraped metric, or only the metrics the provisioned dashboards "
+        "and alerts read",
+    )
+
+    parser.add_argument(
+        "--keep-metric",
+        dest="keep_metrics",
+        action="append",
+        default=[],
+        help="Regex of metric names the used-only profile keeps in addition, can be repeated",
+    )
+
+    parser.add_argument(
+        "--drop-metric",
+        dest="drop_metrics",
+        action="append",
+        default=[],
+        help="Regex of metric names that are never stored, can be repeated",
+    )
 
+    parser.add_argument(
+        "--dashboards-path",
+        dest="dashboards_path",
+        default="/config/grafana/provisioning/dashboards",
+        help="Directory with the provisioned dashboards the used-only profile scans",
+    )
 
-def expand_anchors_text(yaml_text: str) -> str:
-    data = yaml.safe_load(yaml_text)
+    parser.add_argument(
+        "--alerts-path",
+        dest="alerts_path",
+        default="/config/grafana/provisioning/alerting/alerts.yaml",
+        help="Alert rules file the used-only profile scans",
+    )
 
-    class NoAliasDumper(yaml.SafeDumper):
-        # always return True to *prevent* YAML from emitting aliases
-        def ignore_aliases(self, data):
-            return True
+    parser.add_argument(
+        "--report-url",
+        dest="report_url",
+        default=None,
+        help="VictoriaMetrics url, when set print how many stored series the used-only "
+        "profile would drop per job",
+    )
 
-    return yaml.dump(
-        data, Dumper=NoAliasDumper, default_flow_style=False, sort_keys=False
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and rebuild whenever the template, the shards file, the "
+        "dashboards or the alerts change",
     )
 
+    parser.add_argument(
+        "--watch-interval",
+        dest="watch_interval",
+        type=float,
+        default=5,
+        help="Seconds between checks for changed inputs in --watch mode",
+    )
 
-if __name__ == "__main__":
-    args = parse_args()
+    parser.add_argument(
+        "--vmagent-path",
+        dest="vmagent_path",
+        default=None,
+        help="vmagent or victoria-metrics binary used to dry run the generated config",
+    )
+
+    return parser.parse_args()
+
+
+class Shard(NamedTuple):
+    """Targets of one node provider, optionally limited to one data center"""
+
+    node_provider_id: str
+    dc_id: Optional[str] = None
+    scrape_interval: Optional[str] = None
+    scrape_timeout: Optional[str] = None
+    name: Optional[str] = None
+
+    @property
+    def key(self):
+        return (self.node_provider_id, self.dc_id or "")
+
+
+def load_shards_file(path: str) -> List[Shard]:
+    with open(path, "r") as f:
+        data = yaml.safe_load(f) or {}
+
+    entries = data.get("shards", []) if isinstance(data, dict) else data
+    shards = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get("node_provider_id"):
+            raise ValueError(f"Shard {index} of {path} needs a node_provider_id")
+        unknown = set(entry) - set(SHARD_FIELDS)
+        if unknown:
+            raise ValueError(f"Shard {index} of {path} has unknown fields {sorted(unknown)}")
+        shards.append(Shard(**{key: str(value) for key, value in entry.items()}))
+    return shards
 
-    with open(args.template_path, "r") as f:
-        text = f.read()
-        template = dict(yaml.safe_load(expand_anchors_text(text)))
 
-    for scrape_config in template["scrape_configs"]:
-        job_name = scrape_config["job_name"]
+def collect_shards(args: argparse.Namespace) -> List[Shard]:
+    """
+    Shards from the command line matrix and the shards file, in a
+    deterministic order independent of the order they were given in
+    """
+    shards = []
+    for node_provider_id in args.node_provider_ids:
+        for dc_id in args.dc_ids or [None]:
+            shards.append(
+                Shard(node_provider_id, dc_id, args.scrape_interval, args.scrape_timeout)
+            )
+    if args.shards_file:
+        shards.extend(load_shards_file(args.shards_file))
 
-        # Restrict job
-        scrape_config["relabel_configs"][2]["regex"] = job_name
+    if not shards:
+        raise ValueError("At least one --node-provider-id or a --shards-file is required")
 
-        url = scrape_config["http_sd_configs"][0]["url"]
-        params = {"node_provider_id": args.node_provider_id}
-        if args.dc_id is not None:
-            params["dc_id"] = args.dc_id
+    unique: Dict[Any, Shard] = {}
+    for shard in shards:
+        previous = unique.get(shard.key)
+        if previous is not None and previous != shard:
+            raise ValueError(
+                f"Conflicting settings for node provider {shard.node_provider_id} "
+                f"and data center {shard.dc_id}"
+            )
+        unique[shard.key] = shard
 
-        url_parts = urllib.parse.urlparse(url)
-        encoded_query = urllib.parse.urlencode(params)
+    # A provider wide shard already scrapes the targets of every data center of the provider
+    for node_provider_id, dc_id in unique:
+        if dc_id and (node_provider_id, "") in unique:
+            raise ValueError(
+                f"Node provider {node_provider_id} has a shard for all data centers and one "
+                f"for data center {dc_id}, its targets would be scraped twice"
+            )
+    return [unique[key] for key in sorted(unique)]
 
-        scrape_config["http_sd_configs"][0]["url"] = urllib.parse.urlunparse(
-            url_parts._replace(query=encoded_query, netloc=args.sd_url)
+
+def shard_names(shards: List[Shard]) -> List[str]:
+    """
+    Stable job name suffix per shard, built from the first group of the
+    principal and the data center, extended until every name is unique
+    """
+    names = []
+    for groups in range(1, 12):
+        names = [
+            shard.name
+            or "-".join(shard.node_provider_id.split("-")[:groups] + [shard.dc_id or "all"])
+            for shard in shards
+        ]
+        if len(set(names)) == len(names):
+            return [re.sub(r"[^a-zA-Z0-9_-]", "_", name) for name in names]
+    raise ValueError(f"Shard names are not unique: {names}")
+
+
+class NoAliasDumper(yaml.SafeDumper):
+    # always return True to *prevent* YAML from emitting aliases
+    def ignore_aliases(self, data):
+        return True
+
+
+def load_template(path: str) -> Dict[str, Any]:
+    """Parse the template once, the loader resolves anchors and merge keys"""
+    with open(path, "r") as f:
+        return dict(yaml.safe_load(f))
+
+
+def render(config: Dict[str, Any]) -> str:
+    """Serialize the config without aliases, the way it is written to disk"""
+    return yaml.dump(config, Dumper=NoAliasDumper, default_flow_style=False)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def write_if_changed(path: str, text: str) -> bool:
+    """
+    Atomically replace `path` with `text` unless it already has that content
+
+    VictoriaMetrics re-reads the scrape config every few seconds and reloads
+    it on any change, so unchanged output is never rewritten and readers
+    never see a partially written file.
+    """
+    try:
+        with open(path, "r") as f:
+            if content_hash(f.read()) == content_hash(text):
+                return False
+    except FileNotFoundError:
+        pass
+
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".config.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file readable by the owner only
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return True
+
+
+def restrict_to_job(scrape_config: Dict[str, Any], job: str):
+    """Point the placeholder relabel rule at the targets of `job`"""
+    for rule in scrape_config.get("relabel_configs", []):
+        if rule.get("regex") == JOB_RELABEL_PLACEHOLDER:
+            rule["regex"] = job
+            return
+    raise ValueError(f"Job {job} has no relabel rule with regex {JOB_RELABEL_PLACEHOLDER}")
+
+
+def sd_url(url: str, shard: Shard, netloc: str) -> str:
+    params = {"node_provider_id": shard.node_provider_id}
+    if shard.dc_id is not None:
+        params["dc_id"] = shard.dc_id
+
+    url_parts = urllib.parse.urlparse(url)
+    encoded_query = urllib.parse.urlencode(params)
+    return urllib.parse.urlunparse(url_parts._replace(query=encoded_query, netloc=netloc))
+
+
+def template_jobs(template: Dict[str, Any]) -> List[str]:
+    return [job_template["job_name"] for job_template in template["scrape_configs"]]
+
+
+def relabel_rules(
+    args: argparse.Namespace, jobs: List[str], profile: str
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Metric relabel rules per template job for `profile`"""
+    usage = None
+    if profile == "used-only":
+        usage = used_patterns(load_queries(args.dashboards_path, args.alerts_path), jobs)
+    return metric_relabel_configs(jobs, usage, args.keep_metrics, args.drop_metrics)
+
+
+def build_config(
+    template: Dict[str, Any],
+    shards: List[Shard],
+    netloc: str,
+    metric_relabels: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+) -> Dict[str, Any]:
+    """
+    Expand every job of the template into one scrape job per shard
+
+    Jobs are grouped by job type in template order and by shard in sorted
+    order, so the same inputs always produce the same file. Every shard has
+    its own jobs and therefore its own scrape loop and timeout, a slow data
+    center does not hold back the others. A single shard keeps the plain job
+    names of the template. `metric_relabels` are appended to the metric
+    relabel rules of the jobs of each job type.
+    """
+    config = {key: value for key, value in template.items() if key != "anchors"}
+    names = shard_names(shards)
+
+    scrape_configs = []
+    for job_template in template["scrape_configs"]:
+        job = job_template["job_name"]
+        for shard, name in zip(shards, names):
+            scrape_config = copy.deepcopy(job_template)
+            scrape_config["job_name"] = job if len(shards) == 1 else f"{job}-{name}"
+
+            # Targets carry their job type in the `job` label, shards share it
+            restrict_to_job(scrape_config, job)
+
+            for sd_config in scrape_config["http_sd_configs"]:
+                sd_config["url"] = sd_url(sd_config["url"], shard, netloc)
+
+            if shard.scrape_interval is not None:
+                scrape_config["scrape_interval"] = shard.scrape_interval
+            if shard.scrape_timeout is not None:
+                scrape_config["scrape_timeout"] = shard.scrape_timeout
+
+            rules = (metric_relabels or {}).get(job)
+            if rules:
+                scrape_config["metric_relabel_configs"] = scrape_config.get(
+                    "metric_relabel_configs", []
+                ) + copy.deepcopy(rules)
+
+            scrape_configs.append(scrape_config)
+
+    config["scrape_configs"] = scrape_configs
+    return config
+
+
+def build(args: argparse.Namespace) -> bool:
+    """Build the config from the current inputs, returns whether the output changed"""
+    shards = collect_shards(args)
+    template = load_template(args.template_path)
+    jobs = template_jobs(template)
+    config = build_config(
+        template, shards, args.sd_url, relabel_rules(args, jobs, args.relabel_profile)
+    )
+
+    errors = validate(config)
+    if errors:
+        raise ValueError(
+            "Generated config is invalid:\n" + "\n".join(f"  {error}" for error in errors)
         )
 
-    # Drop anchors
-    del template["anchors"]
+    text = render(config)
+    if args.vmagent_path:
+        # Dry run a copy so an invalid config never reaches the output path
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml") as f:
+            f.write(text)
+            f.flush()
+            errors = check_with_binary(args.vmagent_path, f.name)
+        if errors:
+            raise ValueError("\n".join(errors))
+
+    changed = write_if_changed(args.output_path, text)
+    summary = f"{len(config['scrape_configs'])} scrape jobs for {len(shards)} shards"
+    if changed:
+        print(f"Wrote {summary} to {args.output_path}", flush=True)
+    else:
+        print(f"{args.output_path} is up to date ({summary})", flush=True)
+
+    if args.report_url:
+        # Always report what the used-only profile saves, also while it is not enabled
+        rules = relabel_rules(args, jobs, "used-only")
+        print(format_report(series_report(args.report_url, rules)), flush=True)
+    return changed
+
+
+def input_state(args: argparse.Namespace):
+    """Modification state of every input and of the output"""
+    state = []
+    paths = [args.template_path, args.shards_file, args.output_path]
+    if args.relabel_profile == "used-only":
+        paths.append(args.alerts_path)
+        paths.extend(dashboard_files(args.dashboards_path))
+    for path in paths:
+        if path is None:
+            continue
+        try:
+            stat = os.stat(path)
+            state.append((path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            state.append((path, None, None))
+    return state
+
+
+def watch(args: argparse.Namespace):
+    """Rebuild whenever an input changes or the output is removed"""
+    print(f"Watching {args.template_path} for changes every {args.watch_interval}s", flush=True)
+    last_state = None
+    while True:
+        state = input_state(args)
+        if state != last_state:
+            try:
+                build(args)
+            except (OSError, ValueError, yaml.YAMLError, requests.RequestException) as e:
+                print(f"Build failed, keeping the previous output: {e}", file=sys.stderr, flush=True)
+            # The build itself may have touched the output
+            last_state = input_state(args)
+        time.sleep(args.watch_interval)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.watch:
+        try:
+            watch(args)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
 
-    with open(args.output_path, "w") as f:
-        f.write(yaml.safe_dump(template))
+    try:
+        build(args)
+    except (OSError, ValueError, yaml.YAMLError, requests.RequestException) as e:
+        sys.exit(str(e))
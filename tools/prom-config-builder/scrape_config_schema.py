@@ -0,0 +1,301 @@
+"""
+Validation of generated scrape configs against the vmagent config schema
+
+vmagent and VictoriaMetrics parse `-promscrape.config` strictly: unknown
+fields, malformed durations or duplicate job names make the whole config
+reload fail and scraping continues with the previous config. The checks
+below mirror the fields vmagent accepts, see
+https://docs.victoriametrics.com/victoriametrics/sd_configs/#scrape_configs
+so mistakes surface when the config is built instead of in the logs of the
+running stack. `check_with_binary` additionally runs the real parser when a
+vmagent or victoria-metrics binary is available.
+"""
+
+import re
+import subprocess
+from typing import Any, Dict, List, Optional
+
+TOP_LEVEL_FIELDS = frozenset(("global", "scrape_configs", "scrape_config_files"))
+
+GLOBAL_FIELDS = frozenset(
+    (
+        "scrape_interval",
+        "scrape_timeout",
+        "external_labels",
+        "relabel_configs",
+        "metric_relabel_configs",
+    )
+)
+
+SD_CONFIGS = frozenset(
+    (
+        "azure_sd_configs",
+        "consul_sd_configs",
+        "consulagent_sd_configs",
+        "digitalocean_sd_configs",
+        "dns_sd_configs",
+        "docker_sd_configs",
+        "dockerswarm_sd_configs",
+        "ec2_sd_configs",
+        "eureka_sd_configs",
+        "file_sd_configs",
+        "gce_sd_configs",
+        "hetzner_sd_configs",
+        "http_sd_configs",
+        "kubernetes_sd_configs",
+        "kuma_sd_configs",
+        "marathon_sd_configs",
+        "nomad_sd_configs",
+        "openstack_sd_configs",
+        "ovhcloud_sd_configs",
+        "puppetdb_sd_configs",
+        "static_configs",
+        "vultr_sd_configs",
+        "yandexcloud_sd_configs",
+    )
+)
+
+SCRAPE_CONFIG_FIELDS = SD_CONFIGS | frozenset(
+    (
+        "job_name",
+        "scrape_interval",
+        "scrape_timeout",
+        "max_scrape_size",
+        "metrics_path",
+        "honor_labels",
+        "honor_timestamps",
+        "follow_redirects",
+        "scheme",
+        "params",
+        "basic_auth",
+        "bearer_token",
+        "bearer_token_file",
+        "authorization",
+        "oauth2",
+        "tls_config",
+        "headers",
+        "proxy_url",
+        "proxy_basic_auth",
+        "proxy_bearer_token",
+        "proxy_bearer_token_file",
+        "proxy_tls_config",
+        "proxy_oauth2",
+        "proxy_authorization",
+        "proxy_headers",
+        "relabel_configs",
+        "metric_relabel_configs",
+        "sample_limit",
+        "label_limit",
+        "series_limit",
+        "disable_compression",
+        "disable_keepalive",
+        "stream_parse",
+        "scrape_align_interval",
+        "scrape_offset",
+        "no_stale_markers",
+        "relabel_debug",
+        "metric_relabel_debug",
+    )
+)
+
+RELABEL_CONFIG_FIELDS = frozenset(
+    (
+        "source_labels",
+        "separator",
+        "target_label",
+        "regex",
+        "modulus",
+        "replacement",
+        "action",
+        "if",
+        "match",
+        "labels",
+    )
+)
+
+RELABEL_ACTIONS = frozenset(
+    (
+        "replace",
+        "replace_all",
+        "keep",
+        "drop",
+        "keepequal",
+        "dropequal",
+        "keep_if_equal",
+        "drop_if_equal",
+        "keep_if_contains",
+        "drop_if_contains",
+        "hashmod",
+        "labelmap",
+        "labelmap_all",
+        "labeldrop",
+        "labelkeep",
+        "lowercase",
+        "uppercase",
+        "graphite",
+        "keep_metrics",
+        "drop_metrics",
+    )
+)
+
+TLS_CONFIG_FIELDS = frozenset(
+    (
+        "ca",
+        "ca_file",
+        "cert",
+        "cert_file",
+        "key",
+        "key_file",
+        "server_name",
+        "insecure_skip_verify",
+        "min_version",
+    )
+)
+
+SCHEMES = frozenset(("http", "https"))
+
+_DURATION = re.compile(r"^(\d+(\.\d+)?(ms|s|m|h|d|w|y))+$")
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h|d|w|y)")
+_UNIT_SECONDS = {
+    "ms": 0.001,
+    "s": 1,
+    "m": 60,
+    "h": 3600,
+    "d": 86400,
+    "w": 7 * 86400,
+    "y": 365 * 86400,
+}
+
+# vmagent defaults when neither the job nor the global section sets them
+DEFAULT_SCRAPE_INTERVAL = "1m"
+
+
+def duration_seconds(value: str) -> float:
+    """Seconds of a Prometheus style duration such as `1m30s`"""
+    if not isinstance(value, str) or not _DURATION.match(value):
+        raise ValueError(f"Invalid duration {value!r}")
+    return sum(float(number) * _UNIT_SECONDS[unit] for number, unit in _DURATION_PART.findall(value))
+
+
+class _Checker:
+    def __init__(self):
+        self.errors: List[str] = []
+
+    def error(self, where: str, message: str):
+        self.errors.append(f"{where}: {message}")
+
+    def fields(self, where: str, section: Any, allowed: frozenset) -> bool:
+        if not isinstance(section, dict):
+            self.error(where, f"expected a mapping, got {type(section).__name__}")
+            return False
+        for key in section:
+            if key not in allowed:
+                self.error(where, f"unknown field {key!r}")
+        return True
+
+    def duration(self, where: str, value: Any) -> Optional[float]:
+        try:
+            return duration_seconds(value)
+        except ValueError as e:
+            self.error(where, str(e))
+            return None
+
+    def relabel_configs(self, where: str, relabel_configs: Any):
+        if not isinstance(relabel_configs, list):
+            self.error(where, "expected a list")
+            return
+        for index, rule in enumerate(relabel_configs):
+            rule_where = f"{where}[{index}]"
+            if not self.fields(rule_where, rule, RELABEL_CONFIG_FIELDS):
+                continue
+            action = rule.get("action", "replace")
+            if action not in RELABEL_ACTIONS:
+                self.error(rule_where, f"unknown action {action!r}")
+            regex = rule.get("regex")
+            if isinstance(regex, str):
+                try:
+                    re.compile(regex)
+                except re.error as e:
+                    self.error(rule_where, f"invalid regex {regex!r}: {e}")
+            if action in ("replace", "hashmod") and "target_label" not in rule:
+                self.error(rule_where, f"action {action!r} needs a target_label")
+
+    def scrape_config(self, where: str, scrape_config: Any, global_interval: str):
+        if not self.fields(where, scrape_config, SCRAPE_CONFIG_FIELDS):
+            return
+        if not isinstance(scrape_config.get("job_name"), str) or not scrape_config["job_name"]:
+            self.error(where, "job_name is required")
+
+        interval = self.duration(
+            f"{where}.scrape_interval", scrape_config.get("scrape_interval", global_interval)
+        )
+        if "scrape_timeout" in scrape_config:
+            timeout = self.duration(f"{where}.scrape_timeout", scrape_config["scrape_timeout"])
+            if interval is not None and timeout is not None and timeout > interval:
+                self.error(
+                    where,
+                    f"scrape_timeout {scrape_config['scrape_timeout']} exceeds scrape_interval "
+                    f"{scrape_config.get('scrape_interval', global_interval)}",
+                )
+
+        scheme = scrape_config.get("scheme", "http")
+        if scheme not in SCHEMES:
+            self.error(where, f"unsupported scheme {scheme!r}")
+        if "tls_config" in scrape_config:
+            self.fields(f"{where}.tls_config", scrape_config["tls_config"], TLS_CONFIG_FIELDS)
+
+        for key in ("relabel_configs", "metric_relabel_configs"):
+            if key in scrape_config:
+                self.relabel_configs(f"{where}.{key}", scrape_config[key])
+
+        for index, sd_config in enumerate(scrape_config.get("http_sd_configs", [])):
+            if not isinstance(sd_config, dict) or not sd_config.get("url"):
+                self.error(f"{where}.http_sd_configs[{index}]", "url is required")
+
+
+def validate(config: Dict[str, Any]) -> List[str]:
+    """Return every schema violation of a scrape config, empty when valid"""
+    checker = _Checker()
+    if not checker.fields("config", config, TOP_LEVEL_FIELDS):
+        return checker.errors
+
+    global_section = config.get("global", {}) or {}
+    global_interval = DEFAULT_SCRAPE_INTERVAL
+    if checker.fields("global", global_section, GLOBAL_FIELDS):
+        global_interval = global_section.get("scrape_interval", DEFAULT_SCRAPE_INTERVAL)
+        checker.duration("global.scrape_interval", global_interval)
+        if "scrape_timeout" in global_section:
+            checker.duration("global.scrape_timeout", global_section["scrape_timeout"])
+        for key in ("relabel_configs", "metric_relabel_configs"):
+            if key in global_section:
+                checker.relabel_configs(f"global.{key}", global_section[key])
+
+    scrape_configs = config.get("scrape_configs", [])
+    if not isinstance(scrape_configs, list):
+        checker.error("scrape_configs", "expected a list")
+        return checker.errors
+
+    seen = set()
+    for index, scrape_config in enumerate(scrape_configs):
+        where = f"scrape_configs[{index}]"
+        if isinstance(scrape_config, dict) and "job_name" in scrape_config:
+            where = f"scrape_configs[{scrape_config['job_name']}]"
+            if scrape_config["job_name"] in seen:
+                checker.error(where, "duplicate job_name")
+            seen.add(scrape_config["job_name"])
+        checker.scrape_config(where, scrape_config, global_interval)
+
+    return checker.errors
+
+
+def check_with_binary(binary: str, config_path: str) -> List[str]:
+    """Let a vmagent or victoria-metrics binary parse the config with -dryRun"""
+    result = subprocess.run(
+        [binary, "-dryRun", f"-promscrape.config={config_path}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode == 0:
+        return []
+    output = (result.stderr or result.stdout).strip()
+    return [f"{binary} -dryRun failed: {output}"]
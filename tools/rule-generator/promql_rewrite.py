@@ -0,0 +1,246 @@
+"""
+Recording rule candidates in PromQL expressions and their rewrites
+
+Two shapes are recognized, each with a literal range window (dashboard
+`$__rate_interval` is evaluated with a fixed window instead):
+
+* a sum, count, min or max of a range function over a selector,
+  `sum by (mode) (rate(metric{...}[5m]))`
+* a ratio joined on labels, `rate(a[5m]) / on(instance, device) b`
+
+A range function on its own, `rate(metric[5m])`, is not recorded: its
+result has as many series as the raw metric, so recording it would only
+add the same number of series again every evaluation.
+
+Label matchers of the selector, templated or not, move out of the recorded
+expression into a filter on the recorded series, and for aggregations their
+labels are added to the `by` clause. Panels that only differ by a filter
+therefore share one rule, e.g. every `mode` of `node_cpu_seconds_total`.
+An aggregation is re-applied on top of the filtered recorded series, which
+is exact for sum, min and max, and for count when re-aggregated as sum.
+"""
+
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from grafana_queries import AGGREGATIONS as PROMQL_AGGREGATIONS
+from grafana_queries import KEYWORDS, selectors
+
+RANGE_FUNCTIONS = (
+    "rate",
+    "irate",
+    "increase",
+    "delta",
+    "idelta",
+    "deriv",
+    "avg_over_time",
+    "min_over_time",
+    "max_over_time",
+    "sum_over_time",
+    "count_over_time",
+    "last_over_time",
+)
+# Functions whose result is per second or a change of a counter, `_total` is dropped from the rule name
+COUNTER_FUNCTIONS = ("rate", "irate", "increase")
+# Aggregation and the aggregation that combines its partial results again
+AGGREGATIONS = {"sum": "sum", "count": "sum", "min": "min", "max": "max"}
+
+_NAME = r"[a-zA-Z_:][a-zA-Z0-9_:]*"
+
+
+def _selector(prefix: str = "") -> str:
+    return rf"(?P<{prefix}metric>{_NAME})(?:\s*(?P<{prefix}matchers>\{{[^{{}}]*\}}))?"
+
+
+def _range_call() -> str:
+    return (
+        rf"\b(?P<fn>{'|'.join(RANGE_FUNCTIONS)})\s*\(\s*"
+        + _selector()
+        + r"\s*\[(?P<window>[^\]]+)\]\s*\)"
+    )
+
+
+AGGREGATED_CALL = re.compile(
+    rf"\b(?P<agg>{'|'.join(AGGREGATIONS)})\s*(?:by\s*\((?P<by1>[^)]*)\)\s*)?\(\s*"
+    + _range_call()
+    + r"\s*\)(?:\s*by\s*\((?P<by2>[^)]*)\))?"
+)
+# The divisor has to be a whole selector, not the start of a call or of a `^` that binds tighter
+JOINED_CALL = re.compile(
+    _range_call()
+    + r"\s*/\s*on\s*\((?P<on>[^)]*)\)\s*"
+    + _selector("right_")
+    + r"(?![a-zA-Z0-9_:]|\s*[(\[^])"
+)
+# A `*`, `/`, `%` or `^` (with its modifiers) right before a call makes the call its right operand
+_RIGHT_OPERAND = re.compile(
+    r"[*/%^]\s*(?:bool\s*)?(?:(?:on|ignoring)\s*\([^)]*\)\s*)?"
+    r"(?:(?:group_left|group_right)\s*(?:\([^)]*\)\s*)?)?$"
+)
+
+Matcher = Tuple[str, str, str]
+
+
+class Candidate(NamedTuple):
+    """A recordable part of an expression, `span` is its position in the expression"""
+
+    kind: str
+    span: Tuple[int, int]
+    rule_expr: str
+    # Name stem of the rule, completed by `RuleSet` so names stay unique
+    level: str
+    metric: str
+    operation: str
+    # Applied to the rule series: the filter and the aggregation to re-apply
+    filters: Tuple[Matcher, ...]
+    reaggregation: Optional[str]
+    by: Tuple[str, ...]
+
+
+def quote(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def render_matchers(matchers) -> str:
+    return ", ".join(f"{label}{op}{quote(value)}" for label, op, value in matchers)
+
+
+def _matchers(text: Optional[str]) -> Tuple[Matcher, ...]:
+    if not text:
+        return ()
+    return selectors("x" + text)[0].matchers
+
+
+def _window(window: str, rate_window: str) -> Optional[str]:
+    """Literal window of a recording rule, None when it depends on the dashboard range"""
+    window = window.strip()
+    if window == "$__rate_interval":
+        return rate_window
+    if re.fullmatch(r"\d+(ms|s|m|h|d|w|y)", window):
+        return window
+    return None
+
+
+def _templated(matchers) -> bool:
+    return any("$" in value or "[[" in value for _, _, value in matchers)
+
+
+def _metric_stem(metric: str, fn: str) -> str:
+    if fn in COUNTER_FUNCTIONS and metric.endswith("_total"):
+        return metric[: -len("_total")]
+    return metric
+
+
+def _labels(text: Optional[str]) -> Tuple[str, ...]:
+    return tuple(label.strip() for label in (text or "").split(",") if label.strip())
+
+
+def _aggregated_candidate(match: "re.Match", rate_window: str) -> Optional[Candidate]:
+    window = _window(match.group("window"), rate_window)
+    if window is None:
+        return None
+    agg = match.group("agg")
+    by = _labels(match.group("by1")) or _labels(match.group("by2"))
+    filters = _matchers(match.group("matchers"))
+    recorded_by = tuple(sorted(set(by) | {label for label, _, _ in filters}))
+    if not recorded_by:
+        return None
+
+    fn = match.group("fn")
+    metric = match.group("metric")
+    return Candidate(
+        "aggregation",
+        match.span(),
+        f"{agg} by ({', '.join(recorded_by)}) ({fn}({metric}[{window}]))",
+        "_".join(recorded_by),
+        _metric_stem(metric, fn),
+        f"{fn}{window}" if agg == "sum" else f"{agg}_{fn}{window}",
+        filters,
+        AGGREGATIONS[agg],
+        by,
+    )
+
+
+def _joined_candidate(expr: str, match: "re.Match", rate_window: str) -> Optional[Candidate]:
+    window = _window(match.group("window"), rate_window)
+    left = _matchers(match.group("matchers"))
+    right = _matchers(match.group("right_matchers"))
+    on = _labels(match.group("on"))
+    if window is None or not on or _templated(left) or _templated(right):
+        return None
+
+    fn = match.group("fn")
+    metric = match.group("metric")
+    right_metric = match.group("right_metric")
+    if right_metric in KEYWORDS or right_metric in PROMQL_AGGREGATIONS:
+        return None
+    # In `x / rate(a) / on(...) b` the ratio is `(x / rate(a)) / b`, not `x / (rate(a) / b)`
+    if _RIGHT_OPERAND.search(expr[: match.start()]):
+        return None
+    left_selector = metric + (f"{{{render_matchers(left)}}}" if left else "")
+    right_selector = right_metric + (f"{{{render_matchers(right)}}}" if right else "")
+
+    stem = _metric_stem(metric, fn)
+    # Drop the prefix both metrics share from the name of the divisor
+    common = 0
+    for a, b in zip(stem.split("_"), right_metric.split("_")):
+        if a != b:
+            break
+        common += 1
+    divisor = "_".join(right_metric.split("_")[common:]) or right_metric
+
+    return Candidate(
+        "join",
+        match.span(),
+        f"{fn}({left_selector}[{window}]) / on({', '.join(on)}) {right_selector}",
+        "_".join(on),
+        f"{stem}_per_{divisor}",
+        f"{fn}{window}",
+        (),
+        None,
+        (),
+    )
+
+
+def candidates(expr: str, rate_window: str) -> List[Candidate]:
+    """Non-overlapping candidates of an expression, joins first"""
+    found: List[Candidate] = []
+    taken: List[Tuple[int, int]] = []
+
+    def free(span) -> bool:
+        return all(span[1] <= start or span[0] >= end for start, end in taken)
+
+    for match in JOINED_CALL.finditer(expr):
+        candidate = _joined_candidate(expr, match, rate_window)
+        if candidate is not None and free(candidate.span):
+            found.append(candidate)
+            taken.append(candidate.span)
+    for match in AGGREGATED_CALL.finditer(expr):
+        candidate = _aggregated_candidate(match, rate_window)
+        if candidate is not None and free(candidate.span):
+            found.append(candidate)
+            taken.append(candidate.span)
+    return sorted(found, key=lambda candidate: candidate.span)
+
+
+def replacement(candidate: Candidate, record: str) -> str:
+    """Expression reading the recorded series instead of computing `candidate`"""
+    selector = record
+    if candidate.filters:
+        selector += "{" + render_matchers(candidate.filters) + "}"
+    if candidate.reaggregation is None:
+        return selector
+    by = f" by ({', '.join(candidate.by)})" if candidate.by else ""
+    return f"{candidate.reaggregation}{by} ({selector})"
+
+
+def rewrite(expr: str, names: Dict[str, str], rate_window: str) -> str:
+    """Replace every candidate of `expr` whose rule expression has a name in `names`"""
+    result = expr
+    for candidate in reversed(candidates(expr, rate_window)):
+        record = names.get(candidate.rule_expr)
+        if record is None:
+            continue
+        start, end = candidate.span
+        result = result[:start] + replacement(candidate, record) + result[end:]
+    return result
@@ -0,0 +1,253 @@
+"""
+Recording rules for the repeated and expensive queries of the stack
+
+Scans the provisioned dashboards and alert rules for recordable PromQL (see
+promql_rewrite), keeps the parts that are used by several queries or join
+two metrics, and writes them as a vmalert recording rules file. Variants of
+the dashboards and of the alert rules that read the recorded series are
+written next to it, to be copied into the Grafana provisioning folders once
+vmalert has recorded enough history.
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+from typing import Any, Dict, List, NamedTuple, Set, Tuple
+
+import yaml
+from grafana_queries import Query, dashboard_files, load_queries, panel_targets
+from promql_rewrite import Candidate, candidates, rewrite
+
+HEADER = """\
+# Generated by tools/rule-generator/rule_generator.py from the provisioned
+# dashboards and alert rules, regenerate it instead of editing it by hand.
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "rule-generator",
+        description="Generate vmalert recording rules for repeated and expensive queries",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--dashboards-path",
+        dest="dashboards_path",
+        default="config/grafana/provisioning/dashboards",
+        help="Directory with the provisioned dashboards",
+    )
+
+    parser.add_argument(
+        "--alerts-path",
+        dest="alerts_path",
+        default="config/grafana/provisioning/alerting/alerts.yaml",
+        help="Alert rules file",
+    )
+
+    parser.add_argument(
+        "--rules-output",
+        dest="rules_output",
+        default="config/vmalert/rules/recording-rules.yaml",
+        help="Path of the generated recording rules",
+    )
+
+    parser.add_argument(
+        "--variants-path",
+        dest="variants_path",
+        default="config/vmalert/variants",
+        help="Directory the dashboards and alert rules reading the recorded series are written to",
+    )
+
+    parser.add_argument(
+        "--rate-window",
+        dest="rate_window",
+        default="5m",
+        help="Window recorded for dashboard queries using $__rate_interval",
+    )
+
+    parser.add_argument(
+        "--min-uses",
+        dest="min_uses",
+        type=int,
+        default=2,
+        help="Queries that have to share an expression before it is recorded, joins are always recorded",
+    )
+
+    parser.add_argument(
+        "--interval",
+        default="1m",
+        help="Evaluation interval of the recording rules",
+    )
+
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Only check that the rules file is up to date with the dashboards and alerts",
+    )
+
+    return parser.parse_args()
+
+
+class Rule(NamedTuple):
+    record: str
+    expr: str
+    kind: str
+    uses: int
+    sources: Set[str]
+
+
+def collect(queries: List[Query], rate_window: str) -> Dict[str, List[Tuple[Candidate, str]]]:
+    """Candidates of all queries and the file they come from, grouped by rule expression"""
+    found: Dict[str, List[Tuple[Candidate, str]]] = {}
+    for query in queries:
+        for candidate in candidates(query.expr, rate_window):
+            found.setdefault(candidate.rule_expr, []).append(
+                (candidate, os.path.basename(query.source))
+            )
+    return found
+
+
+def select_rules(queries: List[Query], rate_window: str, min_uses: int) -> List[Rule]:
+    """Rules for the candidates that are shared or join two metrics, with unique names"""
+    rules: List[Rule] = []
+    names: Set[str] = set()
+    grouped = collect(queries, rate_window)
+    for expr in sorted(grouped):
+        uses = grouped[expr]
+        first = uses[0][0]
+        if len(uses) < min_uses and first.kind != "join":
+            continue
+
+        record = f"{first.level}:{first.metric}:{first.operation}"
+        suffix = 2
+        while record in names:
+            record = f"{first.level}:{first.metric}:{first.operation}_{suffix}"
+            suffix += 1
+        names.add(record)
+        rules.append(Rule(record, expr, first.kind, len(uses), {source for _, source in uses}))
+    return sorted(rules, key=lambda rule: rule.record)
+
+
+def render_rules(rules: List[Rule], interval: str) -> str:
+    groups = {
+        "groups": [
+            {
+                "name": "recording-rules",
+                "interval": interval,
+                "rules": [{"record": rule.record, "expr": rule.expr} for rule in rules],
+            }
+        ]
+    }
+    return HEADER + yaml.safe_dump(groups, sort_keys=False, width=1000)
+
+
+def _indent(path: str) -> int:
+    """Indentation of a JSON file, so rewritten dashboards diff cleanly against the original"""
+    with open(path, "r") as f:
+        f.readline()
+        line = f.readline()
+    return (len(line) - len(line.lstrip(" "))) or 2
+
+
+def dashboard_variant(path: str, names: Dict[str, str], rate_window: str) -> Any:
+    """The dashboard reading recorded series, None when no query changes"""
+    with open(path, "r") as f:
+        dashboard = json.load(f)
+
+    changed = 0
+    for _, target in panel_targets(dashboard):
+        expr = rewrite(target["expr"], names, rate_window)
+        if expr != target["expr"]:
+            target["expr"] = expr
+            changed += 1
+    if not changed:
+        return None
+
+    # A different uid and title let the variant be provisioned next to the original
+    if dashboard.get("uid"):
+        dashboard["uid"] = f"{dashboard['uid']}-rec"[:40]
+    dashboard["title"] = f"{dashboard.get('title', '')} (recording rules)"
+    return dashboard
+
+
+def alerts_variant(path: str, names: Dict[str, str], rate_window: str) -> Any:
+    """The alert rules reading recorded series, None when no query changes"""
+    with open(path, "r") as f:
+        provisioning = yaml.safe_load(f) or {}
+
+    variant = copy.deepcopy(provisioning)
+    changed = 0
+    for group in variant.get("groups", []):
+        for rule in group.get("rules", []):
+            for data in rule.get("data", []):
+                model = data.get("model", {})
+                if data.get("datasourceUid") == "__expr__" or not model.get("expr"):
+                    continue
+                expr = rewrite(model["expr"], names, rate_window)
+                if expr != model["expr"]:
+                    model["expr"] = expr
+                    changed += 1
+    return variant if changed else None
+
+
+def write_variants(args: argparse.Namespace, names: Dict[str, str]) -> List[str]:
+    written = []
+    for path in dashboard_files(args.dashboards_path):
+        dashboard = dashboard_variant(path, names, args.rate_window)
+        if dashboard is None:
+            continue
+        output = os.path.join(
+            args.variants_path, "dashboards", os.path.relpath(path, args.dashboards_path)
+        )
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(dashboard, f, indent=_indent(path), ensure_ascii=False)
+            f.write("\n")
+        written.append(output)
+
+    if os.path.exists(args.alerts_path):
+        alerts = alerts_variant(args.alerts_path, names, args.rate_window)
+        if alerts is not None:
+            output = os.path.join(args.variants_path, "alerting", os.path.basename(args.alerts_path))
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            with open(output, "w") as f:
+                yaml.safe_dump(alerts, f, sort_keys=False, width=1000)
+            written.append(output)
+    return written
+
+
+def main():
+    args = parse_args()
+
+    queries = load_queries(args.dashboards_path, args.alerts_path)
+    rules = select_rules(queries, args.rate_window, args.min_uses)
+    text = render_rules(rules, args.interval)
+
+    if args.check:
+        try:
+            with open(args.rules_output, "r") as f:
+                current = f.read()
+        except FileNotFoundError:
+            current = None
+        if current != text:
+            sys.exit(f"{args.rules_output} is out of date, run {sys.argv[0]} without --check")
+        print(f"{args.rules_output} is up to date ({len(rules)} rules)")
+        return
+
+    os.makedirs(os.path.dirname(args.rules_output) or ".", exist_ok=True)
+    with open(args.rules_output, "w") as f:
+        f.write(text)
+    print(f"Wrote {len(rules)} recording rules to {args.rules_output}")
+    for rule in rules:
+        print(f"  {rule.uses:>3} uses in {', '.join(sorted(rule.sources))}: {rule.record}")
+
+    names = {rule.expr: rule.record for rule in rules}
+    for path in write_variants(args, names):
+        print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
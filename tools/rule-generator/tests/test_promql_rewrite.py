@@ -0,0 +1,46 @@
+from promql_rewrite import candidates, rewrite
+
+JOIN = "rate(a_total[5m]) / on(instance) b"
+NAMES = {JOIN: "R"}
+
+
+def joins(expr):
+    return [c for c in candidates(expr, "5m") if c.kind == "join"]
+
+
+def test_join_is_rewritten():
+    assert rewrite("rate(a_total[5m]) / on(instance) b > 1", NAMES, "5m") == "R > 1"
+
+
+def test_join_rejects_group_modifier_as_divisor():
+    expr = "rate(a_total[5m]) / on(instance) group_left max(b)"
+    assert joins(expr) == []
+    assert rewrite(expr, NAMES, "5m") == expr
+
+
+def test_join_rejects_call_as_divisor():
+    expr = "rate(a_total[5m]) / on(instance) max(b)"
+    assert joins(expr) == []
+    assert rewrite(expr, NAMES, "5m") == expr
+
+
+def test_join_rejects_right_operand_of_division():
+    expr = "x / rate(a_total[5m]) / on(instance) b"
+    assert joins(expr) == []
+    assert rewrite(expr, NAMES, "5m") == expr
+
+
+def test_unaggregated_range_call_is_not_recorded():
+    assert candidates('rate(node_cpu_seconds_total{mode="idle"}[5m])', "5m") == []
+
+
+def test_aggregation_is_named_after_kept_labels():
+    (candidate,) = candidates('sum by (instance) (rate(node_cpu_seconds_total{mode="idle"}[5m]))', "5m")
+    assert candidate.rule_expr == "sum by (instance, mode) (rate(node_cpu_seconds_total[5m]))"
+    assert candidate.level == "instance_mode"
+    rewritten = rewrite(
+        'sum by (instance) (rate(node_cpu_seconds_total{mode="idle"}[5m]))',
+        {candidate.rule_expr: "instance_mode:node_cpu_seconds:rate5m"},
+        "5m",
+    )
+    assert rewritten == 'sum by (instance) (instance_mode:node_cpu_seconds:rate5m{mode="idle"})'